@@ -1,15 +1,37 @@
 import os
 import json
+import signal
+import asyncio
 import subprocess
 import uvicorn
-import random
+import httpx
 import datetime
 import socket
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Union, Callable
 import traceback
 import shlex
+import sys
+import time
+import fcntl
+import shutil
+import hashlib
+import sqlite3
+import bisect
+import math
+import functools
+import threading
+import collections
+import urllib.parse
+import urllib.request
+import concurrent.futures
+import multiprocessing
+import tempfile
+from types import MappingProxyType
+from media import MEDIA_REF_PREFIX, detect_mime, media_hash, prepare_media, to_data_url
 
 # Initialize FastAPI app
 app = FastAPI(title="Swift Model Deployment API")
@@ -20,12 +42,47 @@ with open("models_config.json", "r") as f:
 
 class DeployRequest(BaseModel):
     model_id: str
-    gpu_id: int = 0
+    gpu_id: Union[int, str] = 0  # GPU index, or "auto" for scheduler placement
     max_model_len: Optional[int] = None
     vision_batch_size: Optional[int] = None
     gpu_memory_utilization: float = 0.9
     port: Optional[int] = None  # Make port optional
     isolate_env: bool = True    # New parameter to request isolated environment
+    replicas: int = 1           # Number of copies of the model to run
+    gpu_ids: Optional[List[int]] = None  # GPU per replica, overrides gpu_id + index
+    tensor_parallel_size: int = 1  # GPUs per replica
+    on_no_capacity: str = "reject"  # "reject" or "queue" when auto placement does not fit
+    queue_timeout: float = 1800.0   # Seconds a queued replica waits for GPU capacity
+    idle_timeout: Optional[float] = None  # Seconds without requests before scaling to zero (0 = never)
+    always_warm: bool = False       # Never scale this model to zero
+    max_in_flight: Optional[int] = None  # Gateway requests let through at once (0 = unlimited)
+    node: Optional[str] = None      # Coordinator only: node_id to deploy on instead of placing automatically
+
+class WarmMetadataRequest(BaseModel):
+    model_ids: Optional[List[str]] = None  # Defaults to the whole catalog
+    refresh: bool = False  # Re-fetch entries that are already cached
+
+class PrebuildEnvsRequest(BaseModel):
+    model_ids: Optional[List[str]] = None  # Defaults to the whole catalog
+    download: bool = True  # Fill the wheelhouse before building
+    workers: Optional[int] = None  # Defaults to POLARIS_PREBUILD_WORKERS
+
+class PrefetchRequest(BaseModel):
+    model_ids: List[str]
+
+class PruneWeightsRequest(BaseModel):
+    max_bytes: Optional[int] = None  # Disk budget; defaults to POLARIS_WEIGHT_CACHE_MAX_BYTES
+
+class PruneEnvsRequest(BaseModel):
+    max_bytes: Optional[int] = None  # Disk budget; defaults to POLARIS_ENV_CACHE_MAX_BYTES
+    unused_for_seconds: Optional[int] = None  # Also drop envs idle for longer than this
+
+class NodeHeartbeat(BaseModel):
+    node_id: str
+    url: str  # Where the coordinator reaches the agent's API
+    gpus: Dict[str, Any] = {}  # The agent's /gpus
+    ports: Dict[str, Any] = {}  # The agent's /ports
+    deployments: List[Dict[str, Any]] = []  # The agent's /deployments
 
 class DeploymentStatus(BaseModel):
     status: str
@@ -33,595 +90,4855 @@ class DeploymentStatus(BaseModel):
     deployment_command: str
     log_file: str
     port: int
-    gpu_id: int
+    gpu_id: Optional[int] = None
+    gpu_ids: Optional[List[int]] = None
     env_path: Optional[str] = None
+    replica_id: Optional[str] = None
+    replicas: List[Dict[str, Any]] = []
+    requested_replicas: Optional[int] = None
+    message: Optional[str] = None  # Why fewer replicas than requested were started
+    node_id: Optional[str] = None
 
-# Track deployments
+# Track deployments by replica_id, and the replica_ids of each model. Both are only changed on the
+# event loop; deploys, stops and scale-downs of one model are serialized by its lock in deploy_locks.
 active_deployments = {}
+replica_groups = {}
+deploy_locks = {}
+
+# /deployments is served from a serialized snapshot that one task rebuilds when the registry changes
+DEPLOYMENTS_SNAPSHOT_INTERVAL = float(os.environ.get("POLARIS_SNAPSHOT_INTERVAL", 1.0))
+
+# GPU placement
+GPU_PROBE = os.environ.get("POLARIS_GPU_PROBE", "nvidia-smi")
+GPU_QUEUE_POLL_INTERVAL = 15.0
+
+# Model server launcher: "swift", or "stub" to run stub_server.py instead (no GPU or weights; for testing)
+DEPLOY_LAUNCHER = os.environ.get("POLARIS_LAUNCHER", "swift")
+STUB_SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_server.py")
+
+# Model metadata (max length etc.) cached on the shared ~/.cache volume
+METADATA_CACHE_DIR = os.environ.get("POLARIS_METADATA_CACHE", os.path.expanduser("~/.cache/polaris/metadata"))
+METADATA_FETCH_TIMEOUT = 10.0
+METADATA_WARM_WORKERS = 8
+
+# Model weight prefetch into the shared hub caches, and LRU eviction of cached weights
+PREFETCH_WORKERS = int(os.environ.get("POLARIS_PREFETCH_WORKERS", 4))
+PREFETCH_ON_DEPLOY = os.environ.get("POLARIS_PREFETCH_ON_DEPLOY", "1") == "1"
+PREFETCH_RETRIES = 3
+PREFETCH_IGNORE_PATTERNS = ["*.zip", "*.gguf", "*.pth", "*.pt", "consolidated*", "onnx/*", "*.msgpack",
+                            "*.onnx", "*.ot", "*.h5"]
+WEIGHT_CACHE_MAX_BYTES = int(os.environ.get("POLARIS_WEIGHT_CACHE_MAX_BYTES", 500 * 1024 ** 3))
+prefetch_jobs = {}
+prefetch_slots = threading.BoundedSemaphore(PREFETCH_WORKERS)
+
+# Deployment log tailing (the model server writes the file, the API reads it back)
+LOG_CHUNK_SIZE = 64 * 1024
+LOG_BUFFER_SIZE = 256 * 1024
+LOG_POLL_INTERVAL = 0.25
+open_deployment_logs = set()
+
+# Deployment log ring buffer and size-based rotation
+LOG_RING_LINES = 2000
+LOG_MAX_BYTES = int(os.environ.get("POLARIS_LOG_MAX_BYTES", 64 * 1024 ** 2))
+LOG_BACKUP_COUNT = int(os.environ.get("POLARIS_LOG_BACKUP_COUNT", 5))
+LOG_FOLLOW_QUEUE_SIZE = 1000
+LOG_KEEPALIVE_INTERVAL = 15.0
+LOG_RELAY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_relay.py")
+
+# Deployment lifecycle and readiness probing
+SETTLED_STATES = ("ready", "failed", "completed", "stopped")
+LOADING_MARKERS = (b"loading the model using model_dir", b"loading checkpoint", b"loading model weights",
+                   b"loading safetensors", b"init engine")
+READINESS_INITIAL_DELAY = 0.5
+READINESS_MAX_DELAY = 10.0
+HEALTH_CHECK_INTERVAL = 15.0
+HEALTH_CHECK_FAILURES = 3
+MAX_WAIT_TIMEOUT = 600.0
+# Timeline spans that follow lifecycle states, which are driven by process output and probes
+STATE_SPANS = {"queued": "gpu_placement", "downloading": "weight_download", "loading": "weight_load"}
+TIMELINE_HISTORY_LIMIT = 50
+
+# OpenAI-compatible gateway with one keep-alive pool per model server port
+GATEWAY_CONNECT_TIMEOUT = 10.0
+GATEWAY_MAX_CONNECTIONS = int(os.environ.get("POLARIS_GATEWAY_MAX_CONNECTIONS", 64))
+GATEWAY_EJECT_SECONDS = float(os.environ.get("POLARIS_GATEWAY_EJECT_SECONDS", 30))
+upstream_clients = {}
+# "least-loaded", or "prefix-affinity" to keep requests sharing a prompt prefix on one replica
+GATEWAY_ROUTING = os.environ.get("POLARIS_GATEWAY_ROUTING", "least-loaded")
+AFFINITY_PREFIX_CHARS = int(os.environ.get("POLARIS_AFFINITY_PREFIX_CHARS", 4096))
+AFFINITY_VIRTUAL_NODES = 64
+# The affinity target is skipped once it holds this much more than its share of in-flight requests
+AFFINITY_LOAD_FACTOR = float(os.environ.get("POLARIS_AFFINITY_LOAD_FACTOR", 1.5))
+AFFINITY_MIN_LOAD = int(os.environ.get("POLARIS_AFFINITY_MIN_LOAD", 4))
+# Idle scale-to-zero: stop models nobody is using and redeploy them on the next request
+IDLE_TIMEOUT = float(os.environ.get("POLARIS_IDLE_TIMEOUT", 0))  # default for deploys that set none; 0 = off
+IDLE_CHECK_INTERVAL = float(os.environ.get("POLARIS_IDLE_CHECK_INTERVAL", 15))
+ALWAYS_WARM_MODELS = {m.strip() for m in os.environ.get("POLARIS_ALWAYS_WARM", "").split(",") if m.strip()}
+COLD_START_TIMEOUT = float(os.environ.get("POLARIS_COLD_START_TIMEOUT", 900))
+COLD_START_QUEUE_SIZE = int(os.environ.get("POLARIS_COLD_START_QUEUE_SIZE", 64))
+STARTING_STATES = ("queued", "deploying", "building_env", "downloading", "loading")
+parked_models = {}
+warming_waiters = collections.Counter()
+cold_start_stats = {}
+# Admission control: per-model in-flight limit with bounded priority queues in front of it
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("POLARIS_MAX_IN_FLIGHT", 0))  # default per model; 0 = unlimited
+ADMISSION_PRIORITIES = ("interactive", "batch")  # served strictly in this order
+ADMISSION_QUEUE_SIZES = {
+    "interactive": int(os.environ.get("POLARIS_QUEUE_SIZE_INTERACTIVE", 64)),
+    "batch": int(os.environ.get("POLARIS_QUEUE_SIZE_BATCH", 256))
+}
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("POLARIS_QUEUE_TIMEOUT", 60))
+admission_controllers = {}
+# Optional cache of deterministic gateway responses, with in-flight request coalescing
+RESPONSE_CACHE_ENABLED = os.environ.get("POLARIS_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("POLARIS_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("POLARIS_RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 ** 2))
+RESPONSE_CACHE_TTL = float(os.environ.get("POLARIS_RESPONSE_CACHE_TTL", 600))
+RESPONSE_CACHE_IGNORED_FIELDS = ("model", "stream", "stream_options", "user")
+inflight_requests = {}
+probe_client = httpx.AsyncClient(timeout=httpx.Timeout(5.0), limits=httpx.Limits(max_keepalive_connections=16))
+
+# Durable deployment records, used to re-attach to model servers after an API restart
+STATE_DB_PATH = os.environ.get("POLARIS_STATE_DB", "/app/state/polaris_state.db")
+ATTACHED_POLL_INTERVAL = 1.0
+
+# Shared virtual environment cache, keyed by requirement set
+ENVS_DIR = os.environ.get("POLARIS_ENVS_DIR", "/app/envs")
+ENV_CACHE_MAX_BYTES = int(os.environ.get("POLARIS_ENV_CACHE_MAX_BYTES", 50 * 1024 ** 3))
+ENV_METADATA_FILE = ".polaris_env.json"
+
+# Environment builder backend and the local wheelhouse it installs from
+ENV_BUILDER = os.environ.get("POLARIS_ENV_BUILDER", "auto")  # pip, uv, or auto (uv when installed)
+WHEELHOUSE_DIR = os.environ.get("POLARIS_WHEELHOUSE", "/app/wheelhouse")
+ENV_OFFLINE = os.environ.get("POLARIS_ENV_OFFLINE") == "1"  # Never fall back to the package index
+PREBUILD_WORKERS = int(os.environ.get("POLARIS_PREBUILD_WORKERS", 4))
+
+# Uploaded media, stored by content hash and referenced from prompts as media://<sha256>
+MEDIA_DIR = os.environ.get("POLARIS_MEDIA_DIR", "/app/media")
+MEDIA_MAX_BYTES = int(os.environ.get("POLARIS_MEDIA_MAX_BYTES", 2 * 1024 ** 3))
+MEDIA_MAX_UPLOAD_BYTES = int(os.environ.get("POLARIS_MEDIA_MAX_UPLOAD_BYTES", 64 * 1024 ** 2))
+MEDIA_PART_TYPES = ("image_url", "audio_url", "video_url")
+media_lock = threading.Lock()
+
+# Port pool for model servers; matches the range published in docker-compose.yml
+MIN_PORT = int(os.environ.get("POLARIS_MIN_PORT", 8001))
+MAX_PORT = int(os.environ.get("POLARIS_MAX_PORT", 8099))
+
+# Multi-node mode. An agent runs models like a standalone server and reports its GPUs, ports and
+# deployments to the coordinator, which runs no models itself: it places deploys on agents, aggregates
+# their state and routes gateway requests to them.
+NODE_ROLE = os.environ.get("POLARIS_ROLE", "standalone")  # standalone, agent or coordinator
+API_PORT = int(os.environ.get("POLARIS_API_PORT", 1009))
+COORDINATOR_URL = os.environ.get("POLARIS_COORDINATOR_URL", "").rstrip("/")
+NODE_ID = os.environ.get("POLARIS_NODE_ID") or socket.gethostname()
+NODE_URL = (os.environ.get("POLARIS_NODE_URL") or f"http://{socket.gethostname()}:{API_PORT}").rstrip("/")
+NODE_HEARTBEAT_INTERVAL = float(os.environ.get("POLARIS_HEARTBEAT_INTERVAL", 5))
+NODE_TIMEOUT = float(os.environ.get("POLARIS_NODE_TIMEOUT", 3 * NODE_HEARTBEAT_INTERVAL))  # then a node is lost
+NODE_REQUEST_TIMEOUT = 30.0
+FORWARDED_HEADERS = ("content-type", "content-encoding", "cache-control", "retry-after", "etag", "x-accel-buffering")
+cluster_nodes = {}  # node_id -> state last reported by that agent (coordinator only)
+cluster_deploy_lock = asyncio.Lock()
+cluster_client = httpx.AsyncClient(timeout=httpx.Timeout(NODE_REQUEST_TIMEOUT, connect=5.0),
+                                   limits=httpx.Limits(max_connections=GATEWAY_MAX_CONNECTIONS))
+
+# Control-plane metrics, served at /metrics in the Prometheus text format
+METRICS_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+metrics_registry = []
+
+def format_metric_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+def format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """Monotonic in-process counter, optionally labelled."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{format_metric_labels(self.labelnames, key)} {format_metric_value(value)}"
+                for key, value in items]
+
+class Histogram:
+    """In-process histogram with fixed buckets, optionally labelled.
+
+    Observations only bump one bucket; buckets are made cumulative at scrape time.
+    """
 
-# Port range for model servers
-MIN_PORT = 8001
-MAX_PORT = 9999  # Expanded port range
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        labelnames = self.labelnames + ("le",)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else format_metric_value(bound)
+                lines.append(f"{self.name}_bucket{format_metric_labels(labelnames, key + (le,))} {cumulative}")
+            labels = format_metric_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_metric_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """Gauge whose samples are computed from live state at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...], collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect = collect  # () -> iterable of (label values, value)
+        metrics_registry.append(self)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_metric_labels(self.labelnames, tuple(str(v) for v in key))} "
+                f"{format_metric_value(value)}" for key, value in self.collect()]
+
+def render_metrics() -> str:
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        try:
+            lines.extend(metric.samples())
+        except Exception as e:
+            print(f"Error collecting metric {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+deploy_attempts = Counter("polaris_deploy_attempts_total", "Replica deployments started", ("model_id",))
+deploy_failures = Counter("polaris_deploy_failures_total",
+                          "Replica deployments that failed, by the state they failed in", ("model_id", "phase"))
+deploy_time_to_ready = Histogram("polaris_deploy_time_to_ready_seconds",
+                                 "Time from deploy request until a replica first became ready", ("model_id",))
+deploy_phase_seconds = Histogram("polaris_deploy_phase_seconds",
+                                 "Time replicas spent in a lifecycle state before leaving it", ("phase",))
+venv_requests = Counter("polaris_venv_requests_total", "Virtual environment lookups by cache result", ("result",))
+venv_build_seconds = Histogram("polaris_venv_build_seconds", "Time to build a virtual environment from scratch")
+pip_install_seconds = Histogram("polaris_pip_install_seconds",
+                                "Time spent in pip install while building environments", ("step",))
+model_max_length_seconds = Histogram("polaris_model_max_length_seconds",
+                                     "get_model_max_length latency by where the answer came from", ("source",))
+port_allocation_seconds = Histogram("polaris_port_allocation_seconds", "find_available_port latency", ("outcome",))
+cold_start_seconds = Histogram("polaris_cold_start_seconds",
+                               "Time from a request for a scaled-to-zero model until it is ready", ("model_id",))
+cold_start_rejections = Counter("polaris_cold_start_rejections_total",
+                                "Requests refused while a model was starting", ("model_id", "reason"))
+admission_wait_seconds = Histogram("polaris_admission_wait_seconds",
+                                   "Time gateway requests spent queued for an in-flight slot",
+                                   ("model_id", "priority"))
+admission_rejections = Counter("polaris_admission_rejections_total",
+                               "Gateway requests refused by admission control", ("model_id", "priority", "reason"))
+gateway_routing = Counter("polaris_gateway_affinity_routing_total",
+                          "Prefix-affinity routing decisions (affinity target used, or spilled for load)",
+                          ("result",))
+gateway_cache_requests = Counter("polaris_gateway_cache_requests_total",
+                                 "Gateway requests by response cache outcome", ("result",))
+http_requests = Counter("polaris_http_requests_total", "HTTP requests handled by the API",
+                        ("method", "route", "status"))
+http_request_seconds = Histogram("polaris_http_request_duration_seconds",
+                                 "HTTP request latency until the response body is complete", ("method", "route"))
 
 def is_port_in_use(port):
-    """Check if a port is in use on the system."""
+    """Check if a port is in use on the system by trying to bind it."""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('localhost', port)) == 0
+        # Match the server's own bind semantics so TIME_WAIT sockets don't count
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("0.0.0.0", port))
+        except OSError:
+            return True
+        return False
+
+class PortAllocator:
+    """Pool of model server ports with O(1) reserve and release.
+
+    A bitmap records which ports in the pool are reserved and a queue holds
+    candidate free ports. Ports are reserved atomically at request time and
+    only become available again once released.
+    """
+
+    def __init__(self, min_port: int, max_port: int):
+        if min_port > max_port:
+            raise ValueError(f"Invalid port range {min_port}-{max_port}")
+        self.min_port = min_port
+        self.max_port = max_port
+        self._reserved = bytearray(max_port - min_port + 1)
+        self._reserved_count = 0
+        self._free = collections.deque(range(min_port, max_port + 1))
+        self._external = set()  # Requested ports outside the pool
+        self._lock = threading.Lock()
+
+    def _in_pool(self, port: int) -> bool:
+        return self.min_port <= port <= self.max_port
+
+    def _mark(self, port: int) -> None:
+        self._reserved[port - self.min_port] = 1
+        self._reserved_count += 1
+
+    def is_reserved(self, port: int) -> bool:
+        if self._in_pool(port):
+            return bool(self._reserved[port - self.min_port])
+        return port in self._external
+
+    def reserve(self, requested_port: Optional[int] = None) -> int:
+        """Reserve the requested port if it is free, otherwise any free port in the pool.
+
+        Raises:
+            ValueError: If no port in the pool is free
+        """
+        with self._lock:
+            if requested_port:
+                if self.is_reserved(requested_port):
+                    print(f"Port {requested_port} is already in use by another deployment")
+                elif is_port_in_use(requested_port):
+                    print(f"Port {requested_port} is already in use on the system")
+                else:
+                    if self._in_pool(requested_port):
+                        # Its queue entry becomes stale and is skipped when popped
+                        self._mark(requested_port)
+                    else:
+                        self._external.add(requested_port)
+                    return requested_port
+
+            # Ports bound by something outside our control are rotated to the back
+            for _ in range(len(self._free)):
+                port = self._free.popleft()
+                if self._reserved[port - self.min_port]:
+                    continue
+                if is_port_in_use(port):
+                    self._free.append(port)
+                    continue
+                self._mark(port)
+                return port
+
+        # If all ports are used, raise an error
+        raise ValueError(f"No available ports in range {self.min_port}-{self.max_port}. Stop some deployments first.")
+
+    def claim(self, port: int) -> None:
+        """Mark a port as reserved without checking the system, for a server that already holds it."""
+        with self._lock:
+            if self._in_pool(port):
+                if not self._reserved[port - self.min_port]:
+                    self._mark(port)
+            else:
+                self._external.add(port)
+
+    def release(self, port: Optional[int]) -> None:
+        """Return a port to the pool. Releasing an unreserved port is a no-op."""
+        if port is None:
+            return
+        with self._lock:
+            if self._in_pool(port):
+                if self._reserved[port - self.min_port]:
+                    self._reserved[port - self.min_port] = 0
+                    self._reserved_count -= 1
+                    self._free.append(port)
+            else:
+                self._external.discard(port)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self.max_port - self.min_port + 1
+            reserved = [self.min_port + i for i, bit in enumerate(self._reserved) if bit]
+            return {
+                "min_port": self.min_port,
+                "max_port": self.max_port,
+                "size": size,
+                "reserved": self._reserved_count,
+                "free": size - self._reserved_count,
+                "utilization": round(self._reserved_count / size, 4),
+                "reserved_ports": reserved,
+                "external_ports": sorted(self._external)
+            }
+
+port_allocator = PortAllocator(MIN_PORT, MAX_PORT)
 
 def find_available_port(requested_port=None):
-    """Find an available port for a new deployment.
+    """Reserve an available port for a new deployment.
     
     Args:
         requested_port: Optional port number requested by the user
         
     Returns:
-        An available port number
-    """
-    # If user requested a specific port, check if it's available
-    if requested_port:
-        # Check if port is in active deployments
-        for deployment in active_deployments.values():
-            if deployment["port"] == requested_port:
-                print(f"Port {requested_port} is already in use by another deployment")
-                requested_port = None
-                break
-                
-        # Check if port is in use on the system
-        if requested_port and is_port_in_use(requested_port):
-            print(f"Port {requested_port} is already in use on the system")
-            requested_port = None
+        A reserved port number; release it with port_allocator.release()
+    """
+    start = time.perf_counter()
+    try:
+        port = port_allocator.reserve(requested_port)
+    except ValueError:
+        port_allocation_seconds.observe(time.perf_counter() - start, outcome="exhausted")
+        raise
+    port_allocation_seconds.observe(time.perf_counter() - start, outcome="ok")
+    return port
+
+class NvidiaSmiProbe:
+    """GPU probe backed by nvidia-smi"""
+
+    def query(self) -> List[Dict[str, int]]:
+        """Index, total and free memory (MiB) of every visible GPU"""
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index,memory.total,memory.free", "--format=csv,noheader,nounits"],
+            check=True,
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+        gpus = []
+        for line in result.stdout.strip().splitlines():
+            index, total, free = [int(value.strip()) for value in line.split(",")]
+            gpus.append({"index": index, "memory_total": total, "memory_free": free})
+        return gpus
+
+class FakeGpuProbe:
+    """GPU probe reporting a fixed set of idle GPUs, for tests and hosts without nvidia-smi"""
+
+    def __init__(self, memory_mib: List[int]):
+        self.gpus = [{"index": i, "memory_total": m, "memory_free": m} for i, m in enumerate(memory_mib)]
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "FakeGpuProbe":
+        """Build from a spec such as "4x81920" or "24576,24576" (MiB per GPU)"""
+        memory_mib = []
+        for part in spec.split(","):
+            part = part.strip()
+            if "x" in part:
+                count, size = part.split("x", 1)
+                memory_mib.extend([int(size)] * int(count))
+            elif part:
+                memory_mib.append(int(part))
+        return cls(memory_mib)
+
+    def query(self) -> List[Dict[str, int]]:
+        return [dict(gpu) for gpu in self.gpus]
+
+def create_gpu_probe():
+    """GPU probe selected by POLARIS_GPU_PROBE ("nvidia-smi" or "fake")"""
+    if GPU_PROBE == "fake":
+        return FakeGpuProbe.from_spec(os.environ.get("POLARIS_FAKE_GPUS", "1x81920"))
+    return NvidiaSmiProbe()
+
+class GpuScheduler:
+    """Tracks per-GPU memory reservations and places deployments on GPUs.
+
+    Each replica reserves its gpu_memory_utilization fraction on every GPU it
+    runs on. A GPU's available fraction is the smaller of its unreserved share
+    and its free memory as reported by the probe, which also accounts for
+    processes we did not start. Placement is best-fit: the GPUs with the least
+    room that still fit are chosen, keeping large GPUs free for large requests.
+    """
+
+    def __init__(self, probe):
+        self.probe = probe
+        self.reservations = {}  # replica_id -> (gpu_ids, fraction)
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+
+    def reserved_fraction(self, gpu_index: int) -> float:
+        return sum(fraction for gpu_ids, fraction in self.reservations.values() if gpu_index in gpu_ids)
+
+    def reserve(self, replica_id: str, gpu_ids: List[int], fraction: float) -> None:
+        """Reserve explicitly chosen GPUs.
         
-        # Return requested port if it's available
-        if requested_port:
-            return requested_port
-    
-    # Get currently used ports
-    used_ports = set()
-    for deployment in active_deployments.values():
-        used_ports.add(deployment["port"])
-    
-    # Try a random approach first with 10 attempts
-    for _ in range(10):
-        # Pick a random port in our range
-        port = random.randint(MIN_PORT, MAX_PORT)
-        if port not in used_ports and not is_port_in_use(port):
-            return port
-    
-    # If random approach fails, methodically try ports
-    for port in range(MIN_PORT, MAX_PORT + 1):
-        if port not in used_ports and not is_port_in_use(port):
-            return port
-    
-    # If all ports are used, raise an error
-    raise ValueError(f"No available ports in range {MIN_PORT}-{MAX_PORT}. Stop some deployments first.")
-
-def find_model_config(model_id: str) -> Dict[str, Any]:
-    """Find the model configuration by model_id"""
-    # Search in multimodal models
-    for category in models_config["multimodal_models"]:
-        for model in models_config["multimodal_models"][category]:
-            if model["model_id"] == model_id:
-                model["is_multimodal"] = True
-                return model
-    
-    # Search in text only models
-    for category in models_config["text_only_models"]:
-        for model in models_config["text_only_models"][category]:
-            if model["model_id"] == model_id:
-                model["is_multimodal"] = False
-                return model
-    
-    raise ValueError(f"Model {model_id} not found in configuration")
+        Raises:
+            ValueError: If a GPU would be reserved beyond its capacity
+        """
+        for gpu_index in gpu_ids:
+            reserved = self.reserved_fraction(gpu_index)
+            if reserved + fraction > 1.0 + 1e-6:
+                raise ValueError(
+                    f"GPU {gpu_index} has {reserved:.2f} of its memory reserved; "
+                    f"another {fraction:.2f} does not fit. Use gpu_id=\"auto\" or a lower gpu_memory_utilization."
+                )
+        self.reservations[replica_id] = (list(gpu_ids), fraction)
+
+    def claim(self, replica_id: str, gpu_ids: List[int], fraction: float) -> None:
+        """Record the GPUs of a server that is already running, without a capacity check."""
+        self.reservations[replica_id] = (list(gpu_ids), fraction)
+
+    def release(self, replica_id: str) -> None:
+        if self.reservations.pop(replica_id, None) is not None:
+            # Wake every queued placement so they can retry
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    def _available(self, gpus: List[Dict[str, int]]) -> Dict[int, float]:
+        available = {}
+        for gpu in gpus:
+            free_fraction = gpu["memory_free"] / gpu["memory_total"] if gpu["memory_total"] else 0.0
+            available[gpu["index"]] = min(1.0 - self.reserved_fraction(gpu["index"]), free_fraction)
+        return available
+
+    def _best_fit(self, gpus: List[Dict[str, int]], fraction: float, count: int) -> Optional[List[int]]:
+        available = self._available(gpus)
+        fitting = sorted(
+            (room, index) for index, room in available.items() if room + 1e-6 >= fraction
+        )
+        if len(fitting) < count:
+            return None
+        return sorted(index for _, index in fitting[:count])
+
+    async def place(self, replica_id: str, fraction: float, count: int = 1) -> Optional[List[int]]:
+        """Choose and reserve `count` GPUs for a replica, or None if it does not fit now"""
+        async with self._lock:
+            gpus = await asyncio.to_thread(self.probe.query)
+            gpu_ids = self._best_fit(gpus, fraction, count)
+            if gpu_ids is not None:
+                self.reservations[replica_id] = (gpu_ids, fraction)
+            return gpu_ids
+
+    async def wait_for_placement(self, replica_id: str, fraction: float, count: int,
+                                 timeout: float) -> Optional[List[int]]:
+        """Queue until a placement fits, re-checking on every release and periodically"""
+        deadline = time.monotonic() + timeout
+        self.waiting += 1
+        try:
+            while True:
+                changed = self._changed
+                gpu_ids = await self.place(replica_id, fraction, count)
+                if gpu_ids is not None:
+                    return gpu_ids
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=min(remaining, GPU_QUEUE_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiting -= 1
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """Probe results merged with our reservations"""
+        try:
+            gpus = await asyncio.to_thread(self.probe.query)
+            error = None
+        except Exception as e:
+            gpus = []
+            error = str(e)
+        available = self._available(gpus)
+        return {
+            "probe": type(self.probe).__name__,
+            "error": error,
+            "queued": self.waiting,
+            "gpus": [
+                {
+                    **gpu,
+                    "reserved_fraction": round(self.reserved_fraction(gpu["index"]), 4),
+                    "available_fraction": round(max(available[gpu["index"]], 0.0), 4),
+                    "replicas": [r for r, (gpu_ids, _) in self.reservations.items() if gpu["index"] in gpu_ids]
+                }
+                for gpu in gpus
+            ]
+        }
+
+gpu_scheduler = GpuScheduler(create_gpu_probe())
+
+def normalize_family(family: str) -> str:
+    """Normalize a family name so 'qwen', 'Qwen' and 'qwen_models' compare equal."""
+    family = family.lower()
+    return family[:-len("_models")] if family.endswith("_models") else family
+
+class ModelCatalog:
+    """Immutable index over models_config.json, built once at load time.
+
+    Entries are read-only mappings with lookup by model_id and secondary
+    indexes by family, type and modality. Serialized /models bodies and their
+    ETags are computed once per distinct filter and reused.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        entries = []
+        by_id = {}
+        by_family = {}
+        by_type = {}
+        by_modality = {"multimodal": [], "text": []}
+
+        for category, is_multimodal in (("multimodal_models", True), ("text_only_models", False)):
+            for family, family_models in config.get(category, {}).items():
+                for model in family_models:
+                    entry = dict(model)
+                    entry["category"] = family
+                    entry["family"] = family
+                    entry["family_name"] = normalize_family(family).capitalize()
+                    entry["is_multimodal"] = is_multimodal
+                    entry = MappingProxyType(entry)
+
+                    if entry["model_id"] in by_id:
+                        print(f"Warning: duplicate model_id {entry['model_id']} in models config, keeping first entry")
+                        continue
+                    by_id[entry["model_id"]] = entry
+                    entries.append(entry)
+                    by_family.setdefault(normalize_family(family), []).append(entry)
+                    by_type.setdefault(entry.get("type", "").lower(), []).append(entry)
+                    by_modality["multimodal" if is_multimodal else "text"].append(entry)
+
+        self.entries = tuple(entries)
+        self.by_id = MappingProxyType(by_id)
+        self.by_family = MappingProxyType({k: tuple(v) for k, v in by_family.items()})
+        self.by_type = MappingProxyType({k: tuple(v) for k, v in by_type.items()})
+        self.by_modality = MappingProxyType({k: tuple(v) for k, v in by_modality.items()})
+
+    def get(self, model_id: str) -> Optional[MappingProxyType]:
+        return self.by_id.get(model_id)
+
+    def filter(self, model_type: Optional[str] = None, family: Optional[str] = None,
+               modality: Optional[str] = None) -> Tuple[MappingProxyType, ...]:
+        """Entries matching every given filter, in config order."""
+        candidates = [self.entries]
+        if model_type:
+            candidates.append(self.by_type.get(model_type.lower(), ()))
+        if family:
+            candidates.append(self.by_family.get(normalize_family(family), ()))
+        if modality:
+            candidates.append(self.by_modality.get(modality.lower(), ()))
+
+        if len(candidates) == 1:
+            return self.entries
+        # Intersect starting from the smallest index
+        candidates.sort(key=len)
+        selected = {id(entry) for entry in candidates[0]}
+        for other in candidates[1:]:
+            selected &= {id(entry) for entry in other}
+        return tuple(entry for entry in self.entries if id(entry) in selected)
+
+    @functools.lru_cache(maxsize=256)
+    def render(self, model_type: Optional[str] = None, family: Optional[str] = None,
+               modality: Optional[str] = None) -> Tuple[bytes, str]:
+        """Serialized JSON body and ETag for a filtered model list."""
+        return self._serialize([dict(entry) for entry in self.filter(model_type, family, modality)])
+
+    @functools.lru_cache(maxsize=256)
+    def render_families(self, model_type: Optional[str] = None, family: Optional[str] = None,
+                        modality: Optional[str] = None) -> Tuple[bytes, str]:
+        """Serialized JSON body and ETag for a filtered model list grouped by family."""
+        groups = {}
+        for entry in self.filter(model_type, family, modality):
+            key = (entry["is_multimodal"], entry["family"])
+            if key not in groups:
+                groups[key] = {
+                    "family": entry["family"],
+                    "name": entry["family_name"],
+                    "is_multimodal": entry["is_multimodal"],
+                    "models": []
+                }
+            groups[key]["models"].append(dict(entry))
+        return self._serialize(list(groups.values()))
+
+    @staticmethod
+    def _serialize(data: Any) -> Tuple[bytes, str]:
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+# Build the catalog index once; it is never mutated afterwards
+model_catalog = ModelCatalog(models_config)
+
+def find_model_config(model_id: str) -> MappingProxyType:
+    """Find the read-only model configuration by model_id"""
+    model = model_catalog.get(model_id)
+    if model is None:
+        raise ValueError(f"Model {model_id} not found in configuration")
+    return model
+
+def get_metadata_cache_path(model_id: str, revision: Optional[str] = None) -> str:
+    """Cache file for one model_id/revision"""
+    revision = revision or get_default_revision(model_id)
+    safe_id = model_id.strip("/").replace("/", "--")
+    return os.path.join(METADATA_CACHE_DIR, f"{safe_id}@{revision.replace('/', '--')}.json")
+
+def get_default_revision(model_id: str) -> str:
+    return "main" if is_hf_model(model_id) else "master"
+
+def extract_model_metadata(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Pick the fields we need from a model's config.json.
+
+    Multimodal configs keep the language model settings in a nested
+    text_config/llm_config, which is used when the top level lacks them.
+    """
+    sources = [config] + [config[key] for key in ("text_config", "llm_config", "language_config")
+                          if isinstance(config.get(key), dict)]
+
+    def first(*names):
+        for source in sources:
+            for name in names:
+                if isinstance(source.get(name), int):
+                    return source[name]
+        return None
+
+    return {
+        "max_position_embeddings": first("max_position_embeddings"),
+        "max_sequence_length": first("max_sequence_length"),
+        "seq_length": first("seq_length"),
+        "n_positions": first("n_positions"),
+        "architectures": config.get("architectures") or [],
+        "model_type": config.get("model_type"),
+        "hidden_size": first("hidden_size", "d_model", "n_embd"),
+        "num_hidden_layers": first("num_hidden_layers", "num_layers", "n_layer")
+    }
+
+def metadata_max_length(metadata: Dict[str, Any]) -> Optional[int]:
+    """Maximum sequence length from cached metadata, in the original lookup order"""
+    for field in ("max_position_embeddings", "max_sequence_length", "seq_length", "n_positions"):
+        if metadata.get(field):
+            return metadata[field]
+    return None
 
-def get_model_max_length(model_id: str) -> int:
-    """Get the maximum sequence length for a model from its config file."""
+def read_model_metadata(model_id: str, revision: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Cached metadata for a model, or None on a cache miss. Never touches the network."""
     try:
-        # Import here to avoid loading at startup
+        with open(get_metadata_cache_path(model_id, revision), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_model_metadata(model_id: str, revision: Optional[str], metadata: Dict[str, Any]) -> None:
+    os.makedirs(METADATA_CACHE_DIR, exist_ok=True)
+    path = get_metadata_cache_path(model_id, revision)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+
+def download_model_config(model_id: str, revision: Optional[str] = None) -> Dict[str, Any]:
+    """Fetch a model's config.json from a local path, HuggingFace or ModelScope"""
+    local_config = os.path.join(model_id, "config.json")
+    if os.path.isfile(local_config):
+        with open(local_config, "r") as f:
+            return json.load(f)
+
+    revision = revision or get_default_revision(model_id)
+    headers = {"User-Agent": "polarisllm"}
+    if is_hf_model(model_id):
+        endpoint = os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+        url = f"{endpoint}/{model_id}/resolve/{urllib.parse.quote(revision)}/config.json"
+        token = os.environ.get("HF_TOKEN") or os.environ.get("HUGGING_FACE_HUB_TOKEN")
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+    else:
+        endpoint = os.environ.get("MODELSCOPE_DOMAIN", "https://www.modelscope.cn").rstrip("/")
+        if not endpoint.startswith("http"):
+            endpoint = f"https://{endpoint}"
+        url = (f"{endpoint}/api/v1/models/{model_id}/repo?"
+               f"Revision={urllib.parse.quote(revision)}&FilePath=config.json")
+
+    request = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(request, timeout=METADATA_FETCH_TIMEOUT) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+def fetch_model_metadata(model_id: str, revision: Optional[str] = None) -> Dict[str, Any]:
+    """Fetch and cache metadata for a model, without importing transformers if possible"""
+    try:
+        config = download_model_config(model_id, revision)
+        source = "config.json"
+    except Exception as e:
+        print(f"Could not download config.json for {model_id}: {e}")
+        # Last resort: transformers knows about auth, mirrors and local snapshots
         from transformers import AutoConfig
-        
-        try:
-            # Try to load config directly
-            config = AutoConfig.from_pretrained(model_id)
-            if hasattr(config, 'max_position_embeddings'):
-                return config.max_position_embeddings
-            elif hasattr(config, 'max_sequence_length'):
-                return config.max_sequence_length
-            elif hasattr(config, 'seq_length'):
-                return config.seq_length
-            elif hasattr(config, 'n_positions'):
-                return config.n_positions
-            
+        config = AutoConfig.from_pretrained(model_id, revision=revision).to_dict()
+        source = "transformers"
+
+    metadata = extract_model_metadata(config)
+    metadata.update({
+        "model_id": model_id,
+        "revision": revision or get_default_revision(model_id),
+        "source": source,
+        "fetched_at": time.time()
+    })
+    write_model_metadata(model_id, revision, metadata)
+    return metadata
+
+def get_model_max_length(model_id: str, revision: Optional[str] = None) -> int:
+    """Get the maximum sequence length for a model from its config file.
+
+    Served from the on-disk metadata cache when warm; otherwise the config is
+    fetched once and cached. With HF_HUB_OFFLINE set, a miss falls back to the
+    default instead of touching the network.
+    """
+    start = time.time()
+    source = "cache"
+    try:
+        metadata = read_model_metadata(model_id, revision)
+        if metadata is None:
+            source = "default"
+            if os.environ.get("HF_HUB_OFFLINE") == "1":
+                print(f"Warning: No cached metadata for {model_id} and HF_HUB_OFFLINE=1. Using default.")
+                return 2048  # Safe default
+            try:
+                metadata = fetch_model_metadata(model_id, revision)
+            except Exception as e:
+                print(f"Error determining model max length: {e}")
+                return 2048  # Safe default
+            source = "hub"
+            print(f"Fetched metadata for {model_id} in {time.time() - start:.2f}s")
+
+        max_length = metadata_max_length(metadata)
+        if max_length is None:
             # If no sequence length found, use default fallback value
             print(f"Warning: Could not determine max sequence length for {model_id}. Using default.")
             return 2048  # Safe default
+        return max_length
+    finally:
+        model_max_length_seconds.observe(time.time() - start, source=source)
+
+def warm_model_metadata(model_ids: Optional[List[str]] = None, refresh: bool = False) -> Dict[str, Any]:
+    """Populate the metadata cache for the given models (default: whole catalog) in parallel"""
+    model_ids = model_ids or [entry["model_id"] for entry in model_catalog.entries]
+    results = {"cached": [], "fetched": [], "failed": {}}
+
+    def warm_one(model_id):
+        if not refresh and read_model_metadata(model_id) is not None:
+            return "cached", None
+        try:
+            fetch_model_metadata(model_id)
+            return "fetched", None
         except Exception as e:
-            print(f"Error loading model config: {e}")
-            return 2048  # Safe default 
-    except Exception as e:
-        print(f"Error determining model max length: {e}")
-        return 2048  # Safe default
-
-def create_virtual_environment(model_id: str, requires: str) -> str:
-    """Create a virtual environment for a model with its requirements."""
-    # Create a sanitized model ID for the venv name
-    env_name = f"env_{model_id.replace('/', '_').replace('-', '_').lower()}"
-    env_path = f"/app/envs/{env_name}"
+            return "failed", str(e)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=METADATA_WARM_WORKERS) as pool:
+        for model_id, (outcome, error) in zip(model_ids, pool.map(warm_one, model_ids)):
+            if outcome == "failed":
+                results["failed"][model_id] = error
+            else:
+                results[outcome].append(model_id)
+
+    return results
+
+def parse_requirements(requires: Optional[str]) -> Tuple[List[str], bool]:
+    """Parse a `requires` string from models_config.json.
+
+    Args:
+        requires: Raw requirement string, e.g. '"timm" "decord" -U' or "-"
+
+    Returns:
+        A tuple of (sorted, de-duplicated requirement specs, upgrade flag)
+    """
+    if not requires or requires.strip() == "-":
+        return [], False
     
     try:
-        # Ensure the base directory exists
-        print(f"Ensuring base envs directory exists: /app/envs")
-        os.makedirs("/app/envs", exist_ok=True)
-        print(f"Base envs directory confirmed.")
+        req_parts = shlex.split(requires)
+    except ValueError as e:
+        print(f"Error parsing requirements: {e}")
+        print("Falling back to simple space-splitting")
+        req_parts = requires.replace('"', '').replace("'", "").split()
 
-        # First, try to create virtual environment with system packages
-        print(f"Attempting venv creation for {model_id} at {env_path} using python -m venv...")
+    upgrade = False
+    normalized = set()
+    for part in req_parts:
+        if part in ("-U", "--upgrade"):
+            upgrade = True
+            continue
+        # Package names are case-insensitive and treat '_' and '-' alike
+        spec = part.replace(" ", "")
+        name_end = len(spec)
+        for i, ch in enumerate(spec):
+            if ch in "<>=!~;[@":
+                name_end = i
+                break
+        name = spec[:name_end].lower().replace("_", "-")
+        if name:
+            normalized.add(name + spec[name_end:])
+
+    return sorted(normalized), upgrade
+
+@functools.lru_cache(maxsize=None)
+def get_env_python() -> Tuple[str, str]:
+    """Interpreter that cached environments are created from, and its major.minor version.
+
+    This Python is used when it can create a venv; otherwise python3.10, the
+    version the image ships. Resolved once per process, before any key is
+    computed, so an environment's key always names the interpreter inside it.
+    """
+    with tempfile.TemporaryDirectory(prefix=".venv_probe_") as probe_dir:
         try:
-            # Use --system-site-packages to inherit the container's packages
-            # Capture stderr to diagnose failures
-            print("Running: python -m venv...")
-            result = subprocess.run(
-                f"python -m venv --system-site-packages {env_path}",
-                shell=True,
+            subprocess.run(
+                [sys.executable, "-m", "venv", "--without-pip", os.path.join(probe_dir, "env")],
                 check=True,
-                capture_output=True, # Capture stdout/stderr
-                text=True           # Decode as text
+                capture_output=True,
+                text=True
             )
-            print(f"Venv creation stdout (python -m venv):\n{result.stdout}")
-            print("Completed: python -m venv.")
+            return sys.executable, f"{sys.version_info[0]}.{sys.version_info[1]}"
         except subprocess.CalledProcessError as e:
-            print(f"Failed venv creation with python -m venv. Stderr:\n{e.stderr}")
-            print(f"Attempting with python3.10 -m venv...")
-            # Try with explicit Python version if first attempt fails
-            # Capture stderr to diagnose failures
-            print("Running: python3.10 -m venv...")
-            result = subprocess.run(
-                f"python3.10 -m venv --system-site-packages {env_path}",
-                shell=True,
-                check=True,
-                capture_output=True, # Capture stdout/stderr
-                text=True           # Decode as text
-            )
-            print(f"Venv creation stdout (python3.10):\n{result.stdout}")
-            print("Completed: python3.10 -m venv.")
+            print(f"Failed venv creation with {sys.executable}; using python3.10. Stderr:\n{e.stderr}")
+    fallback = shutil.which("python3.10")
+    if fallback is None:
+        raise RuntimeError(f"{sys.executable} cannot create virtual environments and python3.10 is not installed")
+    result = subprocess.run(
+        [fallback, "-c", "import sys; print('%d.%d' % sys.version_info[:2])"],
+        check=True,
+        capture_output=True,
+        text=True
+    )
+    return fallback, result.stdout.strip()
 
-        # Install pip and wheel in the venv
-        # Capture stderr to diagnose failures
-        print("Running: pip install --upgrade pip wheel...")
-        result = subprocess.run(
-            f"{env_path}/bin/pip install --upgrade pip wheel",
-            shell=True,
+def get_env_cache_key(requires: Optional[str]) -> str:
+    """Content-addressed key for a requirement set and the version of the environment Python."""
+    requirements, upgrade = parse_requirements(requires)
+    payload = json.dumps({
+        "python": get_env_python()[1],
+        "requirements": requirements,
+        "upgrade": upgrade
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_dir_size(path: str) -> int:
+    """Total size in bytes of all regular files below a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def read_env_metadata(env_path: str) -> Optional[Dict[str, Any]]:
+    """Read the metadata of a cached environment, or None if it is incomplete."""
+    try:
+        with open(os.path.join(env_path, ENV_METADATA_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_env_metadata(env_path: str, metadata: Dict[str, Any]) -> None:
+    """Atomically write the metadata file that marks an environment as complete."""
+    tmp_path = os.path.join(env_path, ENV_METADATA_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, os.path.join(env_path, ENV_METADATA_FILE))
+
+def get_envs_in_use() -> set:
+    """Paths of cached environments referenced by active deployments."""
+    return {d.get("env_path") for d in active_deployments.values() if d.get("env_path")}
+
+def record_span(spans: Optional[List[Dict[str, Any]]], phase: str, start: float,
+                parent: Optional[str] = "environment") -> None:
+    """Append a finished span for a step that runs outside the deployment task."""
+    if spans is not None:
+        spans.append({"phase": phase, "start": start, "end": time.time(), "parent": parent})
+
+def run_build_step(cmd: List[str], spans: Optional[List[Dict[str, Any]]], phase: str,
+                   metric_step: Optional[str] = None) -> subprocess.CompletedProcess:
+    """Run one environment build command, recording it on the timeline and in metrics."""
+    print(f"Running: {' '.join(cmd)}...")
+    step_start = time.time()
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    if metric_step:
+        pip_install_seconds.observe(time.time() - step_start, step=metric_step)
+    record_span(spans, phase, step_start)
+    return result
+
+def wheelhouse_available() -> bool:
+    """Whether the local wheelhouse exists and holds any distributions."""
+    try:
+        return any(name.endswith((".whl", ".tar.gz", ".zip")) for name in os.listdir(WHEELHOUSE_DIR))
+    except OSError:
+        return False
+
+class PipEnvBuilder:
+    """Builds environments with the venv module and pip.
+
+    Requirements are installed from the local wheelhouse without touching the
+    index when possible. Only when that fails (and POLARIS_ENV_OFFLINE is not
+    set) does it bootstrap pip and go to the index.
+    """
+
+    name = "pip"
+
+    def create(self, env_path: str) -> None:
+        # Use --system-site-packages to inherit the container's packages, pip included,
+        # which saves seeding every environment with its own copy
+        subprocess.run(
+            [get_env_python()[0], "-m", "venv", "--system-site-packages", "--without-pip", env_path],
             check=True,
-            capture_output=True, # Capture stdout/stderr
-            text=True           # Decode as text
+            capture_output=True,
+            text=True
         )
-        print(f"pip/wheel install stdout:\n{result.stdout}")
-        print("Completed: pip install --upgrade pip wheel.")
+
+    def install_command(self, env_path: str) -> List[str]:
+        return [os.path.join(env_path, "bin", "python"), "-m", "pip", "install"]
+
+    def bootstrap(self, env_path: str, spans: Optional[List[Dict[str, Any]]]) -> None:
+        run_build_step(self.install_command(env_path) + ["--upgrade", "pip", "wheel"], spans,
+                       "pip_bootstrap", "bootstrap")
+
+    def install(self, env_path: str, requirements: List[str], upgrade: bool,
+                spans: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Install requirements into env_path.
         
-        # Process the requirements
-        if requires and requires != "-":
-            print(f"Processing requirements: {requires}")
-            
-            # Use a more robust approach to parse the requirements
-            # Handle quoted strings and special flags like -U
-            processed_requires = []
-            
-            # Simple parsing of quoted strings and flags
+        Returns:
+            Where they came from: "wheelhouse" or "index"
+        """
+        install_cmd = self.install_command(env_path) + requirements
+        if upgrade:
+            install_cmd.append("--upgrade")
+
+        if wheelhouse_available():
             try:
-                req_parts = shlex.split(requires)
-                print(f"Requirements after parsing: {req_parts}")
-                
-                # Extract upgrade flag if present
-                upgrade_flag = ""
-                if "-U" in req_parts:
-                    upgrade_flag = " -U"
-                    req_parts.remove("-U")
-                elif "--upgrade" in req_parts:
-                    upgrade_flag = " --upgrade"
-                    req_parts.remove("--upgrade")
-                
-                # Build the requirements string, preserving quotes for package names with version constraints
-                if req_parts:
-                    req_string = " ".join(req_parts) + upgrade_flag
-                    print(f"Installing requirements: {req_string}")
-                    
-                    # Install processed requirements
-                    # Capture stderr to diagnose failures
-                    print(f"Running: pip install {req_string}...")
-                    result = subprocess.run(
-                        f"{env_path}/bin/pip install {req_string}",
-                        shell=True,
-                        check=True,
-                        capture_output=True, # Capture stdout/stderr
-                        text=True           # Decode as text
-                    )
-                    print(f"Requirements install stdout:\n{result.stdout}")
-                    print(f"Completed: pip install {req_string}.")
+                result = run_build_step(install_cmd + ["--no-index", "--find-links", WHEELHOUSE_DIR], spans,
+                                        "pip_install", "requirements")
+                print(f"Requirements install stdout:\n{result.stdout}")
+                return "wheelhouse"
+            except subprocess.CalledProcessError as e:
+                if ENV_OFFLINE:
+                    raise
+                print(f"Wheelhouse install failed, falling back to the package index:\n{e.stderr}")
+            install_cmd += ["--find-links", WHEELHOUSE_DIR]
+        elif ENV_OFFLINE:
+            raise RuntimeError(f"POLARIS_ENV_OFFLINE is set but the wheelhouse {WHEELHOUSE_DIR} is empty")
+
+        self.bootstrap(env_path, spans)
+        result = run_build_step(install_cmd, spans, "pip_install", "requirements")
+        print(f"Requirements install stdout:\n{result.stdout}")
+        return "index"
+
+    def download(self, requirements: List[str], dest: str) -> None:
+        """Download requirements and their dependencies as distributions into dest."""
+        subprocess.run(
+            [sys.executable, "-m", "pip", "download", "--dest", dest] + requirements,
+            check=True,
+            capture_output=True,
+            text=True
+        )
+
+class UvEnvBuilder(PipEnvBuilder):
+    """Builds environments with uv, whose resolver and installer are much faster than pip's.
+
+    Environments have no pip of their own, so there is nothing to bootstrap.
+    Downloads into the wheelhouse still go through pip.
+    """
+
+    name = "uv"
+
+    def __init__(self, uv_path: str):
+        self.uv_path = uv_path
+
+    def create(self, env_path: str) -> None:
+        subprocess.run(
+            [self.uv_path, "venv", "--system-site-packages", "--python", get_env_python()[0], env_path],
+            check=True,
+            capture_output=True,
+            text=True
+        )
+
+    def install_command(self, env_path: str) -> List[str]:
+        return [self.uv_path, "pip", "install", "--python", os.path.join(env_path, "bin", "python")]
+
+    def bootstrap(self, env_path: str, spans: Optional[List[Dict[str, Any]]]) -> None:
+        pass
+
+def create_env_builder():
+    """Pick the environment builder configured by POLARIS_ENV_BUILDER."""
+    if ENV_BUILDER in ("uv", "auto"):
+        uv_path = shutil.which("uv")
+        if uv_path:
+            return UvEnvBuilder(uv_path)
+        if ENV_BUILDER == "uv":
+            print("POLARIS_ENV_BUILDER=uv but uv is not installed; using pip")
+    return PipEnvBuilder()
+
+env_builder = create_env_builder()
+
+def build_virtual_environment(env_path: str, requirements: List[str], upgrade: bool,
+                              spans: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+    """Create a venv at env_path and install the given requirements into it.
+
+    Each step is appended to `spans` when given, for the deployment timeline.
+
+    Returns:
+        Where requirements were installed from, or None if there were none
+    """
+    print(f"Creating virtual environment with {env_builder.name}...")
+    step_start = time.time()
+    env_builder.create(env_path)
+    record_span(spans, "venv_create", step_start)
+
+    if not requirements:
+        print("No requirements specified for this environment.")
+        return None
+    return env_builder.install(env_path, requirements, upgrade, spans)
+
+def create_virtual_environment(model_id: str, requires: str,
+                               spans: Optional[List[Dict[str, Any]]] = None, evict: bool = True) -> str:
+    """Get a cached virtual environment for a model's requirements, building it if needed.
+
+    Environments are keyed by the normalized requirement set and Python version,
+    so every model with the same `requires` shares one environment. Concurrent
+    callers for the same key wait on a single build through a file lock.
+    Lock wait and build steps are appended to `spans` when given. Callers that
+    do not know which environments are in use (worker processes) pass
+    evict=False and leave eviction to the API process.
+    """
+    try:
+        key = get_env_cache_key(requires)
+        requirements, upgrade = parse_requirements(requires)
+        env_path = os.path.join(ENVS_DIR, f"env_{key[:16]}")
+        os.makedirs(ENVS_DIR, exist_ok=True)
+
+        with open(os.path.join(ENVS_DIR, f".env_{key[:16]}.lock"), "w") as lock_file:
+            lock_start = time.time()
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            record_span(spans, "venv_lock_wait", lock_start)
+            try:
+                metadata = read_env_metadata(env_path)
+                if metadata is not None and metadata.get("key") == key:
+                    print(f"Reusing cached virtual environment for {model_id} at {env_path}")
+                    venv_requests.inc(result="hit")
                 else:
-                    print("No requirements to install after parsing.")
-            except Exception as e:
-                print(f"Error parsing requirements: {e}")
-                print("Falling back to simple space-splitting")
+                    # Anything left without metadata is a partial build; start over
+                    if os.path.exists(env_path):
+                        print(f"Removing incomplete environment at {env_path}")
+                        shutil.rmtree(env_path, ignore_errors=True)
+
+                    print(f"Building virtual environment for {model_id} at {env_path}...")
+                    build_start = time.time()
+                    venv_requests.inc(result="miss")
+                    source = build_virtual_environment(env_path, requirements, upgrade, spans)
+                    venv_build_seconds.observe(time.time() - build_start)
+                    metadata = {
+                        "key": key,
+                        "requirements": requirements,
+                        "upgrade": upgrade,
+                        "builder": env_builder.name,
+                        "source": source,
+                        "python_version": get_env_python()[1],
+                        "created_at": time.time(),
+                        "build_seconds": round(time.time() - build_start, 2),
+                        "size_bytes": get_dir_size(env_path),
+                        "built_for": model_id
+                    }
+                    print(f"Successfully created virtual environment for {model_id} at {env_path}")
                 
-                # Fallback to simple space-splitting if shlex fails
-                processed_requires = requires.split()
-                if processed_requires:
-                    req_string = ' '.join(processed_requires)
-                    print(f"Installing requirements (fallback method): {req_string}")
-                    result = subprocess.run(
-                        f"{env_path}/bin/pip install {req_string}",
-                        shell=True,
-                        check=True,
-                        capture_output=True,
-                        text=True
-                    )
-                    print(f"Requirements install stdout (fallback):\n{result.stdout}")
-        else:
-            print("No requirements specified for this model.")
+                metadata["last_used"] = time.time()
+                write_env_metadata(env_path, metadata)
+            except subprocess.CalledProcessError:
+                # Clean up while still holding the lock, so a waiting build never loses its directory
+                shutil.rmtree(env_path, ignore_errors=True)
+                raise
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
         
-        print(f"Successfully created virtual environment for {model_id} at {env_path}")
+        # Keep the cache under its disk budget, never touching the env we just handed out
+        if evict:
+            evict_cached_environments(ENV_CACHE_MAX_BYTES, keep={env_path})
         return env_path
     
     except subprocess.CalledProcessError as e: # Catch errors from venv/pip subprocess calls
-        print(f"ERROR: Subprocess failed during virtual environment setup.")
+        print("ERROR: Subprocess failed during virtual environment setup.")
         print(f"Command: {e.cmd}")
         print(f"Return Code: {e.returncode}")
         print(f"Stderr:\n{e.stderr}")
         print(f"Stdout:\n{e.stdout}") # Also print stdout for context
         print("Falling back to system Python.")
+        venv_requests.inc(result="error")
         return None
     except Exception as e:
         print(f"ERROR: Unexpected exception during virtual environment creation for {model_id}.")
         # Print the full traceback for unexpected errors
         traceback.print_exc()
         print("Falling back to system Python.")
+        venv_requests.inc(result="error")
         return None
 
-def deploy_model_task(model_id: str, gpu_id: int, max_model_len: Optional[int], 
-                     vision_batch_size: Optional[int], gpu_memory_utilization: float,
-                     port: int, isolate_env: bool) -> None:
-    """Background task to deploy the model"""
-    # Create log file first so it exists even if there's an early failure
-    log_file = f"deployment_{model_id.replace('/', '_')}_{port}.log"
-    env_path = None
+def populate_wheelhouse(requires: str) -> int:
+    """Download a requirement set's distributions into the wheelhouse.
     
-    # Store deployment information immediately so it's visible even during deployment
-    # Start with status "deploying"
-    active_deployments[model_id] = {
-        "process": None,
-        "command": "",
-        "log_file": log_file,
-        "port": port,
-        "gpu_id": gpu_id,
-        "env_path": None,
-        "status": "deploying"
-    }
+    Downloads go to a private directory first and are moved in afterwards, so
+    concurrent workers never see or write a partial file.
     
+    Returns:
+        Number of distributions added
+    """
+    requirements, _ = parse_requirements(requires)
+    if not requirements:
+        return 0
+    os.makedirs(WHEELHOUSE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".download_", dir=WHEELHOUSE_DIR)
     try:
-        with open(log_file, "w") as f:
-            f.write(f"Starting deployment for {model_id} on port {port}\n")
-            f.write(f"Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"GPU ID: {gpu_id}\n")
-            f.write(f"Isolated environment: {isolate_env}\n\n")
-        
-        # Find model configuration
-        model_config = find_model_config(model_id)
-        requires = model_config.get("requires", "-")
-        
-        with open(log_file, "a") as f:
-            f.write(f"Model configuration found. Requirements: {requires}\n")
-        
-        # Removed special case handling block for deepseek-vl2
-        special_case = False # Ensure special_case is always False now
-        python_cmd = "python" # Default to system python initially
+        env_builder.download(requirements, staging)
+        added = 0
+        for name in os.listdir(staging):
+            target = os.path.join(WHEELHOUSE_DIR, name)
+            if not os.path.exists(target):
+                os.replace(os.path.join(staging, name), target)
+                added += 1
+        return added
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
-        # Create isolated environment if requested
-        if isolate_env:
+def prebuild_environment(model_id: str, requires: str, download: bool) -> Dict[str, Any]:
+    """Fill the wheelhouse for one requirement set and build its environment (runs in a worker process)."""
+    start = time.time()
+    downloaded = populate_wheelhouse(requires) if download else 0
+    env_path = create_virtual_environment(model_id, requires, evict=False)
+    if env_path is None:
+        raise RuntimeError(f"Environment build failed for {requires}")
+    return {"env_path": env_path, "downloaded": downloaded, "seconds": round(time.time() - start, 2)}
+
+def prebuild_environments(model_ids: Optional[List[str]] = None, download: bool = True,
+                          workers: Optional[int] = None) -> Dict[str, Any]:
+    """Build the environment of every distinct requirement set in the catalog in parallel.
+
+    Each set is built in its own process from a pool, so downloads and
+    installs for different sets overlap.
+    """
+    entries = [e for e in model_catalog.entries if model_ids is None or e["model_id"] in model_ids]
+    sets = {}
+    for entry in entries:
+        requires = entry.get("requires", "-")
+        sets.setdefault(get_env_cache_key(requires), (entry["model_id"], requires))
+
+    results = {"built": [], "failed": {}}
+    # Spawn rather than fork: the API process runs threads
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers or PREBUILD_WORKERS, mp_context=context) as pool:
+        futures = {pool.submit(prebuild_environment, model_id, requires, download): requires
+                   for model_id, requires in sets.values()}
+        for future in concurrent.futures.as_completed(futures):
+            requires = futures[future]
             try:
-                env_path = create_virtual_environment(model_id, requires)
-                if env_path:
-                    python_cmd = f"{env_path}/bin/python"
-                    with open(log_file, "a") as f:
-                        f.write(f"Created isolated environment at {env_path}\n")
-                    
-                    # Update deployment record with environment path
-                    active_deployments[model_id]["env_path"] = env_path
-                else:
-                    # Fallback to system Python if venv creation failed
-                    python_cmd = "python"
-                    with open(log_file, "a") as f:
-                        f.write("Failed to create virtual environment. Falling back to system Python.\n")
+                results["built"].append({"requires": requires, **future.result()})
             except Exception as e:
-                with open(log_file, "a") as f:
-                    f.write(f"Error creating virtual environment: {str(e)}\n")
-                    f.write("Falling back to system Python\n")
-                python_cmd = "python"
-        else:
-            # Use system python
-            python_cmd = "python"
-            with open(log_file, "a") as f:
-                f.write("Using system Python environment\n")
-        
-        # Determine if model is from HuggingFace
-        use_hf = not model_id.startswith(("Qwen/", "modelscope/", "damo/", "iic/", "AI-ModelScope/"))
-        
+                results["failed"][requires] = str(e)
+
+    evict_cached_environments(ENV_CACHE_MAX_BYTES, keep={b["env_path"] for b in results["built"]})
+    return results
+
+def list_cached_environments() -> List[Dict[str, Any]]:
+    """List all complete environments in the cache, most recently used first."""
+    envs = []
+    if not os.path.isdir(ENVS_DIR):
+        return envs
+
+    in_use = get_envs_in_use()
+    for name in os.listdir(ENVS_DIR):
+        env_path = os.path.join(ENVS_DIR, name)
+        if not name.startswith("env_") or not os.path.isdir(env_path):
+            continue
+        metadata = read_env_metadata(env_path)
+        if metadata is None:
+            continue
+        envs.append({
+            "key": metadata.get("key"),
+            "env_path": env_path,
+            "requirements": metadata.get("requirements", []),
+            "upgrade": metadata.get("upgrade", False),
+            "python_version": metadata.get("python_version"),
+            "size_bytes": metadata.get("size_bytes", 0),
+            "created_at": metadata.get("created_at"),
+            "last_used": metadata.get("last_used"),
+            "in_use": env_path in in_use
+        })
+
+    envs.sort(key=lambda env: env["last_used"] or 0, reverse=True)
+    return envs
+
+def remove_cached_environment(env_path: str) -> bool:
+    """Remove one cached environment unless a build currently holds its lock."""
+    name = os.path.basename(env_path)
+    with open(os.path.join(ENVS_DIR, f".{name}.lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            shutil.rmtree(env_path, ignore_errors=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    print(f"Removed cached virtual environment {env_path}")
+    return True
+
+def evict_cached_environments(max_bytes: int, keep: Optional[set] = None) -> List[str]:
+    """Evict least recently used, unused environments until the cache fits in max_bytes.
+
+    Returns:
+        Paths of the evicted environments
+    """
+    keep = set(keep or ())
+    envs = list_cached_environments()
+    total = sum(env["size_bytes"] for env in envs)
+    evicted = []
+
+    # Oldest last_used first
+    for env in reversed(envs):
+        if total <= max_bytes:
+            break
+        if env["in_use"] or env["env_path"] in keep:
+            continue
+        if remove_cached_environment(env["env_path"]):
+            total -= env["size_bytes"]
+            evicted.append(env["env_path"])
+
+    return evicted
+
+class DeploymentLog:
+    """Follows a deployment log file that the model server's log relay writes.
+
+    The relay (log_relay.py) owns the file and rotates it by renaming it aside
+    and reopening a fresh one, so the file outlives the API process that
+    started the server. A single background loop (see tail_deployment_logs)
+    reads what was appended since the last poll, following the file by name
+    across rotations like `tail -F`; the most recent lines are kept in memory
+    for tailing and pushed to followers as they arrive. Lines written by the
+    API itself are appended to the same file.
+    """
+
+    def __init__(self, path: str, mode: str = "w", on_data: Optional[Callable[[bytes], None]] = None):
+        self.path = path
+        self.lines = collections.deque(maxlen=LOG_RING_LINES)
+        self.followers = set()
+        self.on_data = on_data
+        self._partial = b""
+        if mode == "a":
+            self._load_recent_lines()
+        open(path, mode + "b").close()
+        self._reader = open(path, "rb")
+        self._reader.seek(0, os.SEEK_END)
+        self._closed = False
+        open_deployment_logs.add(self)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _load_recent_lines(self) -> None:
+        """Seed the in-memory tail from the end of an existing file."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                start = max(0, f.tell() - LOG_BUFFER_SIZE)
+                f.seek(start)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        raw_lines = data.split(b"\n")
+        if start > 0:
+            raw_lines = raw_lines[1:]  # Starts mid-line
+        if raw_lines and not raw_lines[-1]:
+            raw_lines.pop()
+        self.lines.extend(self._decode_line(raw) for raw in raw_lines)
+
+    @staticmethod
+    def _decode_line(raw: bytes) -> str:
+        # Progress bars redraw with carriage returns; keep only the final state
+        segments = [segment for segment in raw.decode("utf-8", errors="replace").split("\r") if segment]
+        return segments[-1] if segments else ""
+
+    def _publish(self, item: Optional[str]) -> None:
+        for queue in self.followers:
+            if queue.full():
+                # A slow follower loses its oldest lines rather than stalling the writer
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    def _collect_lines(self, data: bytes) -> None:
+        *complete, self._partial = (self._partial + data).split(b"\n")
+        if len(self._partial) > LOG_CHUNK_SIZE:
+            complete.append(self._partial)
+            self._partial = b""
+        for raw in complete:
+            line = self._decode_line(raw)
+            self.lines.append(line)
+            self._publish(line)
+
+    def write(self, text: str) -> None:
+        self.write_bytes(text.encode("utf-8", errors="replace"))
+
+    def write_bytes(self, data: bytes) -> None:
+        if self._closed:
+            return
+        # Opened by name each time, so lines land in the current file after a rotation
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.poll()
+
+    def _read_new(self) -> None:
+        size = os.fstat(self._reader.fileno()).st_size
+        offset = self._reader.tell()
+        if size < offset:
+            # Truncated by someone else; start over from the top
+            self._reader.seek(0)
+            self._partial = b""
+        elif size - offset > LOG_BUFFER_SIZE:
+            # Too far behind: skip to the newest output rather than replaying it all
+            self._reader.seek(size - LOG_BUFFER_SIZE)
+            self._partial = b""
+        while True:
+            chunk = self._reader.read(LOG_CHUNK_SIZE)
+            if not chunk:
+                break
+            self._collect_lines(chunk)
+            if self.on_data is not None:
+                self.on_data(chunk)
+
+    def poll(self) -> None:
+        """Pick up whatever was appended to the file since the last poll."""
+        if self._closed:
+            return
+        # Look at the name before draining: once the relay has renamed the file it
+        # no longer writes to the old one, so nothing can follow what we read here
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        self._read_new()
+        if current is not None and current != os.fstat(self._reader.fileno()).st_ino:
+            self._reader.close()
+            self._reader = open(self.path, "rb")
+            self._read_new()
+
+    def follow(self) -> asyncio.Queue:
+        """Subscribe to new lines; None is delivered when the log is closed."""
+        queue = asyncio.Queue(maxsize=LOG_FOLLOW_QUEUE_SIZE)
+        self.followers.add(queue)
+        return queue
+
+    def unfollow(self, queue: asyncio.Queue) -> None:
+        self.followers.discard(queue)
+
+    def close(self) -> None:
+        open_deployment_logs.discard(self)
+        if not self._closed:
+            try:
+                self.poll()
+            except OSError as e:
+                print(f"Error reading log {self.path}: {e}")
+            self._closed = True
+            self._reader.close()
+        if self._partial:
+            line = self._decode_line(self._partial)
+            self._partial = b""
+            self.lines.append(line)
+            self._publish(line)
+        self._publish(None)
+
+async def tail_deployment_logs() -> None:
+    """Periodically read new model server output into every open deployment log."""
+    while True:
+        await asyncio.sleep(LOG_POLL_INTERVAL)
+        for log in list(open_deployment_logs):
+            try:
+                log.poll()
+            except Exception as e:
+                print(f"Error reading log {log.path}: {e}")
+
+def get_log_file(model_id: str, port: int) -> str:
+    """Path of the log file for a deployment."""
+    return f"deployment_{model_id.replace('/', '_')}_{port}.log"
+
+def is_hf_model(model_id: str) -> bool:
+    """Whether a model is downloaded from HuggingFace rather than ModelScope."""
+    return not model_id.startswith(("Qwen/", "modelscope/", "damo/", "iic/", "AI-ModelScope/"))
+
+def build_deploy_command(model_id: str, model_config: Dict[str, Any], gpu_ids: List[int],
+                         max_model_len: int, vision_batch_size: Optional[int],
+                         gpu_memory_utilization: float, port: int,
+                         python_cmd: str = "python",
+                         tensor_parallel_size: int = 1) -> Tuple[Dict[str, str], List[str]]:
+    """Build the environment variables and argv for a `swift deploy` process.
+
+    Runs the deploy entrypoint as a module so the (possibly isolated) Python
+    interpreter is the server process itself.
+
+    Returns:
+        A tuple of (extra environment variables, argv list)
+    """
+    # Add VLLM_USE_V1=0 for multimodal models to fix compatibility issues
+    env_vars = {"CUDA_VISIBLE_DEVICES": ",".join(str(gpu) for gpu in gpu_ids)}
+    if DEPLOY_LAUNCHER == "stub":
+        # Same port and served model name as swift would use
+        return env_vars, [python_cmd, STUB_SERVER_PATH, "--port", str(port), "--model", model_id.split("/")[-1]]
+    if model_config["is_multimodal"]:
+        env_vars["VLLM_USE_V1"] = "0"
+
+    argv = [
+        python_cmd, "-m", "swift.cli.deploy",
+        "--model", model_id,
+        "--infer_backend", "vllm",
+        "--max_model_len", str(max_model_len),
+        "--gpu_memory_utilization", str(gpu_memory_utilization),
+        "--port", str(port),
+        "--host", "0.0.0.0"  # Ensure accessible from outside container
+    ]
+
+    if tensor_parallel_size > 1:
+        argv.extend(["--tensor_parallel_size", str(tensor_parallel_size)])
+
+    # Add vision_batch_size for multimodal models
+    if model_config["is_multimodal"]:
+        argv.extend(["--vision_batch_size", str(vision_batch_size or 2)])
+
+    # Add use_hf flag if needed
+    if is_hf_model(model_id):
+        argv.extend(["--use_hf", "true"])
+
+    return env_vars, argv
+
+def format_deploy_command(env_vars: Dict[str, str], argv: List[str]) -> str:
+    """Render a deploy command as a shell-style string for display and logs."""
+    return " ".join([f"{k}={v}" for k, v in env_vars.items()] + [shlex.join(argv)])
+
+def get_hf_cache_dir() -> str:
+    if os.environ.get("HF_HUB_CACHE"):
+        return os.environ["HF_HUB_CACHE"]
+    return os.path.join(os.environ.get("HF_HOME", os.path.expanduser("~/.cache/huggingface")), "hub")
+
+def get_modelscope_cache_dir() -> str:
+    return os.environ.get("MODELSCOPE_CACHE", os.path.expanduser("~/.cache/modelscope/hub"))
+
+def get_weight_cache_paths(model_id: str) -> List[str]:
+    """Directories that can hold a model's downloaded weights, in the layout of the hub library."""
+    if is_hf_model(model_id):
+        return [os.path.join(get_hf_cache_dir(), "models--" + model_id.replace("/", "--"))]
+    # ModelScope escapes dots in names; newer releases add a models/ level
+    cache_dir = get_modelscope_cache_dir()
+    names = dict.fromkeys([model_id, model_id.replace(".", "___")])
+    return [os.path.join(cache_dir, *prefix, name) for prefix in ((), ("models",)) for name in names]
+
+def get_weight_cache_size(model_id: str) -> int:
+    return sum(get_dir_size(path) for path in get_weight_cache_paths(model_id) if os.path.isdir(path))
+
+def has_cached_weights(model_id: str) -> bool:
+    return any(os.path.isdir(path) for path in get_weight_cache_paths(model_id))
+
+def touch_weight_cache(model_id: str) -> None:
+    """Record that a model's cached weights were just used, for LRU eviction."""
+    try:
+        deployment_store.touch_weights(model_id, time.time())
+    except sqlite3.Error as e:
+        print(f"Error recording weight usage for {model_id}: {e}")
+
+def fetch_snapshot_size(model_id: str) -> Optional[int]:
+    """Total size of a model's files according to its hub, or None if unknown."""
+    try:
+        if is_hf_model(model_id):
+            from huggingface_hub import HfApi
+            info = HfApi().model_info(model_id, files_metadata=True)
+            return sum(sibling.size or 0 for sibling in info.siblings)
+        from modelscope.hub.api import HubApi
+        files = HubApi().get_model_files(model_id, recursive=True)
+        return sum(f.get("Size", 0) for f in files if f.get("Type") == "blob")
+    except Exception as e:
+        print(f"Could not get snapshot size for {model_id}: {e}")
+        return None
+
+def download_model_snapshot(model_id: str) -> str:
+    """Download a model snapshot into the hub cache that `swift deploy` reads from.
+
+    Both hub libraries skip files that are already complete and resume
+    partial ones, so an interrupted download picks up where it stopped.
+
+    Returns:
+        Local path of the snapshot
+    """
+    if is_hf_model(model_id):
+        from huggingface_hub import snapshot_download
+        return snapshot_download(repo_id=model_id, ignore_patterns=PREFETCH_IGNORE_PATTERNS)
+    from modelscope import snapshot_download
+    try:
+        return snapshot_download(model_id, ignore_patterns=PREFETCH_IGNORE_PATTERNS)
+    except TypeError:
+        # Older modelscope releases have no ignore_patterns
+        return snapshot_download(model_id)
+
+def run_prefetch(job: Dict[str, Any]) -> None:
+    """Download one model's weights with retries (runs in a prefetch thread)."""
+    model_id = job["model_id"]
+    with prefetch_slots:
+        job["status"] = "downloading"
+        job["started_at"] = time.time()
+        if job["bytes_total"] is None:
+            job["bytes_total"] = fetch_snapshot_size(model_id)
+        for attempt in range(1, PREFETCH_RETRIES + 1):
+            job["attempts"] = attempt
+            try:
+                job["path"] = download_model_snapshot(model_id)
+                job["status"] = "done"
+                job["error"] = None
+                break
+            except ImportError as e:
+                job["status"] = "failed"
+                job["error"] = f"Hub library not installed: {e}"
+                break
+            except Exception as e:
+                job["error"] = str(e)
+                print(f"Prefetch of {model_id} failed (attempt {attempt}/{PREFETCH_RETRIES}): {e}")
+                if attempt == PREFETCH_RETRIES:
+                    job["status"] = "failed"
+                else:
+                    time.sleep(2 ** attempt)
+        job["finished_at"] = time.time()
+
+def finish_prefetch(job: Dict[str, Any]) -> None:
+    """Runs on the event loop once a prefetch thread is done."""
+    job["done"].set()
+    for span in job["spans"]:
+        end_span(span)
+    job["spans"].clear()
+    if job["status"] == "done":
+        touch_weight_cache(job["model_id"])
+        asyncio.create_task(evict_weights(WEIGHT_CACHE_MAX_BYTES, {job["model_id"]}))
+
+def start_prefetch(model_id: str) -> Dict[str, Any]:
+    """Start downloading a model's weights in the background.
+
+    A download already queued or running is shared, and a finished one is
+    reused as long as its files are still cached.
+    """
+    job = prefetch_jobs.get(model_id)
+    if job is not None:
+        if job["status"] in ("queued", "downloading"):
+            return job
+        if job["status"] == "done" and has_cached_weights(model_id):
+            return job
+
+    job = {
+        "model_id": model_id,
+        "source": "huggingface" if is_hf_model(model_id) else "modelscope",
+        "status": "queued",
+        "bytes_total": None,
+        "attempts": 0,
+        "error": None,
+        "path": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "done": asyncio.Event(),
+        "spans": []  # Timeline spans of deployments waiting on this download
+    }
+    prefetch_jobs[model_id] = job
+    loop = asyncio.get_running_loop()
+
+    def worker():
+        try:
+            run_prefetch(job)
+        finally:
+            loop.call_soon_threadsafe(finish_prefetch, job)
+
+    # Daemon threads so a download never holds up API shutdown; it resumes next time
+    threading.Thread(target=worker, name=f"prefetch-{model_id}", daemon=True).start()
+    return job
+
+def prefetch_to_dict(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a prefetch job, with progress measured from the cache on disk"""
+    bytes_done = get_weight_cache_size(job["model_id"])
+    progress = None
+    if job["status"] == "done":
+        progress = 1.0
+    elif job["bytes_total"]:
+        progress = round(min(bytes_done / job["bytes_total"], 1.0), 4)
+    return {
+        "model_id": job["model_id"],
+        "source": job["source"],
+        "status": job["status"],
+        "bytes_done": bytes_done,
+        "bytes_total": job["bytes_total"],
+        "progress": progress,
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "path": job["path"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+def weights_in_use() -> set:
+    """Models whose weights must stay cached: deployed, scaled to zero, or downloading.
+
+    Reads event-loop state, so call it on the loop and hand the result to the
+    cache helpers that run in worker threads.
+    """
+    in_use = set(replica_groups) | set(parked_models)
+    in_use.update(model_id for model_id, job in prefetch_jobs.items() if job["status"] in ("queued", "downloading"))
+    return in_use
+
+def list_cached_models(in_use: set) -> List[Dict[str, Any]]:
+    """Per-model disk usage of downloaded weights, most recently used first."""
+    try:
+        usage = deployment_store.load_weight_usage()
+    except sqlite3.Error as e:
+        print(f"Error reading weight usage: {e}")
+        usage = {}
+    model_ids = dict.fromkeys([entry["model_id"] for entry in model_catalog.entries] + list(usage) + sorted(in_use))
+
+    models = []
+    for model_id in model_ids:
+        paths = [path for path in get_weight_cache_paths(model_id) if os.path.isdir(path)]
+        if not paths:
+            continue
+        models.append({
+            "model_id": model_id,
+            "paths": paths,
+            "size_bytes": sum(get_dir_size(path) for path in paths),
+            "last_used": usage.get(model_id) or max(os.path.getmtime(path) for path in paths),
+            "in_use": model_id in in_use
+        })
+    models.sort(key=lambda m: m["last_used"], reverse=True)
+    return models
+
+def remove_cached_weights(model_id: str) -> None:
+    for path in get_weight_cache_paths(model_id):
+        shutil.rmtree(path, ignore_errors=True)
+    try:
+        deployment_store.forget_weights(model_id)
+    except sqlite3.Error as e:
+        print(f"Error removing weight usage for {model_id}: {e}")
+
+def forget_prefetch(model_id: str) -> None:
+    """Drop a finished prefetch job once its weights are gone (on the event loop)."""
+    job = prefetch_jobs.get(model_id)
+    if job is not None and job["status"] not in ("queued", "downloading"):
+        del prefetch_jobs[model_id]
+
+def evict_model_weights(max_bytes: int, keep: set) -> List[str]:
+    """Evict least recently used weights of models not in keep until the cache fits in max_bytes.
+
+    Runs in a worker thread; keep comes from weights_in_use() on the loop.
+
+    Returns:
+        Model ids whose weights were evicted
+    """
+    models = list_cached_models(keep)
+    total = sum(m["size_bytes"] for m in models)
+    evicted = []
+
+    # Oldest last_used first
+    for model in reversed(models):
+        if total <= max_bytes:
+            break
+        if model["in_use"]:
+            continue
+        remove_cached_weights(model["model_id"])
+        total -= model["size_bytes"]
+        evicted.append(model["model_id"])
+        print(f"Evicted cached weights of {model['model_id']} ({model['size_bytes']} bytes)")
+
+    return evicted
+
+async def evict_weights(max_bytes: int, keep: Optional[set] = None) -> List[str]:
+    """evict_model_weights() in a worker thread, keeping keep and every model in use."""
+    evicted = await asyncio.to_thread(evict_model_weights, max_bytes, weights_in_use() | set(keep or ()))
+    for model_id in evicted:
+        forget_prefetch(model_id)
+    return evicted
+
+def get_media_path(media_id: str) -> Optional[str]:
+    """File of an uploaded media item, or None if media_id is not a SHA-256 hex digest"""
+    if len(media_id) != 64 or any(c not in "0123456789abcdef" for c in media_id):
+        return None
+    return os.path.join(MEDIA_DIR, media_id)
+
+def store_media(data: bytes, model_id: Optional[str] = None) -> Dict[str, Any]:
+    """Store media under the hash of its content, first preparing it for model_id if given."""
+    mime = detect_mime(data)
+    if mime is None:
+        raise ValueError("Unrecognized media type; expected an image, audio or video file")
+    if model_id:
+        data, mime = prepare_media(data, model_id)
+
+    media_id = media_hash(data)
+    path = get_media_path(media_id)
+    with media_lock:
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(MEDIA_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            evict_media(MEDIA_MAX_BYTES, keep=media_id)
+    return {"media_id": media_id, "ref": f"{MEDIA_REF_PREFIX}{media_id}", "mime_type": mime, "size_bytes": len(data)}
+
+def load_media(media_id: str) -> Optional[Tuple[bytes, str]]:
+    """Bytes and MIME type of an uploaded media item, marking it recently used"""
+    path = get_media_path(media_id)
+    if path is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return data, detect_mime(data) or "application/octet-stream"
+
+def remove_media(media_id: str) -> bool:
+    """Delete an uploaded media item; False if there was none"""
+    path = get_media_path(media_id)
+    if path is None:
+        return False
+    with media_lock:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+    return True
+
+def evict_media(max_bytes: int, keep: Optional[str] = None) -> List[str]:
+    """Delete least recently used media until the store fits in max_bytes. Caller holds media_lock."""
+    try:
+        entries = [entry for entry in os.scandir(MEDIA_DIR) if entry.is_file() and len(entry.name) == 64]
+    except FileNotFoundError:
+        return []
+    stats = sorted(((entry.stat(), entry.name) for entry in entries), key=lambda item: item[0].st_mtime)
+    total = sum(stat.st_size for stat, _ in stats)
+    evicted = []
+    for stat, name in stats:
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(os.path.join(MEDIA_DIR, name))
+        except FileNotFoundError:
+            continue
+        total -= stat.st_size
+        evicted.append(name)
+    return evicted
+
+def expand_media_refs(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a chat request with media://<sha256> references replaced by data URLs.
+
+    Raises:
+        KeyError: With the media_id of a reference that is not in the store
+    """
+    messages = []
+    for message in body["messages"]:
+        content = message.get("content") if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            messages.append(message)
+            continue
+        parts = []
+        for part in content:
+            part_type = part.get("type") if isinstance(part, dict) else None
+            value = part.get(part_type) if part_type in MEDIA_PART_TYPES else None
+            url = value.get("url") if isinstance(value, dict) else value
+            if isinstance(url, str) and url.startswith(MEDIA_REF_PREFIX):
+                media_id = url[len(MEDIA_REF_PREFIX):]
+                media = load_media(media_id)
+                if media is None:
+                    raise KeyError(media_id)
+                data_url = to_data_url(*media)
+                part = {**part, part_type: {**value, "url": data_url} if isinstance(value, dict) else data_url}
+            parts.append(part)
+        messages.append({**message, "content": parts})
+    return {**body, "messages": messages}
+
+def has_media_refs(body: Dict[str, Any]) -> bool:
+    messages = body.get("messages")
+    return isinstance(messages, list) and MEDIA_REF_PREFIX in json.dumps(messages)
+
+def get_replica_id(model_id: str, index: int) -> str:
+    """Identifier of one replica of a model"""
+    return f"{model_id}@{index}"
+
+class DeploymentStore:
+    """SQLite record of every replica, so model servers outlive an API restart.
+
+    The database runs in WAL mode with relaxed syncing, which keeps a write
+    cheap enough to do inline on every state change. It is opened lazily so
+    CLI-style entry points never create it.
+    """
+
+    COLUMNS = ("replica_id", "model_id", "replica_index", "pid", "port", "gpu_ids", "env_path",
+               "state", "log_file", "command", "served_model_name", "created_at", "ready_at",
+               "config", "updated_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS deployments ("
+                "replica_id TEXT PRIMARY KEY, model_id TEXT NOT NULL, replica_index INTEGER, "
+                "pid INTEGER, port INTEGER, gpu_ids TEXT, env_path TEXT, state TEXT, log_file TEXT, "
+                "command TEXT, served_model_name TEXT, created_at REAL, ready_at REAL, "
+                "config TEXT, updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS deploy_timelines ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, replica_id TEXT, model_id TEXT NOT NULL, "
+                "created_at REAL, time_to_ready REAL, outcome TEXT, spans TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS deploy_timelines_model ON deploy_timelines (model_id, created_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS weight_usage (model_id TEXT PRIMARY KEY, last_used REAL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parked_models ("
+                "model_id TEXT PRIMARY KEY, request TEXT, served_model_name TEXT, parked_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def save(self, deployment: Dict[str, Any]) -> None:
+        process = deployment.get("process")
+        row = (
+            deployment["replica_id"], deployment["model_id"], deployment["replica_index"],
+            process.pid if process is not None else None, deployment["port"],
+            json.dumps(deployment["gpu_ids"]), deployment["env_path"], deployment["status"],
+            deployment["log_file"], deployment["command"], deployment["served_model_name"],
+            deployment["created_at"], deployment["ready_at"], json.dumps(deployment["config"]),
+            time.time()
+        )
+        placeholders = ", ".join("?" * len(self.COLUMNS))
+        with self._lock:
+            self._connect().execute(
+                f"INSERT OR REPLACE INTO deployments ({', '.join(self.COLUMNS)}) VALUES ({placeholders})", row
+            )
+
+    def delete(self, replica_id: str) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM deployments WHERE replica_id = ?", (replica_id,))
+
+    def load(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM deployments ORDER BY created_at"
+            ).fetchall()
+        records = []
+        for row in rows:
+            record = dict(zip(self.COLUMNS, row))
+            record["gpu_ids"] = json.loads(record["gpu_ids"]) if record["gpu_ids"] else None
+            record["config"] = json.loads(record["config"]) if record["config"] else {}
+            records.append(record)
+        return records
+
+    def save_timeline(self, timeline: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO deploy_timelines (replica_id, model_id, created_at, time_to_ready, outcome, spans) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (timeline["replica_id"], timeline["model_id"], timeline["created_at"],
+                 timeline["time_to_ready"], timeline["status"], json.dumps(timeline["spans"]))
+            )
+
+    def load_timelines(self, model_id: str, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT replica_id, model_id, created_at, time_to_ready, outcome, spans FROM deploy_timelines "
+                "WHERE model_id = ? ORDER BY created_at DESC LIMIT ?", (model_id, limit)
+            ).fetchall()
+        return [
+            {"replica_id": replica_id, "model_id": model_id, "created_at": created_at,
+             "time_to_ready": time_to_ready, "status": outcome, "spans": json.loads(spans)}
+            for replica_id, model_id, created_at, time_to_ready, outcome, spans in rows
+        ]
+
+    def touch_weights(self, model_id: str, at: float) -> None:
+        with self._lock:
+            self._connect().execute("INSERT OR REPLACE INTO weight_usage (model_id, last_used) VALUES (?, ?)",
+                                    (model_id, at))
+
+    def forget_weights(self, model_id: str) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM weight_usage WHERE model_id = ?", (model_id,))
+
+    def load_weight_usage(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._connect().execute("SELECT model_id, last_used FROM weight_usage").fetchall())
+
+    def save_parked(self, parked: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO parked_models (model_id, request, served_model_name, parked_at) "
+                "VALUES (?, ?, ?, ?)",
+                (parked["model_id"], json.dumps(parked["request"]), parked["served_model_name"], parked["parked_at"])
+            )
+
+    def delete_parked(self, model_id: str) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM parked_models WHERE model_id = ?", (model_id,))
+
+    def load_parked(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT model_id, request, served_model_name, parked_at FROM parked_models"
+            ).fetchall()
+        return [
+            {"model_id": model_id, "request": json.loads(request), "served_model_name": served_model_name,
+             "parked_at": parked_at}
+            for model_id, request, served_model_name, parked_at in rows
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+deployment_store = DeploymentStore(STATE_DB_PATH)
+
+class DeploymentsSnapshot:
+    """The /deployments body, serialized once per registry change instead of once per request.
+
+    Writers call touch(): state transitions (urgent) wake the refresh task
+    right away, while request counters only mark the snapshot stale and are
+    folded in at most every DEPLOYMENTS_SNAPSHOT_INTERVAL. Readers share the
+    same immutable body and ETag until the next rebuild; a reader that
+    arrives after a state transition but before the task has run rebuilds it
+    itself, so a deploy or stop is always visible to the next request.
+    """
+
+    def __init__(self):
+        self.version = 0  # Bumped on every change
+        self.urgent_version = 0  # Version of the last state transition
+        self.built_version = -1
+        self.body = b"[]"
+        self.etag = '"empty"'
+        self._changed = asyncio.Event()
+
+    def touch(self, urgent: bool = True) -> None:
+        self.version += 1
+        if urgent:
+            self.urgent_version = self.version
+            self._changed.set()
+
+    def rebuild(self) -> None:
+        version = self.version
+        entries = cluster_deployments() if NODE_ROLE == "coordinator" else local_deployments()
+        body = json.dumps(entries, separators=(",", ":")).encode("utf-8")
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.built_version = version
+
+    def get(self) -> Tuple[bytes, str]:
+        if self.built_version < self.urgent_version:
+            self.rebuild()
+        return self.body, self.etag
+
+    async def refresh(self) -> None:
+        """Rebuild whenever something changed, at most every DEPLOYMENTS_SNAPSHOT_INTERVAL for counters"""
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=DEPLOYMENTS_SNAPSHOT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            if self.built_version != self.version:
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    print(f"Error rebuilding the deployments snapshot: {e}")
+
+deployments_snapshot = DeploymentsSnapshot()
+
+def get_deploy_lock(model_id: str) -> asyncio.Lock:
+    """Lock held while replicas of a model are added or removed"""
+    lock = deploy_locks.get(model_id)
+    if lock is None:
+        lock = deploy_locks[model_id] = asyncio.Lock()
+    return lock
+
+def persist_deployment(deployment: Dict[str, Any]) -> None:
+    """Write a deployment record to the store; a store failure never fails the deployment."""
+    deployments_snapshot.touch()
+    try:
+        deployment_store.save(deployment)
+    except sqlite3.Error as e:
+        print(f"Error persisting deployment {deployment['replica_id']}: {e}")
+
+def forget_deployment(replica_id: str) -> None:
+    """Remove a deployment record from the store."""
+    deployments_snapshot.touch()
+    try:
+        deployment_store.delete(replica_id)
+    except sqlite3.Error as e:
+        print(f"Error removing deployment {replica_id} from the store: {e}")
+
+def register_deployment(model_id: str, replica_id: str, replica_index: int, port: int,
+                        gpu_ids: Optional[List[int]], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Create the record for a new replica with status "deploying".
+
+    `config` holds the deploy parameters the replica was started with.
+    """
+    now = time.time()
+    deployment = {
+        "model_id": model_id,
+        "replica_id": replica_id,
+        "replica_index": replica_index,
+        "process": None,
+        "task": None,
+        "command": "",
+        "log_file": get_log_file(model_id, port),
+        "log": None,
+        "port": port,
+        "gpu_id": gpu_ids[0] if gpu_ids else None,
+        "gpu_ids": gpu_ids,
+        "env_path": None,
+        "status": "deploying",
+        "state_history": [{"state": "deploying", "at": now}],
+        "created_at": now,
+        "ready_at": None,
+        "time_to_ready": None,
+        "served_model_name": None,
+        "config": config or {},
+        "timeline": [],
+        "timeline_saved": False,
+        "settled": asyncio.Event(),
+        "outstanding": 0,
+        "total_requests": 0,
+        "affinity_hits": 0,
+        "affinity_spills": 0,
+        "last_request_at": None,
+        "cold_start_at": None,
+        "ejected_until": 0.0
+    }
+    active_deployments[replica_id] = deployment
+    replica_groups.setdefault(model_id, []).append(replica_id)
+    persist_deployment(deployment)
+    return deployment
+
+def start_span(deployment: Dict[str, Any], phase: str, at: Optional[float] = None) -> Dict[str, Any]:
+    """Open a timed span on a deployment's timeline."""
+    span = {"phase": phase, "start": at or time.time(), "end": None, "parent": None}
+    deployment["timeline"].append(span)
+    return span
+
+def end_span(span: Optional[Dict[str, Any]], at: Optional[float] = None) -> None:
+    if span is not None and span["end"] is None:
+        span["end"] = at or time.time()
+
+def find_open_span(deployment: Dict[str, Any], phase: str) -> Optional[Dict[str, Any]]:
+    for span in reversed(deployment["timeline"]):
+        if span["phase"] == phase and span["end"] is None:
+            return span
+    return None
+
+def timeline_to_dict(deployment: Dict[str, Any]) -> Dict[str, Any]:
+    """A deployment's spans as offsets and durations from the deploy request."""
+    created_at = deployment["created_at"]
+    now = time.time()
+    spans = []
+    for span in deployment["timeline"]:
+        end = span["end"] if span["end"] is not None else now
+        spans.append({
+            "phase": span["phase"],
+            "parent": span["parent"],
+            "offset": round(span["start"] - created_at, 3),
+            "duration": round(end - span["start"], 3),
+            "open": span["end"] is None
+        })
+    return {
+        "replica_id": deployment["replica_id"],
+        "model_id": deployment["model_id"],
+        "status": deployment["status"],
+        "created_at": created_at,
+        "time_to_ready": deployment.get("time_to_ready"),
+        "spans": spans
+    }
+
+def save_timeline(deployment: Dict[str, Any]) -> None:
+    """Keep a settled deploy's timeline so later deploys of the model can be compared with it."""
+    if deployment["timeline_saved"]:
+        return
+    deployment["timeline_saved"] = True
+    try:
+        deployment_store.save_timeline(timeline_to_dict(deployment))
+    except sqlite3.Error as e:
+        print(f"Error saving timeline for {deployment['replica_id']}: {e}")
+
+def set_deployment_state(deployment: Dict[str, Any], state: str) -> None:
+    """Move a deployment to a new lifecycle state and record the transition."""
+    if deployment["status"] == state:
+        return
+    now = time.time()
+    previous = deployment["state_history"][-1]
+    deploy_phase_seconds.observe(now - previous["at"], phase=previous["state"])
+    deployment["status"] = state
+    deployment["state_history"].append({"state": state, "at": now})
+
+    end_span(find_open_span(deployment, STATE_SPANS.get(previous["state"], "")), now)
+    if state in STATE_SPANS:
+        start_span(deployment, STATE_SPANS[state], now)
+
+    if state == "ready" and deployment.get("ready_at") is None:
+        deployment["ready_at"] = now
+        deployment["time_to_ready"] = round(now - deployment["created_at"], 3)
+        deploy_time_to_ready.observe(now - deployment["created_at"], model_id=deployment["model_id"])
+        if deployment.get("cold_start_at") is not None:
+            record_cold_start(deployment["model_id"], now - deployment["cold_start_at"])
+    elif state == "failed":
+        deploy_failures.inc(model_id=deployment["model_id"], phase=previous["state"])
+
+    # Wake long-polls once the deployment is either usable or finished
+    if state in SETTLED_STATES:
+        deployment["settled"].set()
+        for span in deployment["timeline"]:
+            end_span(span, now)
+        if state in ("ready", "failed"):
+            save_timeline(deployment)
+    persist_deployment(deployment)
+
+def detect_loading_phase(deployment: Dict[str, Any], chunk: bytes) -> None:
+    """Advance downloading -> loading based on markers in the process output."""
+    if deployment["status"] != "downloading":
+        return
+    text = chunk.lower()
+    if any(marker in text for marker in LOADING_MARKERS):
+        set_deployment_state(deployment, "loading")
+
+async def probe_backend(port: int) -> Optional[Dict[str, Any]]:
+    """Query a model server's /v1/models endpoint; None if it is not answering."""
+    try:
+        response = await probe_client.get(f"http://127.0.0.1:{port}/v1/models")
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+async def monitor_readiness(deployment: Dict[str, Any]) -> None:
+    """Poll a deployment's backend with backoff until ready, then keep health-checking it."""
+    process = deployment["process"]
+    delay = READINESS_INITIAL_DELAY
+    failures = 0
+
+    while process.returncode is None:
+        models = await probe_backend(deployment["port"])
+
+        if models is not None:
+            failures = 0
+            if deployment["status"] != "ready":
+                served = [m.get("id") for m in models.get("data", []) if m.get("id")]
+                if served:
+                    deployment["served_model_name"] = served[0]
+                set_deployment_state(deployment, "ready")
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        elif deployment["status"] in ("ready", "degraded"):
+            failures += 1
+            if failures >= HEALTH_CHECK_FAILURES:
+                set_deployment_state(deployment, "degraded")
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        else:
+            # Still starting up: back off until the server answers
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, READINESS_MAX_DELAY)
+
+async def terminate_process(process: asyncio.subprocess.Process, timeout: float = 30) -> None:
+    """Terminate a deployment's process group, escalating to SIGKILL after timeout."""
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(process.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return
+        await process.wait()
+
+def get_deploy_config(max_model_len: Optional[int], vision_batch_size: Optional[int],
+                      gpu_memory_utilization: float, isolate_env: bool,
+                      tensor_parallel_size: int, auto_placement: bool = False,
+                      idle_timeout: Optional[float] = None, always_warm: bool = False,
+                      max_in_flight: Optional[int] = None) -> Dict[str, Any]:
+    """Deploy parameters stored with a replica's record."""
+    return {
+        "max_model_len": max_model_len,
+        "vision_batch_size": vision_batch_size,
+        "gpu_memory_utilization": gpu_memory_utilization,
+        "isolate_env": isolate_env,
+        "tensor_parallel_size": tensor_parallel_size,
+        "auto_placement": auto_placement,
+        "idle_timeout": idle_timeout,
+        "always_warm": always_warm,
+        "max_in_flight": max_in_flight
+    }
+
+async def release_deployment_resources(deployment: Dict[str, Any]) -> None:
+    """Free the port, GPUs and gateway pool of a replica whose process is gone (or never started)."""
+    await close_upstream_client(deployment["port"])
+    port_allocator.release(deployment["port"])
+    gpu_scheduler.release(deployment["replica_id"])
+
+async def deploy_model_task(model_id: str, gpu_id: Optional[int], max_model_len: Optional[int],
+                            vision_batch_size: Optional[int], gpu_memory_utilization: float,
+                            port: int, isolate_env: bool, replica_id: Optional[str] = None,
+                            gpu_ids: Optional[List[int]] = None, tensor_parallel_size: int = 1,
+                            placement_timeout: float = 1800.0) -> None:
+    """Supervise a deployment from environment setup until its process exits.
+
+    Runs as a task on the event loop; blocking setup steps are pushed to a
+    worker thread only while they run, and process output is streamed in chunks.
+    """
+    # Store deployment information immediately so it's visible even during deployment
+    replica_id = replica_id or get_replica_id(model_id, 0)
+    if gpu_ids is None and gpu_id is not None:
+        gpu_ids = [gpu_id]
+    deployment = active_deployments.get(replica_id) or register_deployment(
+        model_id, replica_id, 0, port, gpu_ids,
+        get_deploy_config(max_model_len, vision_batch_size, gpu_memory_utilization, isolate_env, tensor_parallel_size)
+    )
+    log_file = deployment["log_file"]
+    env_path = None
+    log = None
+    readiness_task = None
+    deploy_attempts.inc(model_id=model_id)
+
+    try:
+        # Create log file first so it exists even if there's an early failure
+        log = DeploymentLog(log_file, "w", on_data=lambda chunk: detect_loading_phase(deployment, chunk))
+        deployment["log"] = log
+        log.write(f"Starting deployment for {replica_id} on port {port}\n")
+        log.write(f"Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        log.write(f"Isolated environment: {isolate_env}\n")
+
+        # Wait for the scheduler to find room if the request was queued
+        if gpu_ids is None:
+            log.write(f"Waiting for GPU capacity ({tensor_parallel_size} x {gpu_memory_utilization})...\n")
+            gpu_ids = await gpu_scheduler.wait_for_placement(
+                replica_id, gpu_memory_utilization, tensor_parallel_size, placement_timeout
+            )
+            if gpu_ids is None:
+                raise RuntimeError(f"No GPU capacity became available within {placement_timeout}s")
+            deployment["gpu_ids"] = gpu_ids
+            deployment["gpu_id"] = gpu_ids[0]
+            set_deployment_state(deployment, "deploying")
+        log.write(f"GPU IDs: {', '.join(str(gpu) for gpu in gpu_ids)}\n\n")
+
+        # Find model configuration
+        model_config = find_model_config(model_id)
+        requires = model_config.get("requires", "-")
+        log.write(f"Model configuration found. Requirements: {requires}\n")
+
+        # Download weights while the environment is prepared
+        prefetch_job = None
+        if PREFETCH_ON_DEPLOY and DEPLOY_LAUNCHER == "swift" and os.environ.get("HF_HUB_OFFLINE") != "1":
+            prefetch_job = start_prefetch(model_id)
+            prefetch_span = start_span(deployment, "weight_prefetch")
+            if prefetch_job["done"].is_set():
+                end_span(prefetch_span)
+            else:
+                prefetch_job["spans"].append(prefetch_span)
+            log.write(f"Prefetching weights from {prefetch_job['source']} in the background\n")
+
+        python_cmd = "python" # Default to system python initially
+
+        # Create isolated environment if requested
+        if isolate_env and DEPLOY_LAUNCHER == "swift":
+            set_deployment_state(deployment, "building_env")
+            env_span = start_span(deployment, "environment")
+            env_spans = []
+            try:
+                env_path = await asyncio.to_thread(create_virtual_environment, model_id, requires, env_spans)
+                if env_path:
+                    python_cmd = f"{env_path}/bin/python"
+                    log.write(f"Using isolated environment at {env_path}\n")
+
+                    # Update deployment record with environment path
+                    deployment["env_path"] = env_path
+                else:
+                    # Fallback to system Python if venv creation failed
+                    log.write("Failed to create virtual environment. Falling back to system Python.\n")
+            except Exception as e:
+                log.write(f"Error creating virtual environment: {str(e)}\n")
+                log.write("Falling back to system Python\n")
+                python_cmd = "python"
+            end_span(env_span)
+            deployment["timeline"].extend(env_spans)
+        else:
+            # Use system python
+            log.write("Using system Python environment\n")
+
         # Get model's max length from config
+        lookup_span = start_span(deployment, "max_length_lookup")
         try:
-            model_max_length = get_model_max_length(model_id)
-            with open(log_file, "a") as f:
-                f.write(f"Detected model max length: {model_max_length}\n")
+            model_max_length = await asyncio.to_thread(get_model_max_length, model_id)
+            log.write(f"Detected model max length: {model_max_length}\n")
         except Exception as e:
             model_max_length = 2048
-            with open(log_file, "a") as f:
-                f.write(f"Error detecting model max length: {str(e)}\n")
-                f.write(f"Using default max length: {model_max_length}\n")
+            log.write(f"Error detecting model max length: {str(e)}\n")
+            log.write(f"Using default max length: {model_max_length}\n")
+        end_span(lookup_span)
         
         # Set default max_model_len if not provided or ensure it doesn't exceed model's capability
         if max_model_len is None:
             # Use a safe default based on whether it's multimodal
             default_len = min(2048, model_max_length) if model_config["is_multimodal"] else min(4096, model_max_length)
             max_model_len = default_len
-            with open(log_file, "a") as f:
-                f.write(f"Using default max model length: {max_model_len}\n")
+            log.write(f"Using default max model length: {max_model_len}\n")
+        else:
+            # Ensure max_model_len doesn't exceed model's capabilities
+            if max_model_len > model_max_length:
+                log.write(f"Warning: Requested max_model_len ({max_model_len}) exceeds model's maximum ({model_max_length}). Using {model_max_length} instead.\n")
+                max_model_len = model_max_length
+
+        env_vars, argv = build_deploy_command(
+            model_id, model_config, gpu_ids, max_model_len, vision_batch_size,
+            gpu_memory_utilization, port, python_cmd, tensor_parallel_size
+        )
+        cmd_str = format_deploy_command(env_vars, argv)
+        deployment["command"] = cmd_str
+        deployment["max_model_len"] = max_model_len
+
+        # Swift would download the same files itself, so let the prefetch finish first
+        if prefetch_job is not None:
+            if not prefetch_job["done"].is_set():
+                log.write("Waiting for weight prefetch to finish...\n")
+                wait_span = start_span(deployment, "weight_prefetch_wait")
+                await prefetch_job["done"].wait()
+                end_span(wait_span)
+            if prefetch_job["status"] == "done":
+                log.write(f"Weights prefetched to {prefetch_job['path']}\n")
+            else:
+                log.write(f"Weight prefetch failed ({prefetch_job['error']}); swift will download them\n")
+        touch_weight_cache(model_id)
+
+        # Execute deployment command
+        log.write(f"Executing: {cmd_str}\n\n")
+        log.write("=== Deployment Output ===\n\n")
+
+        # Run in its own session so the whole process group can be stopped together.
+        # The log relay, not this API process, owns the log file and rotates it, so a
+        # server left running across an API restart keeps logging.
+        spawn_span = start_span(deployment, "spawn")
+        relay_argv = [sys.executable, LOG_RELAY_PATH, log_file, str(LOG_MAX_BYTES), str(LOG_BACKUP_COUNT), "--"]
+        with open(log_file, "ab") as relay_output:
+            deployment_process = await asyncio.create_subprocess_exec(
+                *relay_argv, *argv,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=relay_output,
+                stderr=asyncio.subprocess.STDOUT,
+                env={**os.environ, **env_vars},
+                start_new_session=True
+            )
+        deployment["process"] = deployment_process
+        end_span(spawn_span)
+        set_deployment_state(deployment, "downloading")
+        readiness_task = asyncio.create_task(monitor_readiness(deployment))
+
+        return_code = await deployment_process.wait()
+
+        # Update deployment status based on return code
+        log.write(f"\nProcess exited with code {return_code}\n")
+        if deployment["status"] == "stopping":
+            log.write("Deployment stopped.\n")
+        elif return_code != 0:
+            log.write("Deployment failed. Check error messages above.\n")
+            set_deployment_state(deployment, "failed")
+        else:
+            log.write("Deployment completed successfully.\n")
+            set_deployment_state(deployment, "completed")
+
+    except asyncio.CancelledError:
+        process = deployment.get("process")
+        if process is not None and process.returncode is None and deployment["status"] != "stopping":
+            # The API is shutting down: leave the server running for the next API process to re-attach
+            if log is not None:
+                log.write("\nAPI shutting down; the model server keeps running.\n")
+        else:
+            if log is not None:
+                log.write("\nDeployment cancelled.\n")
+            if process is not None:
+                await terminate_process(process)
+        raise
+
+    except Exception as e:
+        error_msg = f"Error deploying model {model_id}: {str(e)}"
+        print(error_msg)
+
+        # Write error to log even if something went wrong
+        try:
+            if log is None:
+                log = DeploymentLog(log_file, "a")
+                deployment["log"] = log
+            log.write(f"\n\nERROR: {error_msg}\n")
+        except Exception:
+            pass
+
+        # Update deployment status to failed
+        set_deployment_state(deployment, "failed")
+
+    finally:
+        if readiness_task is not None:
+            readiness_task.cancel()
+        await release_deployment_resources(deployment)
+        if log is not None:
+            log.close()
+
+class AttachedProcess:
+    """Handle for a model server started by a previous API process.
+
+    Offers the pid/returncode/wait() subset of asyncio.subprocess.Process used
+    by the supervisor. The server is not our child, so its exit is observed
+    through a pidfd (or by polling) and its exit code is unknown (-1).
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+        self._exited = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            fd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self._poller = loop.create_task(self._poll())
+            return
+
+        def on_exit():
+            loop.remove_reader(fd)
+            os.close(fd)
+            self._mark_exited()
+        loop.add_reader(fd, on_exit)
+
+    async def _poll(self) -> None:
+        while is_pid_alive(self.pid):
+            await asyncio.sleep(ATTACHED_POLL_INTERVAL)
+        self._mark_exited()
+
+    def _mark_exited(self) -> None:
+        self.returncode = -1
+        self._exited.set()
+
+    async def wait(self) -> int:
+        await self._exited.wait()
+        return self.returncode
+
+def is_pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_deployment_process(pid: int, port: int) -> bool:
+    """Whether pid is still the model server started for port, and not a reused PID."""
+    if not is_pid_alive(pid):
+        return False
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            argv = f.read().decode("utf-8", errors="replace").split("\0")
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # No procfs (e.g. macOS): trust the PID
+        return True
+    if "swift.cli.deploy" not in argv and STUB_SERVER_PATH not in argv:
+        return False
+    return any(arg == "--port" and value == str(port) for arg, value in zip(argv, argv[1:]))
+
+async def supervise_attached_deployment(deployment: Dict[str, Any]) -> None:
+    """Supervise a re-attached model server until it exits.
+
+    Its log relay still writes the log file, so tailing simply resumes from
+    the current end of the file.
+    """
+    process = deployment["process"]
+    log = DeploymentLog(deployment["log_file"], "a", on_data=lambda chunk: detect_loading_phase(deployment, chunk))
+    deployment["log"] = log
+    log.write(f"\n=== Re-attached to PID {process.pid} after API restart "
+              f"({datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}) ===\n")
+    readiness_task = asyncio.create_task(monitor_readiness(deployment))
+    try:
+        await process.wait()
+        log.write("\nProcess exited (exit code unknown after re-attach)\n")
+        if deployment["status"] == "stopping":
+            log.write("Deployment stopped.\n")
+        else:
+            set_deployment_state(deployment, "failed")
+    finally:
+        readiness_task.cancel()
+        await release_deployment_resources(deployment)
+        log.close()
+
+def attach_deployment(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild a live replica from its stored record and resume supervising it."""
+    config = record["config"]
+    gpu_ids = record["gpu_ids"] or []
+    port_allocator.claim(record["port"])
+    gpu_scheduler.claim(record["replica_id"], gpu_ids, config.get("gpu_memory_utilization", 0.9))
+
+    deployment = register_deployment(record["model_id"], record["replica_id"], record["replica_index"],
+                                     record["port"], gpu_ids, config)
+    deployment.update({
+        "process": AttachedProcess(record["pid"]),
+        "command": record["command"] or "",
+        "log_file": record["log_file"] or deployment["log_file"],
+        "env_path": record["env_path"],
+        "served_model_name": record["served_model_name"],
+        "created_at": record["created_at"],
+        "status": record["state"],
+        "state_history": [{"state": record["state"], "at": time.time(), "reattached": True}]
+    })
+    if record["ready_at"] is not None:
+        deployment["ready_at"] = record["ready_at"]
+        deployment["time_to_ready"] = round(record["ready_at"] - record["created_at"], 3)
+    if deployment["status"] in SETTLED_STATES:
+        deployment["settled"].set()
+    persist_deployment(deployment)
+    deployment["task"] = asyncio.create_task(supervise_attached_deployment(deployment))
+    return deployment
+
+async def restore_deployments() -> None:
+    """Reconcile stored records with live processes after an API restart.
+
+    Replicas whose server process is still running (same PID, same deploy
+    command and port) are re-attached in place; every other record is dropped.
+    Models that were scaled to zero stay parked until their next request.
+    """
+    try:
+        records = await asyncio.to_thread(deployment_store.load)
+    except sqlite3.Error as e:
+        print(f"Could not read deployment store {STATE_DB_PATH}: {e}")
+        return
+
+    for record in records:
+        pid = record["pid"]
+        if record["state"] in ("failed", "completed", "stopped") or not pid \
+                or not is_deployment_process(pid, record["port"]):
+            print(f"Dropping stale deployment record {record['replica_id']} (state {record['state']})")
+            forget_deployment(record["replica_id"])
+            continue
+
+        deployment = attach_deployment(record)
+        listening = "listening" if is_port_in_use(record["port"]) else "not yet listening"
+        print(f"Re-attached {record['replica_id']} (PID {pid}, port {record['port']}, {listening}, "
+              f"state {deployment['status']})")
+
+    try:
+        parked_records = await asyncio.to_thread(deployment_store.load_parked)
+    except sqlite3.Error as e:
+        print(f"Could not read scaled-to-zero models from {STATE_DB_PATH}: {e}")
+        return
+    for parked in parked_records:
+        if parked["model_id"] in replica_groups:
+            # Woken by an API process that exited before it could forget the record
+            unpark_model(parked["model_id"])
+            continue
+        parked.update({"stopped": asyncio.Event(), "wake_task": None, "error": None})
+        parked["stopped"].set()
+        parked_models[parked["model_id"]] = parked
+        deployments_snapshot.touch()
+        print(f"Restored scaled-to-zero model {parked['model_id']}")
+
+def install_requirements(model_id: str) -> None:
+    """Install required packages for the model - now only used for system-wide installation"""
+    try:
+        model_config = find_model_config(model_id)
+        requires = model_config.get("requires", "-")
+
+        if requires != "-" and requires:
+            # Log the requirements
+            print(f"Model requirements for {model_id}: {requires}")
+
+    except Exception as e:
+        print(f"Error processing requirements for {model_id}: {str(e)}")
+        raise
+
+@app.post("/deploy", response_model=DeploymentStatus)
+async def deploy_model(deploy_request: DeployRequest):
+    """Deploy a model with the specified parameters
+
+    `replicas` is the number of copies the model should have. Replicas that
+    already exist count towards it; missing ones are started on their own
+    port. With `gpu_id="auto"` each replica is bin-packed onto GPUs with room
+    for its gpu_memory_utilization; otherwise replica i uses `gpu_ids[i]`, or
+    `gpu_id + i * tensor_parallel_size`. Requests that do not fit are refused,
+    or queued when `on_no_capacity="queue"`.
+
+    On a coordinator the replicas are placed on nodes instead (see
+    cluster_deploy), or all on `node` when it is given.
+
+    Deploys of the same model are serialized, so concurrent or retried
+    requests never start more replicas than asked for.
+    """
+    if NODE_ROLE == "coordinator":
+        return await cluster_deploy(deploy_request)
+    async with get_deploy_lock(deploy_request.model_id):
+        return await start_replicas(deploy_request)
+
+async def start_replicas(deploy_request: DeployRequest) -> DeploymentStatus:
+    """Start the replicas a deploy request is missing. Callers hold the model's deploy lock."""
+    try:
+        model_id = deploy_request.model_id
+        if deploy_request.replicas < 1:
+            raise HTTPException(status_code=400, detail="replicas must be at least 1")
+        if deploy_request.tensor_parallel_size < 1:
+            raise HTTPException(status_code=400, detail="tensor_parallel_size must be at least 1")
+        if deploy_request.on_no_capacity not in ("reject", "queue"):
+            raise HTTPException(status_code=400, detail="on_no_capacity must be 'reject' or 'queue'")
+        if deploy_request.max_in_flight is not None and deploy_request.max_in_flight < 0:
+            raise HTTPException(status_code=400, detail="max_in_flight must be 0 (unlimited) or more")
+        if deploy_request.idle_timeout is not None and deploy_request.idle_timeout < 0:
+            raise HTTPException(status_code=400, detail="idle_timeout must be 0 (never) or a number of seconds")
+        gpu_id = deploy_request.gpu_id
+        if isinstance(gpu_id, str) and gpu_id.isdigit():
+            gpu_id = int(gpu_id)
+        auto_placement = isinstance(gpu_id, str)
+        if auto_placement and gpu_id != "auto":
+            raise HTTPException(status_code=400, detail="gpu_id must be a GPU index or 'auto'")
+
+        # Check if model is already deployed with enough replicas
+        existing = [active_deployments[r] for r in replica_groups.get(model_id, [])]
+        if len(existing) >= deploy_request.replicas:
+            # A park whose stops failed partway leaves replicas behind; they now serve the model again
+            unpark_model(model_id)
+            first = existing[0]
+            return DeploymentStatus(
+                status="already_deployed",
+                model_id=model_id,
+                deployment_command=first["command"],
+                log_file=first["log_file"],
+                port=first["port"],
+                gpu_id=first["gpu_id"],
+                env_path=first.get("env_path"),
+                replica_id=first["replica_id"],
+                replicas=[replica_summary(d) for d in existing]
+            )
+
+        # Find model in config
+        model_config = find_model_config(model_id)
+
+        tp_size = deploy_request.tensor_parallel_size
+        fraction = deploy_request.gpu_memory_utilization
+        started = []
+        shortfall = None
+        used_indexes = {d["replica_index"] for d in existing}
+        next_index = 0
+        for _ in range(deploy_request.replicas - len(existing)):
+            while next_index in used_indexes:
+                next_index += 1
+            index = next_index
+            used_indexes.add(index)
+            replica_id = get_replica_id(model_id, index)
+
+            # Place on GPUs first so a refused request holds no port
+            if auto_placement:
+                try:
+                    gpu_ids = await gpu_scheduler.place(replica_id, fraction, tp_size)
+                except Exception as e:
+                    raise HTTPException(status_code=503, detail=f"GPU probe failed: {e}")
+                if gpu_ids is None and deploy_request.on_no_capacity == "reject":
+                    if started:
+                        shortfall = f"no GPU placement fits {tp_size} x {fraction} of GPU memory"
+                        break
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"No GPU placement fits {tp_size} x {fraction} of GPU memory. "
+                               "Stop some deployments or retry with on_no_capacity='queue'."
+                    )
+            else:
+                if deploy_request.gpu_ids and index < len(deploy_request.gpu_ids):
+                    first_gpu = deploy_request.gpu_ids[index]
+                else:
+                    first_gpu = gpu_id + index * tp_size
+                gpu_ids = list(range(first_gpu, first_gpu + tp_size))
+                try:
+                    gpu_scheduler.reserve(replica_id, gpu_ids, fraction)
+                except ValueError as e:
+                    if started:
+                        shortfall = str(e)
+                        break
+                    raise HTTPException(status_code=409, detail=str(e))
+
+            # Select port - either user-specified (first new replica only) or auto-assigned
+            requested_port = deploy_request.port if not started else None
+            try:
+                port = find_available_port(requested_port)
+                # Log if we had to change the port
+                if requested_port and port != requested_port:
+                    print(f"Requested port {requested_port} was unavailable. Using port {port} instead.")
+            except ValueError as e:
+                gpu_scheduler.release(replica_id)
+                if started:
+                    shortfall = str(e)
+                    break
+                raise HTTPException(status_code=500, detail=str(e))
+
+            # Register before starting so concurrent requests see the deployment
+            deployment = register_deployment(model_id, replica_id, index, port, gpu_ids, get_deploy_config(
+                deploy_request.max_model_len, deploy_request.vision_batch_size, fraction,
+                deploy_request.isolate_env, tp_size, auto_placement,
+                deploy_request.idle_timeout, deploy_request.always_warm, deploy_request.max_in_flight
+            ))
+            if gpu_ids is None:
+                set_deployment_state(deployment, "queued")
+            deployment["task"] = asyncio.create_task(deploy_model_task(
+                model_id=model_id,
+                gpu_id=gpu_ids[0] if gpu_ids else None,
+                max_model_len=deploy_request.max_model_len,
+                vision_batch_size=deploy_request.vision_batch_size,
+                gpu_memory_utilization=fraction,
+                port=port,
+                isolate_env=deploy_request.isolate_env,
+                replica_id=replica_id,
+                gpu_ids=gpu_ids,
+                tensor_parallel_size=tp_size,
+                placement_timeout=deploy_request.queue_timeout
+            ))
+            started.append(deployment)
+
+        # A deploy of a scaled-to-zero model replaces its parked configuration
+        unpark_model(model_id)
+
+        # Keep the replicas that did start, but say why the others did not
+        replicas = existing + started
+        message = None
+        if shortfall is not None:
+            message = (f"Started {len(replicas)} of {deploy_request.replicas} requested replicas: "
+                       f"{shortfall}")
+            print(f"{model_id}: {message}")
+
+        # Build the command for display
+        first = started[0]
+        env_vars, argv = build_deploy_command(
+            model_id, model_config, first["gpu_ids"] or [],
+            deploy_request.max_model_len or (2048 if model_config["is_multimodal"] else 4096),
+            deploy_request.vision_batch_size, fraction, first["port"],
+            tensor_parallel_size=tp_size
+        )
+
+        return DeploymentStatus(
+            status=first["status"] if first["status"] == "queued" else "deploying",
+            model_id=model_id,
+            deployment_command=format_deploy_command(env_vars, argv),
+            log_file=first["log_file"],
+            port=first["port"],
+            gpu_id=first["gpu_id"],
+            gpu_ids=first["gpu_ids"],
+            replica_id=first["replica_id"],
+            replicas=[replica_summary(d) for d in replicas],
+            requested_replicas=deploy_request.replicas,
+            message=message
+        )
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Deployment error: {str(e)}")
+
+def replica_summary(deployment: Dict[str, Any]) -> Dict[str, Any]:
+    """Short view of a replica for deploy responses"""
+    return {
+        "replica_id": deployment["replica_id"],
+        "port": deployment["port"],
+        "gpu_id": deployment["gpu_id"],
+        "gpu_ids": deployment["gpu_ids"],
+        "status": deployment["status"]
+    }
+
+def deployment_to_dict(deployment: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a deployment (replica) record"""
+    # Lifecycle states are explicit; only a vanished process needs reporting here
+    status = deployment.get("status", "unknown")
+    process = deployment.get("process")
+    if process is not None and process.returncode is not None and status not in SETTLED_STATES + ("stopping",):
+        status = f"exited (code: {process.returncode})"
+
+    return {
+        "status": status,
+        "model_id": deployment["model_id"],
+        "replica_id": deployment["replica_id"],
+        "replica_index": deployment["replica_index"],
+        "deployment_command": deployment["command"],
+        "log_file": deployment["log_file"],
+        "port": deployment["port"],
+        "gpu_id": deployment["gpu_id"],
+        "gpu_ids": deployment["gpu_ids"],
+        "env_path": deployment.get("env_path"),
+        "served_model_name": deployment.get("served_model_name"),
+        "max_model_len": deployment.get("max_model_len") or command_max_model_len(deployment["command"]),
+        "outstanding_requests": deployment["outstanding"],
+        "total_requests": deployment["total_requests"],
+        "affinity_hits": deployment["affinity_hits"],
+        "affinity_spills": deployment["affinity_spills"],
+        "idle_timeout": get_idle_timeout(deployment),
+        "always_warm": is_always_warm(deployment),
+        "last_request_at": deployment.get("last_request_at"),
+        "cold_starts": cold_start_stats.get(deployment["model_id"]),
+        "ejected": deployment["ejected_until"] > time.monotonic(),
+        "created_at": deployment.get("created_at"),
+        "ready_at": deployment.get("ready_at"),
+        "time_to_ready": deployment.get("time_to_ready"),
+        "state_history": deployment.get("state_history", [])
+    }
+
+def command_max_model_len(command: str) -> Optional[int]:
+    """--max_model_len of a deploy command, for replicas re-attached after a restart"""
+    try:
+        argv = shlex.split(command or "")
+    except ValueError:
+        return None
+    for arg, value in zip(argv, argv[1:]):
+        if arg == "--max_model_len" and value.isdigit():
+            return int(value)
+    return None
+
+def group_status(replicas: List[Dict[str, Any]]) -> str:
+    """Aggregate lifecycle state of a model's replicas"""
+    states = [d["status"] for d in replicas]
+    if all(state == "ready" for state in states):
+        return "ready"
+    if any(state in ("ready", "degraded") for state in states):
+        return "degraded"
+    if all(state == "failed" for state in states):
+        return "failed"
+    # Report the replica that is furthest behind
+    for state in ("queued", "deploying", "building_env", "downloading", "loading", "stopping"):
+        if state in states:
+            return state
+    return states[0]
+
+def group_to_dict(model_id: str) -> Dict[str, Any]:
+    """Public view of all replicas of a model"""
+    replicas = [deployment_to_dict(active_deployments[r]) for r in replica_groups[model_id]]
+    first = replicas[0]
+    return {
+        "status": group_status([active_deployments[r] for r in replica_groups[model_id]]),
+        "model_id": model_id,
+        "settled": all(active_deployments[r]["settled"].is_set() for r in replica_groups[model_id]),
+        "port": first["port"],
+        "gpu_id": first["gpu_id"],
+        "log_file": first["log_file"],
+        "max_model_len": first["max_model_len"],
+        "time_to_ready": first["time_to_ready"],
+        "replicas": replicas
+    }
+
+@app.get("/deployments")
+async def get_deployments(request: Request):
+    """Get all active deployments, one entry per replica, then models scaled to zero
+
+    On a coordinator, the deployments of every node, each with its `node_id`.
+    Served from a snapshot (see DeploymentsSnapshot), so request counters may
+    lag by up to POLARIS_SNAPSHOT_INTERVAL; supports If-None-Match.
+    """
+    body, etag = deployments_snapshot.get()
+    return cached_json_response(request, body, etag)
+
+def find_replica(model_id: str, replica: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Look up a replica by replica_id, or by model_id and replica index (default: the first)."""
+    if model_id in active_deployments:
+        return active_deployments[model_id]
+    for replica_id in replica_groups.get(model_id, []):
+        deployment = active_deployments[replica_id]
+        if replica is None or deployment["replica_index"] == replica:
+            return deployment
+    return None
+
+def format_sse(data: str, event: Optional[str] = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {data}\n\n"
+
+@app.get("/deployments/{model_id:path}/logs")
+async def get_deployment_logs(request: Request, model_id: str, tail: int = 100, follow: bool = False,
+                              replica: Optional[int] = None, node: Optional[str] = None):
+    """Recent log lines of a deployment, as text or followed live over SSE
+
+    `model_id` may also be a replica_id; for a model with several replicas,
+    `replica` picks one by index. Lines come from an in-memory buffer of the
+    last LOG_RING_LINES lines, fed by tailing the file the server writes to.
+    On a coordinator the logs come from `node`, or the first node with the model.
+    """
+    if NODE_ROLE == "coordinator":
+        params = {"tail": tail, "follow": str(follow).lower()}
+        if replica is not None:
+            params["replica"] = replica
+        return await forward_to_node(find_model_nodes(model_id, node)[0], "GET", f"/deployments/{model_id}/logs",
+                                     params, timeout=None if follow else NODE_REQUEST_TIMEOUT)
+    deployment = find_replica(model_id, replica)
+    if deployment is None:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} not found in active deployments")
+    log = deployment.get("log")
+    tail = max(0, min(tail, LOG_RING_LINES))
+
+    if not follow:
+        lines = list(log.lines)[-tail:] if log is not None and tail else []
+        return Response(content="".join(f"{line}\n" for line in lines), media_type="text/plain")
+
+    async def stream_log():
+        # Wait for the log if the deployment has not opened it yet
+        while deployment.get("log") is None:
+            if await request.is_disconnected() or deployment["replica_id"] not in active_deployments:
+                return
+            await asyncio.sleep(LOG_POLL_INTERVAL)
+        log = deployment["log"]
+        queue = log.follow()
+        try:
+            for line in (list(log.lines)[-tail:] if tail else []):
+                yield format_sse(line)
+            if log.closed:
+                yield format_sse(deployment["status"], event="end")
+                return
+            while True:
+                try:
+                    line = await asyncio.wait_for(queue.get(), timeout=LOG_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if line is None:
+                    yield format_sse(deployment["status"], event="end")
+                    return
+                yield format_sse(line)
+        finally:
+            log.unfollow(queue)
+
+    return StreamingResponse(stream_log(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/deployments/{model_id:path}/timeline")
+async def get_deployment_timeline(model_id: str, history: int = 10, node: Optional[str] = None):
+    """Per-phase timeline of a model's deploy, with earlier deploys of the same model
+
+    `current` has one timeline per live replica (or just the replica when
+    `model_id` is a replica_id); `history` lists the most recent settled
+    deploys recorded in the state store, newest first. On a coordinator the
+    timeline comes from `node`, or the first node with the model.
+    """
+    if NODE_ROLE == "coordinator":
+        return await forward_to_node(find_model_nodes(model_id, node)[0], "GET", f"/deployments/{model_id}/timeline",
+                                     {"history": history})
+    if model_id in active_deployments:
+        current = [timeline_to_dict(active_deployments[model_id])]
+        model_id = active_deployments[model_id]["model_id"]
+    else:
+        current = [timeline_to_dict(active_deployments[r]) for r in replica_groups.get(model_id, [])]
+
+    live = {(t["replica_id"], t["created_at"]) for t in current}
+    history = max(0, min(history, TIMELINE_HISTORY_LIMIT))
+    try:
+        records = await asyncio.to_thread(deployment_store.load_timelines, model_id, history + len(live))
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Error reading timelines: {e}")
+    previous = [r for r in records if (r["replica_id"], r["created_at"]) not in live][:history]
+
+    if not current and not previous:
+        raise HTTPException(status_code=404, detail=f"No deploys of {model_id} have been recorded")
+    return {"model_id": model_id, "current": current, "history": previous}
+
+@app.get("/deployments/{model_id:path}")
+async def get_deployment(model_id: str, wait_until_ready: bool = False, timeout: float = 60.0,
+                         node: Optional[str] = None):
+    """Get a model's replicas (or a single replica by replica_id)
+
+    With `wait_until_ready=true` the request is held for up to `timeout` seconds
+    (capped at MAX_WAIT_TIMEOUT) and returns as soon as every replica is ready
+    or has failed. On a coordinator the replicas of every node (or of `node`)
+    are merged into one group.
+    """
+    if NODE_ROLE == "coordinator":
+        return await cluster_get_deployment(model_id, node, wait_until_ready, timeout)
+    if model_id in active_deployments:
+        replica_ids = [model_id]
+    elif model_id in replica_groups:
+        replica_ids = list(replica_groups[model_id])
+    elif model_id in parked_models:
+        return parked_to_dict(parked_models[model_id])
+    else:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} not found in active deployments")
+
+    if wait_until_ready:
+        waiters = [active_deployments[r]["settled"].wait() for r in replica_ids]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiters), timeout=min(max(timeout, 0), MAX_WAIT_TIMEOUT))
+        except asyncio.TimeoutError:
+            pass
+
+    if model_id in active_deployments:
+        return deployment_to_dict(active_deployments[model_id])
+    if model_id not in replica_groups:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} was stopped")
+    return group_to_dict(model_id)
+
+async def stop_replica(replica_id: str) -> None:
+    """Stop one replica and remove it from its model's group"""
+    deployment = active_deployments[replica_id]
+    set_deployment_state(deployment, "stopping")
+
+    # Terminate the process, or cancel a deployment that is still setting up
+    if deployment.get("process") is not None:
+        await terminate_process(deployment["process"])
+    elif deployment.get("task") is not None and not deployment["task"].done():
+        deployment["task"].cancel()
+
+    # Remove from active deployments
+    set_deployment_state(deployment, "stopped")
+    active_deployments.pop(replica_id, None)
+    forget_deployment(replica_id)
+    group = replica_groups.get(deployment["model_id"])
+    if group is not None:
+        if replica_id in group:
+            group.remove(replica_id)
+        if not group:
+            del replica_groups[deployment["model_id"]]
+
+@app.delete("/deployments/{model_id:path}")
+async def stop_deployment(model_id: str, node: Optional[str] = None):
+    """Stop all replicas of a model, or a single replica by replica_id
+
+    Stopping a model also drops its scaled-to-zero configuration, so it is not
+    redeployed on the next request. On a coordinator the model is stopped on
+    every node that runs it, or only on `node`.
+    """
+    if NODE_ROLE == "coordinator":
+        return await cluster_stop_deployment(model_id, node)
+    owner = active_deployments[model_id]["model_id"] if model_id in active_deployments else model_id
+    async with get_deploy_lock(owner):
+        return await stop_replicas(model_id)
+
+async def stop_replicas(model_id: str) -> Dict[str, Any]:
+    """Stop a model or one replica. Callers hold the model's deploy lock."""
+    parked = unpark_model(model_id)
+    if model_id in active_deployments:
+        replica_ids = [model_id]
+    elif model_id in replica_groups:
+        replica_ids = list(replica_groups[model_id])
+    elif parked is not None:
+        return {"status": "stopped", "model_id": model_id, "replicas": []}
+    else:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} not found in active deployments")
+
+    try:
+        await asyncio.gather(*(stop_replica(r) for r in replica_ids))
+        return {"status": "stopped", "model_id": model_id, "replicas": replica_ids}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error stopping deployment: {str(e)}")
+
+def cached_json_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve a pre-serialized JSON body, honoring If-None-Match."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/models", response_model=List[Dict[str, Any]])
+async def list_models(request: Request, type: Optional[str] = None, family: Optional[str] = None,
+                      modality: Optional[str] = None):
+    """List all available models with enhanced metadata
+
+    Supports filtering by `type` (e.g. vision), `family` (e.g. qwen) and
+    `modality` (multimodal or text).
+    """
+    body, etag = model_catalog.render(type, family, modality)
+    return cached_json_response(request, body, etag)
+
+@app.get("/models/families")
+async def list_model_families(request: Request, type: Optional[str] = None, family: Optional[str] = None,
+                              modality: Optional[str] = None):
+    """List models grouped by family, in config order, with the same filters as /models"""
+    body, etag = model_catalog.render_families(type, family, modality)
+    return cached_json_response(request, body, etag)
+
+@app.post("/metadata/warm")
+async def warm_metadata(warm_request: WarmMetadataRequest):
+    """Pre-populate the model metadata cache so deploys never wait on the hub"""
+    results = await asyncio.to_thread(warm_model_metadata, warm_request.model_ids, warm_request.refresh)
+    return {
+        "status": "warmed",
+        "cache_dir": METADATA_CACHE_DIR,
+        "cached": len(results["cached"]),
+        "fetched": len(results["fetched"]),
+        "failed": results["failed"]
+    }
+
+@app.get("/metadata/{model_id:path}")
+async def get_metadata(model_id: str):
+    """Cached metadata for one model"""
+    metadata = read_model_metadata(model_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail=f"No cached metadata for {model_id}")
+    return metadata
+
+@app.get("/gpus")
+async def get_gpus():
+    """Show per-GPU free memory, reservations and queued placements (per node on a coordinator)"""
+    if NODE_ROLE == "coordinator":
+        return [{"node_id": node["node_id"], "status": "live" if is_node_live(node) else "lost", **node["gpus"]}
+                for node in cluster_nodes.values()]
+    return await gpu_scheduler.snapshot()
+
+@app.get("/ports")
+async def get_port_pool():
+    """Show model server port pool utilization (per node on a coordinator)"""
+    if NODE_ROLE == "coordinator":
+        return [{"node_id": node["node_id"], "status": "live" if is_node_live(node) else "lost", **node["ports"]}
+                for node in cluster_nodes.values()]
+    return port_allocator.stats()
+
+def collect_deployment_states():
+    counts = collections.Counter(d["status"] for d in active_deployments.values())
+    return [((state,), count) for state, count in counts.items()]
+
+def collect_gpu_deployments():
+    counts = collections.Counter(gpu for gpu_ids, _ in gpu_scheduler.reservations.values() for gpu in gpu_ids)
+    return [((gpu,), count) for gpu, count in sorted(counts.items())]
+
+def collect_gpu_reserved_fraction():
+    gpus = {gpu for gpu_ids, _ in gpu_scheduler.reservations.values() for gpu in gpu_ids}
+    return [((gpu,), round(gpu_scheduler.reserved_fraction(gpu), 4)) for gpu in sorted(gpus)]
+
+Gauge("polaris_deployments", "Replicas by lifecycle state", ("state",), collect_deployment_states)
+Gauge("polaris_gpu_deployments", "Replicas holding a reservation on each GPU", ("gpu",), collect_gpu_deployments)
+Gauge("polaris_gpu_reserved_fraction", "Fraction of each GPU's memory reserved by replicas", ("gpu",),
+      collect_gpu_reserved_fraction)
+Gauge("polaris_gpu_placements_waiting", "Replicas queued for GPU capacity", (),
+      lambda: [((), gpu_scheduler.waiting)])
+Gauge("polaris_ports_reserved", "Model server ports reserved from the pool", (),
+      lambda: [((), port_allocator.stats()["reserved"])])
+Gauge("polaris_admission_in_flight", "Gateway requests holding an in-flight slot", ("model_id",),
+      lambda: [((c.model_id,), c.in_flight) for c in admission_controllers.values()])
+Gauge("polaris_admission_queue_depth", "Gateway requests waiting for an in-flight slot", ("model_id", "priority"),
+      lambda: [((c.model_id, p), len(q)) for c in admission_controllers.values() for p, q in c.queues.items()])
+Gauge("polaris_scaled_to_zero_models", "Models stopped for idleness that wake on the next request", (),
+      lambda: [((), len(parked_models))])
+Gauge("polaris_gateway_cache_bytes", "Bytes held by the gateway response cache", (),
+      lambda: [((), response_cache.snapshot()["bytes"])])
+Gauge("polaris_cluster_nodes", "Nodes registered with the coordinator, live or lost", ("status",),
+      lambda: [((status,), count) for status, count in
+               collections.Counter("live" if is_node_live(n) else "lost" for n in cluster_nodes.values()).items()])
+Gauge("polaris_replica_outstanding_requests", "Gateway requests in flight per replica", ("replica_id",),
+      lambda: [((d["replica_id"],), d["outstanding"]) for d in active_deployments.values()])
+
+class RequestMetricsMiddleware:
+    """Count and time HTTP requests by route template, without wrapping the response body."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            http_requests.inc(method=scope["method"], route=path, status=status)
+            http_request_seconds.observe(time.perf_counter() - start, method=scope["method"], route=path)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Control-plane metrics in the Prometheus text exposition format"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.on_event("startup")
+async def start_supervisor():
+    """Prepare the event loop to supervise deployment processes"""
+    # Before 3.12 the default child watcher starts one waitpid thread per process
+    if sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+        try:
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(asyncio.get_running_loop())
+            asyncio.set_child_watcher(watcher)
+        except OSError as e:
+            print(f"pidfd child watcher unavailable, using default: {e}")
+
+    if NODE_ROLE not in ("standalone", "agent", "coordinator"):
+        raise RuntimeError(f"POLARIS_ROLE must be standalone, agent or coordinator, not {NODE_ROLE!r}")
+    if NODE_ROLE == "agent":
+        if not COORDINATOR_URL:
+            raise RuntimeError("POLARIS_ROLE=agent needs POLARIS_COORDINATOR_URL")
+        app.state.heartbeat = asyncio.create_task(send_heartbeats())
+
+    app.state.log_tailer = asyncio.create_task(tail_deployment_logs())
+    app.state.snapshot_refresher = asyncio.create_task(deployments_snapshot.refresh())
+    app.state.idle_reaper = asyncio.create_task(reap_idle_deployments())
+    await restore_deployments()
+
+@app.on_event("shutdown")
+async def stop_supervisor():
+    """Release shared resources held by the supervisor"""
+    await probe_client.aclose()
+    await cluster_client.aclose()
+    for port in list(upstream_clients):
+        await close_upstream_client(port)
+    deployment_store.close()
+
+def openai_error(status_code: int, message: str, error_type: str = "invalid_request_error",
+                 headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """Error response in the OpenAI API format"""
+    return JSONResponse(status_code=status_code, headers=headers, content={
+        "error": {"message": message, "type": error_type, "code": status_code}
+    })
+
+def get_idle_timeout(deployment: Dict[str, Any]) -> float:
+    idle_timeout = deployment["config"].get("idle_timeout")
+    return IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+
+def is_always_warm(deployment: Dict[str, Any]) -> bool:
+    return bool(deployment["config"].get("always_warm")) or deployment["model_id"] in ALWAYS_WARM_MODELS
+
+def is_idle(replicas: List[Dict[str, Any]], now: float) -> bool:
+    """Whether a model has been serving nothing for longer than its idle timeout"""
+    first = replicas[0]
+    idle_timeout = get_idle_timeout(first)
+    if idle_timeout <= 0 or is_always_warm(first) or warming_waiters[first["model_id"]]:
+        return False
+    if any(d["status"] not in ("ready", "degraded") or d["outstanding"] for d in replicas):
+        return False
+    last_active = max(d["last_request_at"] or d["ready_at"] or d["created_at"] for d in replicas)
+    return now - last_active >= idle_timeout
+
+def parked_request(model_id: str, replicas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """DeployRequest fields that bring a model back the way it was running"""
+    config = replicas[0]["config"]
+    request = {
+        "model_id": model_id,
+        "max_model_len": config.get("max_model_len"),
+        "vision_batch_size": config.get("vision_batch_size"),
+        "gpu_memory_utilization": config.get("gpu_memory_utilization", 0.9),
+        "isolate_env": config.get("isolate_env", True),
+        "replicas": len(replicas),
+        "tensor_parallel_size": config.get("tensor_parallel_size", 1),
+        "idle_timeout": config.get("idle_timeout"),
+        "always_warm": bool(config.get("always_warm")),
+        "max_in_flight": config.get("max_in_flight")
+    }
+    if config.get("auto_placement"):
+        # The GPUs may have gone to another model meanwhile: wait for room rather than fail
+        request.update({"gpu_id": "auto", "on_no_capacity": "queue", "queue_timeout": COLD_START_TIMEOUT})
+    else:
+        ordered = sorted(replicas, key=lambda d: d["replica_index"])
+        request["gpu_ids"] = [d["gpu_ids"][0] for d in ordered if d["gpu_ids"]] or None
+    return request
+
+async def park_model(model_id: str) -> None:
+    """Scale a model to zero: stop its replicas but keep what is needed to redeploy it."""
+    replicas = [active_deployments[r] for r in replica_groups[model_id]]
+    parked = {
+        "model_id": model_id,
+        "request": parked_request(model_id, replicas),
+        "served_model_name": replicas[0].get("served_model_name"),
+        "parked_at": time.time(),
+        "stopped": asyncio.Event(),
+        "wake_task": None,
+        "error": None
+    }
+    parked_models[model_id] = parked
+    deployments_snapshot.touch()
+    try:
+        deployment_store.save_parked(parked)
+    except sqlite3.Error as e:
+        print(f"Error persisting scaled-to-zero model {model_id}: {e}")
+    print(f"Scaling {model_id} to zero after {get_idle_timeout(replicas[0]):.0f}s without requests")
+    for deployment in replicas:
+        if deployment.get("log") is not None and not deployment["log"].closed:
+            deployment["log"].write("\nIdle timeout reached; scaling to zero.\n")
+    try:
+        await asyncio.gather(*(stop_replica(d["replica_id"]) for d in replicas))
+    finally:
+        parked["stopped"].set()
+
+def unpark_model(model_id: str) -> Optional[Dict[str, Any]]:
+    """Forget the scaled-to-zero configuration of a model, if it has one."""
+    parked = parked_models.pop(model_id, None)
+    if parked is not None:
+        deployments_snapshot.touch()
+        try:
+            deployment_store.delete_parked(model_id)
+        except sqlite3.Error as e:
+            print(f"Error removing scaled-to-zero model {model_id} from the store: {e}")
+    return parked
+
+def parked_to_dict(parked: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a model that is scaled to zero"""
+    request = parked["request"]
+    return {
+        "status": "scaled_to_zero",
+        "model_id": parked["model_id"],
+        "replica_id": None,
+        "replica_index": None,
+        "port": None,
+        "gpu_ids": request.get("gpu_ids"),
+        "served_model_name": parked["served_model_name"],
+        "parked_at": parked["parked_at"],
+        "replicas": request["replicas"],
+        "idle_timeout": IDLE_TIMEOUT if request.get("idle_timeout") is None else request["idle_timeout"],
+        "waking": parked["wake_task"] is not None and not parked["wake_task"].done(),
+        "last_wake_error": parked["error"],
+        "cold_starts": cold_start_stats.get(parked["model_id"])
+    }
+
+def record_cold_start(model_id: str, seconds: float) -> None:
+    cold_start_seconds.observe(seconds, model_id=model_id)
+    stats = cold_start_stats.setdefault(model_id, {"count": 0, "last_seconds": None, "mean_seconds": None})
+    stats["count"] += 1
+    stats["last_seconds"] = round(seconds, 3)
+    total = (stats["mean_seconds"] or 0) * (stats["count"] - 1) + seconds
+    stats["mean_seconds"] = round(total / stats["count"], 3)
+
+async def wake_model(model_id: str) -> None:
+    """Redeploy a scaled-to-zero model with the configuration it was parked with."""
+    parked = parked_models[model_id]
+    requested_at = time.time()
+    await parked["stopped"].wait()
+    print(f"Cold-starting {model_id}")
+    try:
+        await deploy_model(DeployRequest(**parked["request"]))
+    except HTTPException as e:
+        parked["error"] = e.detail
+        print(f"Cold start of {model_id} failed: {e.detail}")
+        return
+    for replica_id in replica_groups.get(model_id, []):
+        deployment = active_deployments[replica_id]
+        deployment["cold_start_at"] = requested_at
+        # Keep resolving the served name while the new replicas load
+        deployment["served_model_name"] = deployment["served_model_name"] or parked["served_model_name"]
+
+def starting_without_ready(model_id: str) -> bool:
+    replicas = [active_deployments[r] for r in replica_groups.get(model_id, [])]
+    return bool(replicas) and not any(d["status"] in ("ready", "degraded") for d in replicas) \
+        and any(d["status"] in STARTING_STATES for d in replicas)
+
+async def wait_for_model(model_id: str) -> Optional[JSONResponse]:
+    """Hold a gateway request until a replica of model_id is ready, waking it if it is scaled to zero.
+
+    At most COLD_START_QUEUE_SIZE requests wait per model and none waits longer
+    than COLD_START_TIMEOUT; the rest are refused with 503 and Retry-After.
+
+    Returns:
+        None once a replica is ready, otherwise the error response to send
+    """
+    retry_after = {"Retry-After": str(int(IDLE_CHECK_INTERVAL))}
+    if warming_waiters[model_id] >= COLD_START_QUEUE_SIZE:
+        cold_start_rejections.inc(model_id=model_id, reason="queue_full")
+        return openai_error(503, f"Model {model_id} is starting and its request queue is full",
+                            "unavailable_error", retry_after)
+
+    parked = parked_models.get(model_id)
+    if parked is not None and (parked["wake_task"] is None or parked["wake_task"].done()):
+        parked["error"] = None
+        parked["wake_task"] = asyncio.create_task(wake_model(model_id))
+
+    warming_waiters[model_id] += 1
+    deadline = time.monotonic() + COLD_START_TIMEOUT
+    try:
+        while True:
+            parked = parked_models.get(model_id)
+            wake_task = parked["wake_task"] if parked is not None else None
+            if parked is not None and wake_task.done():
+                cold_start_rejections.inc(model_id=model_id, reason="deploy_failed")
+                return openai_error(503, f"Model {model_id} could not be started: {parked['error']}",
+                                    "unavailable_error", retry_after)
+            replicas = [active_deployments[r] for r in replica_groups.get(model_id, [])]
+            if any(d["status"] in ("ready", "degraded") for d in replicas):
+                return None
+            starting = [d for d in replicas if not d["settled"].is_set()]
+            if parked is None and not starting:
+                cold_start_rejections.inc(model_id=model_id, reason="deploy_failed")
+                return openai_error(503, f"Model {model_id} failed to start", "unavailable_error")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                cold_start_rejections.inc(model_id=model_id, reason="timeout")
+                return openai_error(503, f"Model {model_id} did not become ready within {COLD_START_TIMEOUT:.0f}s",
+                                    "unavailable_error", retry_after)
+            waiters = [asyncio.ensure_future(d["settled"].wait()) for d in starting]
+            await asyncio.wait(waiters + ([wake_task] if wake_task is not None else []),
+                               timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+    finally:
+        warming_waiters[model_id] -= 1
+
+async def reap_idle_deployments() -> None:
+    """Periodically scale models that have been idle past their timeout to zero."""
+    while True:
+        await asyncio.sleep(IDLE_CHECK_INTERVAL)
+        now = time.time()
+        for model_id, replica_ids in list(replica_groups.items()):
+            if model_id in parked_models:
+                continue
+            replicas = [active_deployments[r] for r in replica_ids]
+            if not replicas or not is_idle(replicas, now):
+                continue
+            async with get_deploy_lock(model_id):
+                # A deploy or stop may have run while we waited for the lock
+                replicas = [active_deployments[r] for r in replica_groups.get(model_id, [])]
+                if model_id in parked_models or not replicas or not is_idle(replicas, time.time()):
+                    continue
+                try:
+                    await park_model(model_id)
+                except Exception as e:
+                    print(f"Error scaling {model_id} to zero: {e}")
+
+def resolve_model(model_name: str) -> Optional[str]:
+    """Find the model_id whose replicas serve a model, by model_id or served model name."""
+    if model_name in replica_groups:
+        return model_name
+    for model_id, replica_ids in replica_groups.items():
+        for replica_id in replica_ids:
+            if active_deployments[replica_id].get("served_model_name") == model_name:
+                return model_id
+    if model_name in parked_models:
+        return model_name
+    for model_id, parked in parked_models.items():
+        if parked["served_model_name"] == model_name:
+            return model_id
+    return None
+
+def normalize_prompt_text(content: Any) -> str:
+    """Flatten message content (a string or a list of parts) to whitespace-normalized text"""
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, dict):
+                value = part.get("text") or part.get("image_url") or part.get("audio_url") or part.get("video_url")
+                parts.append(value.get("url", "") if isinstance(value, dict) else str(value or ""))
+            else:
+                parts.append(str(part))
+        content = " ".join(parts)
+    return " ".join(str(content or "").split())
+
+def prompt_affinity_key(body: Dict[str, Any]) -> Optional[str]:
+    """Hash of the leading slice of a prompt that a backend's prefix cache could reuse.
+
+    For chat requests this is everything before the newest message, so every
+    turn of a conversation, and every request sharing a system prompt, maps
+    to the same key. A single-message request uses the message itself.
+    """
+    if isinstance(body.get("messages"), list) and body["messages"]:
+        messages = body["messages"]
+        history = messages[:-1] or messages
+        text = "\n".join(f"{m.get('role', '')}: {normalize_prompt_text(m.get('content'))}"
+                          for m in history if isinstance(m, dict))
+    elif isinstance(body.get("prompt"), str):
+        text = normalize_prompt_text(body["prompt"])
+    else:
+        return None
+    if not text:
+        return None
+    return hashlib.sha1(text[:AFFINITY_PREFIX_CHARS].encode("utf-8")).hexdigest()
+
+def ring_point(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+@functools.lru_cache(maxsize=256)
+def build_hash_ring(replica_ids: Tuple[str, ...]) -> Tuple[List[int], List[str]]:
+    """Consistent-hash ring with AFFINITY_VIRTUAL_NODES points per replica"""
+    points = sorted((ring_point(f"{replica_id}#{i}"), replica_id)
+                    for replica_id in replica_ids for i in range(AFFINITY_VIRTUAL_NODES))
+    return [point for point, _ in points], [replica_id for _, replica_id in points]
+
+def affinity_target(pool: List[Dict[str, Any]], affinity_key: str) -> Dict[str, Any]:
+    """Replica that owns affinity_key on the hash ring of pool"""
+    by_id = {d["replica_id"]: d for d in pool}
+    points, owners = build_hash_ring(tuple(sorted(by_id)))
+    index = bisect.bisect(points, int(affinity_key[:16], 16)) % len(points)
+    return by_id[owners[index]]
+
+def select_replica(model_id: str, exclude: Optional[set] = None,
+                   affinity_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Pick the healthy replica with the fewest outstanding requests.
+
+    Ejected replicas are skipped; degraded ones are used only when no replica
+    is ready. With an affinity key (prefix-affinity routing), the replica that
+    owns the key on the consistent-hash ring is preferred unless it is
+    carrying more than AFFINITY_LOAD_FACTOR times its share of the load.
+    """
+    now = time.monotonic()
+    candidates = [
+        active_deployments[r] for r in replica_groups.get(model_id, [])
+        if not exclude or r not in exclude
+    ]
+    candidates = [d for d in candidates if d["status"] in ("ready", "degraded") and d["ejected_until"] <= now]
+    ready = [d for d in candidates if d["status"] == "ready"]
+    pool = ready or candidates
+    if not pool:
+        return None
+    least_loaded = min(pool, key=lambda d: (d["outstanding"], d["total_requests"]))
+    if affinity_key is None or len(pool) == 1:
+        return least_loaded
+
+    target = affinity_target(pool, affinity_key)
+    share = (sum(d["outstanding"] for d in pool) + 1) / len(pool)
+    if target["outstanding"] >= max(AFFINITY_MIN_LOAD, math.ceil(share * AFFINITY_LOAD_FACTOR)):
+        target["affinity_spills"] += 1
+        gateway_routing.inc(result="spill")
+        return least_loaded
+    target["affinity_hits"] += 1
+    gateway_routing.inc(result="affinity")
+    return target
+
+def eject_replica(deployment: Dict[str, Any], reason: str) -> None:
+    """Take a replica out of rotation for GATEWAY_EJECT_SECONDS"""
+    deployment["ejected_until"] = time.monotonic() + GATEWAY_EJECT_SECONDS
+    print(f"Ejecting replica {deployment['replica_id']} for {GATEWAY_EJECT_SECONDS}s: {reason}")
+
+def get_upstream_client(port: int) -> httpx.AsyncClient:
+    """Keep-alive connection pool for one model server"""
+    client = upstream_clients.get(port)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            timeout=httpx.Timeout(GATEWAY_CONNECT_TIMEOUT, read=None),
+            limits=httpx.Limits(max_connections=GATEWAY_MAX_CONNECTIONS,
+                                max_keepalive_connections=GATEWAY_MAX_CONNECTIONS)
+        )
+        upstream_clients[port] = client
+    return client
+
+async def close_upstream_client(port: int) -> None:
+    """Drop the connection pool of a model server that went away"""
+    client = upstream_clients.pop(port, None)
+    if client is not None:
+        await client.aclose()
+
+def upstream_releaser(upstream: httpx.Response, deployment: Dict[str, Any], on_release=None):
+    """Idempotent callback that closes an upstream response and frees its replica slot"""
+    released = False
+
+    async def release() -> None:
+        nonlocal released
+        if released:
+            return
+        released = True
+        deployment["outstanding"] -= 1
+        deployment["last_request_at"] = time.time()
+        deployments_snapshot.touch(urgent=False)
+        if on_release is not None:
+            on_release()
+        await upstream.aclose()
+
+    return release
+
+async def relay_upstream(upstream: httpx.Response, release) -> Any:
+    """Yield upstream bytes as they arrive, releasing the replica however the stream ends"""
+    try:
+        async for chunk in upstream.aiter_raw():
+            yield chunk
+    finally:
+        await release()
+
+class ResponseCache:
+    """LRU cache of complete gateway responses, bounded by total size and TTL.
+
+    Entries are always stored as the non-streaming JSON response; streaming
+    clients get them replayed as SSE. Only touched from the event loop.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # key -> (body bytes, expires at)
+        self._bytes = 0
+        self.stats = collections.Counter()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        body, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: str, body: bytes) -> None:
+        if len(body) > RESPONSE_CACHE_MAX_ENTRY_BYTES or len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (body, time.monotonic() + self.ttl)
+        self._bytes += len(body)
+        self.stats["stores"] += 1
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        body, _ = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        return count
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["coalesced"] + self.stats["misses"]
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hit_rate": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else None,
+            "in_flight": len(inflight_requests),
+            **{name: self.stats[name] for name in ("hits", "coalesced", "misses", "bypassed", "stores",
+                                                   "evictions", "expired")}
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+
+def response_cache_key(request: Request, path: str, model_id: str, body: Dict[str, Any]) -> Optional[str]:
+    """Canonical hash of a deterministic request, or None if it must not be cached.
+
+    Only greedy (temperature 0) or seeded requests for a single choice are
+    cacheable, and clients can opt out with Cache-Control: no-cache/no-store.
+    Streaming and non-streaming requests share entries.
+    """
+    cache_control = request.headers.get("cache-control", "")
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return None
+    if body.get("temperature") != 0 and body.get("seed") is None:
+        return None
+    if body.get("n", 1) != 1:
+        return None
+    canonical = {k: v for k, v in body.items() if k not in RESPONSE_CACHE_IGNORED_FIELDS}
+    payload = json.dumps({"path": path, "model": model_id, "body": canonical},
+                         sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def completion_to_sse(completion: Dict[str, Any], path: str, include_usage: bool) -> bytes:
+    """Replay a complete (non-streaming) response as the SSE stream the backend would have sent."""
+    chat = path.endswith("/chat/completions")
+    base = {"id": completion.get("id"), "created": completion.get("created"), "model": completion.get("model"),
+            "object": "chat.completion.chunk" if chat else "text_completion"}
+    events = []
+    for choice in completion.get("choices", []):
+        index = choice.get("index", 0)
+        if chat:
+            message = choice.get("message") or {}
+            delta = {"role": message.get("role", "assistant"), "content": message.get("content") or ""}
+            events.append({**base, "choices": [{"index": index, "delta": delta, "finish_reason": None}]})
+            events.append({**base, "choices": [{"index": index, "delta": {},
+                                                "finish_reason": choice.get("finish_reason")}]})
         else:
-            # Ensure max_model_len doesn't exceed model's capabilities
-            if max_model_len > model_max_length:
-                with open(log_file, "a") as f:
-                    f.write(f"Warning: Requested max_model_len ({max_model_len}) exceeds model's maximum ({model_max_length}). Using {model_max_length} instead.\n")
-                max_model_len = model_max_length
+            events.append({**base, "choices": [{"index": index, "text": choice.get("text", ""),
+                                                "finish_reason": choice.get("finish_reason")}]})
+    if include_usage and completion.get("usage"):
+        events.append({**base, "choices": [], "usage": completion["usage"]})
+    return b"".join(f"data: {json.dumps(event)}\n\n".encode("utf-8") for event in events) + b"data: [DONE]\n\n"
+
+def sse_to_completion(data: bytes, path: str) -> Optional[Dict[str, Any]]:
+    """Reassemble a streamed response into the equivalent non-streaming one.
+
+    Returns None for anything it cannot represent faithfully, such as tool
+    call deltas, so such streams are simply not cached.
+    """
+    chat = path.endswith("/chat/completions")
+    first = None
+    usage = None
+    choices = {}
+    for line in data.decode("utf-8").splitlines():
+        if not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+        chunk = json.loads(payload)
+        first = first or chunk
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices", []):
+            merged = choices.setdefault(choice.get("index", 0), {"role": "assistant", "text": [], "finish_reason": None})
+            if chat:
+                delta = choice.get("delta") or {}
+                if set(delta) - {"role", "content"}:
+                    return None
+                merged["role"] = delta.get("role") or merged["role"]
+                merged["text"].append(delta.get("content") or "")
+            else:
+                merged["text"].append(choice.get("text") or "")
+            merged["finish_reason"] = choice.get("finish_reason") or merged["finish_reason"]
+    # A choice without a finish reason means the stream was cut short
+    if first is None or not choices or not all(c["finish_reason"] for c in choices.values()):
+        return None
+
+    completion = {"id": first.get("id"), "object": "chat.completion" if chat else "text_completion",
+                  "created": first.get("created"), "model": first.get("model"), "choices": []}
+    for index in sorted(choices):
+        merged = choices[index]
+        text = "".join(merged["text"])
+        if chat:
+            choice = {"index": index, "message": {"role": merged["role"], "content": text}}
+        else:
+            choice = {"index": index, "text": text}
+        choice["finish_reason"] = merged["finish_reason"]
+        completion["choices"].append(choice)
+    if usage:
+        completion["usage"] = usage
+    return completion
+
+def cached_completion_response(cached: bytes, body: Dict[str, Any], path: str, outcome: str) -> Response:
+    """Serve a cached response in the form the client asked for."""
+    headers = {"X-Polaris-Cache": outcome}
+    if body.get("stream"):
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        headers.update({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        return Response(content=completion_to_sse(json.loads(cached), path, include_usage),
+                        media_type="text/event-stream", headers=headers)
+    return Response(content=cached, media_type="application/json", headers=headers)
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """In-flight limit for one model's gateway traffic, with a bounded FIFO queue per priority.
+
+    A freed slot goes to the oldest interactive waiter, then to the oldest
+    batch waiter. Requests that find their queue full, or wait longer than
+    ADMISSION_QUEUE_TIMEOUT, are refused with a Retry-After estimated from
+    recent request durations. Only touched from the event loop.
+    """
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.in_flight = 0
+        self.queues = {priority: collections.deque() for priority in ADMISSION_PRIORITIES}
+        self.mean_duration = 1.0  # EWMA of seconds a slot is held
+        self.rejected = collections.Counter()
+        self.admitted = 0
+
+    @property
+    def limit(self) -> int:
+        """max_in_flight of the model's current deployment, else the server-wide default"""
+        for replica_id in replica_groups.get(self.model_id, []):
+            limit = active_deployments[replica_id]["config"].get("max_in_flight")
+            if limit is not None:
+                return limit
+        parked = parked_models.get(self.model_id)
+        if parked is not None and parked["request"].get("max_in_flight") is not None:
+            return parked["request"]["max_in_flight"]
+        return ADMISSION_MAX_IN_FLIGHT
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead has likely drained"""
+        queued = sum(len(queue) for queue in self.queues.values())
+        return max(1, math.ceil(self.mean_duration * (queued + 1) / max(self.limit, 1)))
+
+    def reject(self, priority: str, reason: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        admission_rejections.inc(model_id=self.model_id, priority=priority, reason=reason)
+        return AdmissionRejected(reason, self.retry_after())
+
+    async def acquire(self, priority: str) -> float:
+        """Wait for an in-flight slot.
         
-        # Build command - use swift deploy directly
-        # Add VLLM_USE_V1=0 for multimodal models to fix compatibility issues
-        env_vars = [f"CUDA_VISIBLE_DEVICES={gpu_id}"]
-        if model_config["is_multimodal"]:
-            env_vars.append("VLLM_USE_V1=0")
-            
-        cmd = [
-            " ".join(env_vars),  # Join all environment variables
-            "swift deploy",  # Use swift deploy directly
-            "--model", model_id,
-            "--infer_backend", "vllm",
-            "--max_model_len", str(max_model_len),
-            "--gpu_memory_utilization", str(gpu_memory_utilization),
-            "--port", str(port),
-            "--host", "0.0.0.0"  # Ensure accessible from outside container
-        ]
+        Returns:
+            Time the slot was granted (time.monotonic()), to pass to release()
         
-        # Add vision_batch_size for multimodal models
-        if model_config["is_multimodal"]:
-            if vision_batch_size is None:
-                vision_batch_size = 2
-            cmd.extend(["--vision_batch_size", str(vision_batch_size)])
+        Raises:
+            AdmissionRejected: If the queue is full or the wait timed out
+        """
+        limit = self.limit
+        ahead = ADMISSION_PRIORITIES[:ADMISSION_PRIORITIES.index(priority) + 1]
+        if limit <= 0 or (self.in_flight < limit and not any(self.queues[p] for p in ahead)):
+            self.in_flight += 1
+            self.admitted += 1
+            admission_wait_seconds.observe(0, model_id=self.model_id, priority=priority)
+            return time.monotonic()
         
-        # Add use_hf flag if needed
-        if use_hf:
-            cmd.extend(["--use_hf", "true"])
+        queue = self.queues[priority]
+        if len(queue) >= ADMISSION_QUEUE_SIZES[priority]:
+            raise self.reject(priority, "queue_full")
         
-        # Execute deployment command
-        cmd_str = " ".join(cmd)
-        with open(log_file, "a") as f:
-            f.write(f"Executing: {cmd_str}\n\n")
-            f.write("=== Deployment Output ===\n\n")
-            
-            # Update deployment command in record
-            active_deployments[model_id]["command"] = cmd_str
-            
-            deployment_process = subprocess.Popen(
-                cmd_str,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
-            
-            # Store deployment process in record
-            active_deployments[model_id]["process"] = deployment_process
-            
-            # Stream output to log file
-            for line in deployment_process.stdout:
-                f.write(line)
-                f.flush()
-            
-            # Wait for process to complete if it's a fast failure
-            return_code = deployment_process.wait()
-            
-            # Update deployment status based on return code
-            if return_code != 0:
-                f.write(f"\nProcess exited with code {return_code}\n")
-                f.write("Deployment failed. Check error messages above.\n")
-                active_deployments[model_id]["status"] = "failed"
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return self.granted(priority, queued_at)
+            queue.remove(waiter)
+            raise self.reject(priority, "timeout")
+        except asyncio.CancelledError:
+            # The client went away; pass on a slot that was already handed to us
+            if waiter.done():
+                self.release(None)
             else:
-                f.write(f"\nProcess exited with code {return_code}\n")
-                f.write("Deployment completed successfully.\n")
-                active_deployments[model_id]["status"] = "completed"
+                queue.remove(waiter)
+            raise
+        return self.granted(priority, queued_at)
+
+    def granted(self, priority: str, queued_at: float) -> float:
+        now = time.monotonic()
+        self.admitted += 1
+        admission_wait_seconds.observe(now - queued_at, model_id=self.model_id, priority=priority)
+        return now
+
+    def release(self, acquired_at: Optional[float]) -> None:
+        """Free a slot, handing it straight to the next waiter if there is one."""
+        if acquired_at is not None:
+            self.mean_duration = 0.8 * self.mean_duration + 0.2 * (time.monotonic() - acquired_at)
+        for priority in ADMISSION_PRIORITIES:
+            queue = self.queues[priority]
+            if queue:
+                queue.popleft().set_result(True)
+                return
+        self.in_flight -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "model_id": self.model_id,
+            "max_in_flight": self.limit,
+            "in_flight": self.in_flight,
+            "queued": {priority: len(queue) for priority, queue in self.queues.items()},
+            "queue_sizes": dict(ADMISSION_QUEUE_SIZES),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "mean_request_seconds": round(self.mean_duration, 3)
+        }
+
+def get_admission_controller(model_id: str) -> AdmissionController:
+    controller = admission_controllers.get(model_id)
+    if controller is None:
+        controller = admission_controllers[model_id] = AdmissionController(model_id)
+    return controller
+
+def request_priority(request: Request) -> Optional[str]:
+    """Priority class from the X-Polaris-Priority header (default interactive), or None if invalid"""
+    priority = request.headers.get("x-polaris-priority", "interactive").strip().lower()
+    return priority if priority in ADMISSION_PRIORITIES else None
+
+async def open_upstream(model_id: str, path: str, body: Dict[str, Any]) -> Tuple[Optional[httpx.Response],
+                                                                                Optional[Dict[str, Any]],
+                                                                                Optional[Response]]:
+    """Send a request to a replica of model_id, failing over on connection errors.
+
+    Under prefix-affinity routing the affinity key is taken before the model
+    name is rewritten, and failover walks on to the next replica on the ring.
+    media:// references are expanded to data URLs here, after the cache and
+    affinity keys have been computed from the short references.
+
+    Returns:
+        (upstream response, replica, None) on success, or (None, None, error response)
+    """
+    affinity_key = prompt_affinity_key(body) if GATEWAY_ROUTING == "prefix-affinity" else None
+    if has_media_refs(body):
+        # References were hashed above; the backend gets the bytes
+        try:
+            body = await asyncio.to_thread(expand_media_refs, body)
+        except KeyError as e:
+            return None, None, openai_error(400, f"Unknown media reference {MEDIA_REF_PREFIX}{e.args[0]}; "
+                                                 "upload it to /media first")
+    tried = set()
+    while True:
+        deployment = select_replica(model_id, tried, affinity_key)
+        if deployment is None:
+            if tried:
+                return None, None, openai_error(502, f"No replica of {model_id} is reachable", "upstream_error")
+            status = group_status([active_deployments[r] for r in replica_groups[model_id]])
+            return None, None, openai_error(503, f"Model {model_id} is not ready (status: {status})",
+                                            "unavailable_error")
+        tried.add(deployment["replica_id"])
         
-    except Exception as e:
-        error_msg = f"Error deploying model {model_id}: {str(e)}"
-        print(error_msg)
+        # The backend only knows the name it registered itself under
+        if deployment.get("served_model_name"):
+            body["model"] = deployment["served_model_name"]
         
-        # Write error to log even if something went wrong
+        client = get_upstream_client(deployment["port"])
+        upstream_request = client.build_request(
+            "POST", path,
+            content=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        deployment["outstanding"] += 1
+        deployment["total_requests"] += 1
+        deployment["last_request_at"] = time.time()
+        deployments_snapshot.touch(urgent=False)
         try:
-            with open(log_file, "a") as f:
-                f.write(f"\n\nERROR: {error_msg}\n")
-        except:
-            pass
-            
-        # Update deployment status to failed
-        if model_id in active_deployments:
-            active_deployments[model_id]["status"] = "failed"
-            
-def install_requirements(model_id: str) -> None:
-    """Install required packages for the model - now only used for system-wide installation"""
+            upstream = await client.send(upstream_request, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # Nothing reached the backend, so another replica can take the request
+            deployment["outstanding"] -= 1
+            eject_replica(deployment, str(e) or type(e).__name__)
+            continue
+        except httpx.HTTPError as e:
+            deployment["outstanding"] -= 1
+            eject_replica(deployment, str(e) or type(e).__name__)
+            return None, None, openai_error(502, f"Replica {deployment['replica_id']} failed: {e}", "upstream_error")
+        return upstream, deployment, None
+
+def upstream_headers(upstream: httpx.Response, body: Dict[str, Any]) -> Dict[str, str]:
+    headers = {}
+    if "content-type" in upstream.headers:
+        headers["Content-Type"] = upstream.headers["content-type"]
+    if body.get("stream"):
+        headers["Cache-Control"] = "no-cache"
+        headers["X-Accel-Buffering"] = "no"
+    return headers
+
+async def relay_and_cache(upstream: httpx.Response, release, cache_key: str, path: str,
+                          flight: asyncio.Future) -> Any:
+    """Relay a streamed response while collecting it for the cache.
+
+    Coalesced requests waiting on the flight get the cached response, or None
+    if the stream was cut short or could not be cached.
+    """
+    collected = bytearray()
+    cached = None
     try:
-        model_config = find_model_config(model_id)
-        requires = model_config.get("requires", "-")
-        
-        if requires != "-" and requires:
-            # Log the requirements
-            print(f"Model requirements for {model_id}: {requires}")
-        
-    except Exception as e:
-        print(f"Error processing requirements for {model_id}: {str(e)}")
-        raise
+        async for chunk in upstream.aiter_raw():
+            if collected is not None:
+                collected += chunk
+                if len(collected) > RESPONSE_CACHE_MAX_ENTRY_BYTES * 4:
+                    collected = None  # SSE framing is verbose; far past the entry limit
+            yield chunk
+        if collected is not None and upstream.status_code == 200:
+            try:
+                completion = sse_to_completion(bytes(collected), path)
+            except ValueError:
+                completion = None
+            if completion is not None:
+                cached = json.dumps(completion).encode("utf-8")
+                response_cache.put(cache_key, cached)
+    finally:
+        finish_flight(cache_key, flight, cached)
+        await release()
 
-@app.post("/deploy", response_model=DeploymentStatus)
-async def deploy_model(deploy_request: DeployRequest, background_tasks: BackgroundTasks):
-    """Deploy a model with the specified parameters"""
+def finish_flight(cache_key: str, flight: asyncio.Future, cached: Optional[bytes]) -> None:
+    if inflight_requests.get(cache_key) is flight:
+        del inflight_requests[cache_key]
+    if not flight.done():
+        flight.set_result(cached)
+
+async def proxy_openai_request(request: Request, path: str) -> Response:
+    """Route an OpenAI-style request to a replica of the model named by its `model` field.
+
+    Replicas are chosen by fewest outstanding requests. A replica that refuses
+    the connection is ejected and the request is retried on another one. The
+    upstream response is relayed chunk by chunk, so SSE streams reach the
+    client as they are produced.
+
+    Requests for a model that is scaled to zero or still starting wait for
+    it in a bounded queue (see wait_for_model). Requests that reach the
+    backend then go through the model's admission control, in the priority
+    class named by X-Polaris-Priority.
+
+    With POLARIS_RESPONSE_CACHE=1, deterministic requests are answered from
+    the response cache, and identical requests already in flight wait for
+    that one response instead of reaching the backend themselves.
+
+    A coordinator passes the request on to a node instead (see forward_openai_request).
+    """
+    if NODE_ROLE == "coordinator":
+        return await forward_openai_request(request, path)
     try:
-        model_id = deploy_request.model_id
-        
-        # Check if model is already deployed
-        if model_id in active_deployments:
-            return DeploymentStatus(
-                status="already_deployed",
-                model_id=model_id,
-                deployment_command=active_deployments[model_id]["command"],
-                log_file=active_deployments[model_id]["log_file"],
-                port=active_deployments[model_id]["port"],
-                gpu_id=active_deployments[model_id]["gpu_id"],
-                env_path=active_deployments[model_id].get("env_path")
-            )
-        
-        # Find model in config
-        model_config = find_model_config(model_id)
-        
-        # Select port - either user-specified or auto-assigned
-        requested_port = deploy_request.port
-        try:
-            port = find_available_port(requested_port)
-            # Log if we had to change the port
-            if requested_port and port != requested_port:
-                print(f"Requested port {requested_port} was unavailable. Using port {port} instead.")
-        except ValueError as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        body = await request.json()
+    except ValueError:
+        return openai_error(400, "Request body must be valid JSON")
+    if not isinstance(body, dict) or not body.get("model"):
+        return openai_error(400, "Request must include a 'model' field")
+
+    model_id = resolve_model(body["model"])
+    if model_id is None:
+        return openai_error(404, f"Model {body['model']} is not deployed", "not_found_error")
+    priority = request_priority(request)
+    if priority is None:
+        return openai_error(400, f"X-Polaris-Priority must be one of: {', '.join(ADMISSION_PRIORITIES)}")
+
+    if model_id in parked_models or starting_without_ready(model_id):
+        error = await wait_for_model(model_id)
+        if error is not None:
+            return error
+
+    cache_key = response_cache_key(request, path, model_id, body) if RESPONSE_CACHE_ENABLED else None
+    flight = None
+    if RESPONSE_CACHE_ENABLED and cache_key is None:
+        response_cache.stats["bypassed"] += 1
+        gateway_cache_requests.inc(result="bypass")
+    elif cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            response_cache.stats["hits"] += 1
+            gateway_cache_requests.inc(result="hit")
+            return cached_completion_response(cached, body, path, "HIT")
         
-        # Start deployment in background
-        background_tasks.add_task(
-            deploy_model_task,
-            model_id=model_id,
-            gpu_id=deploy_request.gpu_id,
-            max_model_len=deploy_request.max_model_len,
-            vision_batch_size=deploy_request.vision_batch_size,
-            gpu_memory_utilization=deploy_request.gpu_memory_utilization,
-            port=port,
-            isolate_env=deploy_request.isolate_env
+        pending = inflight_requests.get(cache_key)
+        if pending is not None:
+            # shield: a disconnecting follower must not cancel the shared flight
+            cached = await asyncio.shield(pending)
+            if cached is not None:
+                response_cache.stats["coalesced"] += 1
+                gateway_cache_requests.inc(result="coalesced")
+                return cached_completion_response(cached, body, path, "COALESCED")
+            # The leader's response could not be cached; go to the backend ourselves
+        else:
+            flight = asyncio.get_running_loop().create_future()
+            inflight_requests[cache_key] = flight
+        response_cache.stats["misses"] += 1
+        gateway_cache_requests.inc(result="miss")
+
+    controller = get_admission_controller(model_id)
+    acquired_at = None
+    try:
+        acquired_at = await controller.acquire(priority)
+        upstream, deployment, error = await open_upstream(model_id, path, body)
+    except AdmissionRejected as e:
+        if flight is not None:
+            finish_flight(cache_key, flight, None)
+        message = "queue is full" if e.reason == "queue_full" else "request waited too long in the queue"
+        return openai_error(429, f"Model {model_id} is overloaded: {priority} {message}", "rate_limit_error",
+                            {"Retry-After": str(e.retry_after)})
+    except BaseException:
+        if flight is not None:
+            finish_flight(cache_key, flight, None)
+        if acquired_at is not None:
+            controller.release(acquired_at)
+        raise
+    if error is not None:
+        if flight is not None:
+            finish_flight(cache_key, flight, None)
+        controller.release(acquired_at)
+        return error
+
+    headers = upstream_headers(upstream, body)
+    release = upstream_releaser(upstream, deployment, functools.partial(controller.release, acquired_at))
+    if flight is None:
+        return StreamingResponse(
+            relay_upstream(upstream, release),
+            status_code=upstream.status_code,
+            headers=headers,
+            background=BackgroundTask(release)
         )
-        
-        # Build the command for display
-        env_vars = [f"CUDA_VISIBLE_DEVICES={deploy_request.gpu_id}"]
-        
-        # Add VLLM_USE_V1=0 for multimodal models
-        if model_config["is_multimodal"]:
-            env_vars.append("VLLM_USE_V1=0")
-        
-        cmd_parts = [
-            " ".join(env_vars),
-            "swift deploy",
-            "--model", model_id,
-            "--infer_backend", "vllm",
-            "--max_model_len", str(deploy_request.max_model_len or (2048 if model_config["is_multimodal"] else 4096)),
-            "--gpu_memory_utilization", str(deploy_request.gpu_memory_utilization),
-            "--port", str(port),
-            "--host", "0.0.0.0"  # Ensure the model server accepts connections from all interfaces
+
+    headers["X-Polaris-Cache"] = "MISS"
+    if body.get("stream"):
+        async def release_unstarted():
+            # Only does anything if the client went away before the body was relayed
+            finish_flight(cache_key, flight, None)
+            await release()
+        return StreamingResponse(
+            relay_and_cache(upstream, release, cache_key, path, flight),
+            status_code=upstream.status_code,
+            headers=headers,
+            background=BackgroundTask(release_unstarted)
+        )
+
+    # A non-streaming response is complete before it is sent, so read it whole
+    cached = None
+    try:
+        content = await upstream.aread()
+        if upstream.status_code == 200:
+            cached = content
+            response_cache.put(cache_key, content)
+    except httpx.HTTPError as e:
+        return openai_error(502, f"Replica {deployment['replica_id']} failed: {e}", "upstream_error")
+    finally:
+        finish_flight(cache_key, flight, cached)
+        await release()
+    return Response(content=content, status_code=upstream.status_code, headers=headers)
+
+@app.post("/v1/chat/completions")
+async def gateway_chat_completions(request: Request):
+    """OpenAI-compatible chat completions, routed by the request's model"""
+    return await proxy_openai_request(request, "/v1/chat/completions")
+
+@app.post("/v1/completions")
+async def gateway_completions(request: Request):
+    """OpenAI-compatible completions, routed by the request's model"""
+    return await proxy_openai_request(request, "/v1/completions")
+
+@app.get("/v1/models")
+async def gateway_models():
+    """OpenAI-compatible list of the models that can currently serve requests, on any node"""
+    if NODE_ROLE == "coordinator":
+        models = {}
+        for node in get_live_nodes():
+            for entry in node_entries(node):
+                if entry.get("status") in ("ready", "degraded"):
+                    models[entry["model_id"]] = min(models.get(entry["model_id"], math.inf), entry.get("created_at") or 0)
+        return {"object": "list", "data": [{"id": model_id, "object": "model", "created": int(created),
+                                            "owned_by": "polarisllm"} for model_id, created in models.items()]}
+    return {
+        "object": "list",
+        "data": [
+            {
+                "id": model_id,
+                "object": "model",
+                "created": int(min(active_deployments[r]["created_at"] for r in replica_ids)),
+                "owned_by": "polarisllm"
+            }
+            for model_id, replica_ids in replica_groups.items()
+            if any(active_deployments[r]["status"] in ("ready", "degraded") for r in replica_ids)
         ]
+    }
+
+def local_deployments() -> List[Dict[str, Any]]:
+    """This server's replicas, then its models scaled to zero"""
+    return [deployment_to_dict(deployment) for deployment in active_deployments.values()] + \
+        [parked_to_dict(parked) for model_id, parked in parked_models.items() if model_id not in replica_groups]
+
+async def send_heartbeats() -> None:
+    """Agent mode: register with the coordinator, then report this node's state every NODE_HEARTBEAT_INTERVAL."""
+    connected = None
+    while True:
+        try:
+            response = await cluster_client.post(f"{COORDINATOR_URL}/nodes/heartbeat", json={
+                "node_id": NODE_ID,
+                "url": NODE_URL,
+                "gpus": await gpu_scheduler.snapshot(),
+                "ports": port_allocator.stats(),
+                "deployments": local_deployments()
+            })
+            response.raise_for_status()
+            if not connected:
+                print(f"Registered as node {NODE_ID} ({NODE_URL}) with coordinator {COORDINATOR_URL}")
+            connected = True
+        except Exception as e:
+            # Only report the first failure of a streak; deployments keep running meanwhile
+            if connected is not False:
+                print(f"Heartbeat to coordinator {COORDINATOR_URL} failed: {e}")
+            connected = False
+        await asyncio.sleep(NODE_HEARTBEAT_INTERVAL)
+
+def require_coordinator() -> None:
+    if NODE_ROLE != "coordinator":
+        raise HTTPException(status_code=400, detail="This server is not a coordinator; start it with POLARIS_ROLE=coordinator")
+
+def is_node_live(node: Dict[str, Any]) -> bool:
+    return time.monotonic() - node["seen"] <= NODE_TIMEOUT
+
+def get_live_nodes() -> List[Dict[str, Any]]:
+    return [node for node in cluster_nodes.values() if is_node_live(node)]
+
+def update_node(node: Dict[str, Any], state: Dict[str, Any]) -> None:
+    for key in ("url", "gpus", "ports", "deployments"):
+        if key in state:
+            node[key] = state[key]
+    node["last_heartbeat"] = time.time()
+    node["seen"] = time.monotonic()
+    deployments_snapshot.touch(urgent=False)
+
+async def refresh_node(node: Dict[str, Any]) -> None:
+    """Pull a node's state right away, e.g. after a deploy, instead of waiting for its next heartbeat"""
+    try:
+        responses = await asyncio.gather(*(cluster_client.get(f"{node['url']}/{path}")
+                                           for path in ("gpus", "ports", "deployments")))
+        for response in responses:
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Could not refresh node {node['node_id']}: {e}")
+        return
+    gpus, ports, deployments = (response.json() for response in responses)
+    update_node(node, {"gpus": gpus, "ports": ports, "deployments": deployments})
+    deployments_snapshot.touch()
+
+def node_entries(node: Dict[str, Any], model_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """A node's /deployments entries, optionally only those of model_id (or of the replica_id model_id)"""
+    return [entry for entry in node.get("deployments", [])
+            if model_id is None or model_id in (entry.get("model_id"), entry.get("replica_id"))]
+
+def node_replicas(node: Dict[str, Any], model_id: str) -> List[Dict[str, Any]]:
+    """A node's running or starting replicas of model_id.
+
+    Leaves out the placeholder entry of a model scaled to zero (it has no
+    replica_id) and replicas that failed, exited or are being stopped.
+    """
+    return [entry for entry in node_entries(node, model_id)
+            if entry.get("replica_id") and entry.get("status") not in ("failed", "completed", "stopped", "stopping")]
+
+def tag_node(entry: Dict[str, Any], node: Dict[str, Any]) -> Dict[str, Any]:
+    """A node's view of a deployment, labelled with the node it runs on"""
+    entry = {**entry, "node_id": node["node_id"]}
+    if "replicas" in entry and isinstance(entry["replicas"], list):
+        entry["replicas"] = [{**replica, "node_id": node["node_id"]} for replica in entry["replicas"]]
+    return entry
+
+def find_model_nodes(model_id: str, node_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Live nodes reporting model_id, or just node_id.
+
+    Raises:
+        HTTPException: 404 if no such node, or no live node has the model
+    """
+    if node_id is not None:
+        node = cluster_nodes.get(node_id)
+        if node is None or not is_node_live(node):
+            raise HTTPException(status_code=404, detail=f"Node {node_id} is not registered or has been lost")
+        return [node]
+    nodes = [node for node in get_live_nodes() if node_entries(node, model_id)]
+    if not nodes:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} not found on any node")
+    return nodes
+
+def plan_node_placement(model_id: str, count: int, fraction: float, tp_size: int) -> Optional[List[str]]:
+    """Node for each of `count` new replicas, or None if they do not all fit.
+
+    Works from the GPU availability each live node last reported, less what
+    the plan itself has taken. Nodes running fewer replicas of the model come
+    first, so replicas spread over hosts; ties go to the best fit, the node
+    whose fitting GPUs have the least room left, as in GpuScheduler.
+    """
+    rooms = {node["node_id"]: {gpu["index"]: gpu["available_fraction"] for gpu in node["gpus"].get("gpus", [])}
+             for node in get_live_nodes()}
+    replicas_on = {node_id: len(node_replicas(cluster_nodes[node_id], model_id)) for node_id in rooms}
+    plan = []
+    for _ in range(count):
+        best = None
+        for node_id, room in rooms.items():
+            fitting = sorted((available, index) for index, available in room.items()
+                             if available + 1e-6 >= fraction)[:tp_size]
+            if len(fitting) < tp_size:
+                continue
+            key = (replicas_on[node_id], sum(available for available, _ in fitting))
+            if best is None or key < best[0]:
+                best = (key, node_id, fitting)
+        if best is None:
+            return None
+        _, node_id, fitting = best
+        for _, index in fitting:
+            rooms[node_id][index] -= fraction
+        replicas_on[node_id] += 1
+        plan.append(node_id)
+    return plan
+
+async def node_request(node: Dict[str, Any], method: str, path: str, timeout: float = NODE_REQUEST_TIMEOUT,
+                       **kwargs) -> httpx.Response:
+    """Call an agent's API; unreachable agents surface as 502"""
+    try:
+        return await cluster_client.request(method, f"{node['url']}{path}", timeout=timeout, **kwargs)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Node {node['node_id']} ({node['url']}) is unreachable: {e}")
+
+def node_error(node: Dict[str, Any], response: httpx.Response) -> HTTPException:
+    """An agent's error response, passed on with its status code"""
+    try:
+        detail = response.json().get("detail", response.text)
+    except ValueError:
+        detail = response.text
+    return HTTPException(status_code=response.status_code, detail=f"Node {node['node_id']}: {detail}")
+
+async def forward_to_node(node: Dict[str, Any], method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                          timeout: Optional[float] = NODE_REQUEST_TIMEOUT) -> Response:
+    """Relay a request to an agent and stream its response back, e.g. a followed log"""
+    request = cluster_client.build_request(method, f"{node['url']}{path}", params=params,
+                                           timeout=httpx.Timeout(timeout, connect=5.0))
+    try:
+        upstream = await cluster_client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Node {node['node_id']} ({node['url']}) is unreachable: {e}")
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() in FORWARDED_HEADERS}
+    return StreamingResponse(upstream.aiter_raw(), status_code=upstream.status_code, headers=headers,
+                             background=BackgroundTask(upstream.aclose))
+
+async def cluster_deploy(deploy_request: DeployRequest) -> DeploymentStatus:
+    """Place a deploy's missing replicas on nodes and forward it to each of them.
+
+    Each node is sent the same request with `replicas` set to the number it
+    should end up running, so agents keep their own GPU and port placement.
+    """
+    model_id = deploy_request.model_id
+    if deploy_request.replicas < 1:
+        raise HTTPException(status_code=400, detail="replicas must be at least 1")
+    async with cluster_deploy_lock:
+        live = get_live_nodes()
+        if not live:
+            raise HTTPException(status_code=503, detail="No nodes are registered with the coordinator")
+        if deploy_request.node is not None:
+            # `replicas` then counts the replicas on that node only
+            live = find_model_nodes(model_id, deploy_request.node)
+        existing = {node["node_id"]: len(node_replicas(node, model_id)) for node in live}
+        missing = max(deploy_request.replicas - sum(existing.values()), 0)
         
-        if model_config["is_multimodal"]:
-            cmd_parts.extend(["--vision_batch_size", str(deploy_request.vision_batch_size or 2)])
-            
-        # Determine if model is from HuggingFace
-        use_hf = not model_id.startswith(("Qwen/", "modelscope/", "damo/", "iic/", "AI-ModelScope/"))
-        if use_hf:
-            cmd_parts.extend(["--use_hf", "true"])
-        
-        command = " ".join(cmd_parts)
-        log_file = f"deployment_{model_id.replace('/', '_')}_{port}.log"
+        explicit_gpu = str(deploy_request.gpu_id) != "auto"
+        if deploy_request.node is not None:
+            plan = [deploy_request.node] * missing
+        elif explicit_gpu and missing:
+            if len(live) > 1:
+                raise HTTPException(status_code=400, detail="An explicit gpu_id needs `node` when several nodes "
+                                                            "are registered; or use gpu_id=\"auto\"")
+            plan = [live[0]["node_id"]] * missing
+        else:
+            plan = plan_node_placement(model_id, missing, deploy_request.gpu_memory_utilization,
+                                       deploy_request.tensor_parallel_size)
+            if plan is None:
+                if deploy_request.on_no_capacity == "reject":
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"No node has {deploy_request.tensor_parallel_size} x "
+                               f"{deploy_request.gpu_memory_utilization} of GPU memory free for every replica. "
+                               "Stop some deployments or retry with on_no_capacity='queue'."
+                    )
+                # Queue it all on the node with the most room; its scheduler waits for capacity
+                roomiest = max(live, key=lambda n: sum(g["available_fraction"] for g in n["gpus"].get("gpus", [])))
+                plan = [roomiest["node_id"]] * missing
         
-        return DeploymentStatus(
-            status="deploying",
-            model_id=model_id,
-            deployment_command=command,
-            log_file=log_file,
-            port=port,
-            gpu_id=deploy_request.gpu_id
-        )
+        targets = collections.Counter(plan)
+        if not targets:
+            # Already deployed: let the first node that has it answer
+            targets[next(node_id for node_id, count in existing.items() if count)] = 0
         
-    except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Deployment error: {str(e)}")
+        responses = []
+        shortfall = None
+        for node_id, new in targets.items():
+            node = cluster_nodes[node_id]
+            body = deploy_request.model_dump(exclude={"node"})
+            body["replicas"] = existing.get(node_id, 0) + new
+            if responses:
+                body["port"] = None
+            response = await node_request(node, "POST", "/deploy", json=body)
+            if response.status_code != 200:
+                if responses:
+                    # Keep the replicas already started elsewhere, as a single-node deploy does
+                    print(f"Deploy of {model_id} on node {node_id} failed: {response.text}")
+                    shortfall = node_error(node, response).detail
+                    break
+                raise node_error(node, response)
+            responses.append((node, response.json()))
+            await refresh_node(node)
 
-@app.get("/deployments")
-async def get_deployments():
-    """Get all active deployments"""
-    result = []
-    for model_id, deployment in active_deployments.items():
-        # If process exists, check its status; otherwise use stored status
-        status = deployment.get("status", "unknown")
-        if deployment.get("process") is not None:
-            if deployment["process"].poll() is None:
-                status = "running"
-            elif status == "deploying":  # Only update if it was previously "deploying"
-                status = f"exited (code: {deployment['process'].returncode})"
-                
-        result.append({
-            "status": status,
-            "model_id": model_id,
-            "deployment_command": deployment["command"],
-            "log_file": deployment["log_file"],
-            "port": deployment["port"],
-            "gpu_id": deployment["gpu_id"],
-            "env_path": deployment.get("env_path")
-        })
+    node, first = responses[0]
+    replicas = [{**replica, "node_id": n["node_id"]} for n, result in responses for replica in result["replicas"]]
+    for other in cluster_nodes.values():
+        if other["node_id"] not in targets:
+            replicas.extend({**replica_summary_entry(entry), "node_id": other["node_id"]}
+                            for entry in node_replicas(other, model_id) if is_node_live(other))
+    statuses = [result["status"] for _, result in responses]
+    status = next((s for s in ("deploying", "queued") if s in statuses), statuses[0])
+    # With `node`, the request counts only that node's replicas
+    running = len(replicas) if deploy_request.node is None else len(first["replicas"])
+    shortfalls = [f"Node {n['node_id']}: {result['message']}" for n, result in responses if result.get("message")]
+    if shortfall is not None:
+        shortfalls.append(shortfall)
+    message = None
+    if running < deploy_request.replicas and shortfalls:
+        message = f"Started {running} of {deploy_request.replicas} requested replicas. " + "; ".join(shortfalls)
+    return DeploymentStatus(**{**first, "status": status, "replicas": replicas, "node_id": node["node_id"],
+                               "requested_replicas": deploy_request.replicas, "message": message})
+
+def replica_summary_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """replica_summary() of a node's /deployments entry"""
+    return {key: entry.get(key) for key in ("replica_id", "port", "gpu_id", "gpu_ids", "status")}
+
+def cluster_deployments() -> List[Dict[str, Any]]:
+    """Every node's deployments; those of lost nodes are reported as node_lost"""
+    entries = []
+    for node in cluster_nodes.values():
+        live = is_node_live(node)
+        for entry in node_entries(node):
+            entry = tag_node(entry, node)
+            if not live:
+                entry["status"] = "node_lost"
+            entries.append(entry)
+    return entries
+
+async def cluster_get_deployment(model_id: str, node: Optional[str], wait_until_ready: bool,
+                                 timeout: float) -> Dict[str, Any]:
+    """A model's replicas across nodes, asking each node that has it (so waiting works as on one node)"""
+    nodes = find_model_nodes(model_id, node)
+    params = {"wait_until_ready": str(wait_until_ready).lower(), "timeout": timeout}
+    responses = await asyncio.gather(*(node_request(n, "GET", f"/deployments/{model_id}", params=params,
+                                                    timeout=min(max(timeout, 0), MAX_WAIT_TIMEOUT) + NODE_REQUEST_TIMEOUT)
+                                       for n in nodes))
+    results = []
+    for n, response in zip(nodes, responses):
+        if response.status_code == 200:
+            results.append(tag_node(response.json(), n))
+        elif len(nodes) == 1:
+            raise node_error(n, response)
+    if not results:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} not found on any node")
+    if len(results) == 1:
+        return results[0]
     
-    return result
+    # One group spanning several nodes
+    replicas = [replica for result in results
+                for replica in (result["replicas"] if isinstance(result.get("replicas"), list) else [result])]
+    first = results[0]
+    return {**first, "status": group_status(replicas), "settled": all(r.get("settled", True) for r in results),
+            "node_id": None, "replicas": replicas}
 
-@app.delete("/deployments/{model_id}")
-async def stop_deployment(model_id: str):
-    """Stop a running deployment"""
-    if model_id not in active_deployments:
-        raise HTTPException(status_code=404, detail=f"Model {model_id} not found in active deployments")
+async def cluster_stop_deployment(model_id: str, node: Optional[str]) -> Dict[str, Any]:
+    """Stop a model on every node that runs it (or on one node)"""
+    nodes = find_model_nodes(model_id, node)
+    responses = await asyncio.gather(*(node_request(n, "DELETE", f"/deployments/{model_id}") for n in nodes))
+    stopped = []
+    for n, response in zip(nodes, responses):
+        if response.status_code != 200:
+            raise node_error(n, response)
+        stopped.extend(f"{n['node_id']}/{replica_id}" for replica_id in response.json()["replicas"])
+    await asyncio.gather(*(refresh_node(n) for n in nodes))
+    return {"status": "stopped", "model_id": model_id, "replicas": stopped, "nodes": [n["node_id"] for n in nodes]}
+
+def select_model_nodes(model_name: str) -> List[Dict[str, Any]]:
+    """Live nodes that can take a request for model_name, best first.
+
+    Nodes with a ready replica come before nodes where the model is starting
+    or scaled to zero (which wake it); within those, fewest requests this
+    coordinator has in flight to the node, then fewest reported, then fewest
+    sent so far.
+    """
+    candidates = []
+    for node in get_live_nodes():
+        entries = [entry for entry in node_entries(node)
+                   if model_name in (entry.get("model_id"), entry.get("served_model_name"))]
+        if not entries:
+            continue
+        ready = any(entry.get("status") in ("ready", "degraded") for entry in entries)
+        reported = sum(entry.get("outstanding_requests") or 0 for entry in entries)
+        candidates.append(((not ready, node["outstanding"], reported, node["total_requests"]), node))
+    return [node for _, node in sorted(candidates, key=lambda item: item[0])]
+
+async def forward_openai_request(request: Request, path: str) -> Response:
+    """Coordinator gateway: pass an OpenAI-style request to the gateway of a node serving its model.
     
+    The node does replica selection, admission control and response caching.
+    Nodes that refuse the connection are skipped. media:// references are
+    expanded here, since uploads are stored on the coordinator.
+    """
     try:
-        # Terminate the process
-        deployment = active_deployments[model_id]
-        if deployment["process"].poll() is None:
-            deployment["process"].terminate()
-            deployment["process"].wait(timeout=30)
-        
-        # Remove from active deployments
-        del active_deployments[model_id]
-        
-        return {"status": "stopped", "model_id": model_id}
+        body = await request.json()
+    except ValueError:
+        return openai_error(400, "Request body must be valid JSON")
+    if not isinstance(body, dict) or not body.get("model"):
+        return openai_error(400, "Request must include a 'model' field")
+    nodes = select_model_nodes(body["model"])
+    if not nodes:
+        return openai_error(404, f"Model {body['model']} is not deployed on any node", "not_found_error")
+    if has_media_refs(body):
+        try:
+            body = await asyncio.to_thread(expand_media_refs, body)
+        except KeyError as e:
+            return openai_error(400, f"Unknown media reference {MEDIA_REF_PREFIX}{e.args[0]}; "
+                                     "upload it to /media first")
+
+    headers = {"Content-Type": "application/json"}
+    for name in ("x-polaris-priority", "cache-control"):
+        if name in request.headers:
+            headers[name] = request.headers[name]
+    content = json.dumps(body).encode("utf-8")
+    for node in nodes:
+        upstream_request = cluster_client.build_request(
+            "POST", f"{node['url']}{path}", content=content, headers=headers,
+            timeout=httpx.Timeout(GATEWAY_CONNECT_TIMEOUT, read=None)
+        )
+        node["outstanding"] += 1
+        node["total_requests"] += 1
+        try:
+            upstream = await cluster_client.send(upstream_request, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # Nothing reached the node, so another one can take the request
+            node["outstanding"] -= 1
+            print(f"Node {node['node_id']} refused a gateway request: {e}")
+            continue
+        except httpx.HTTPError as e:
+            node["outstanding"] -= 1
+            return openai_error(502, f"Node {node['node_id']} failed: {e}", "upstream_error")
+        response_headers = {k: v for k, v in upstream.headers.items()
+                            if k.lower() in FORWARDED_HEADERS or k.lower().startswith("x-polaris-")}
+        response_headers["X-Polaris-Node"] = node["node_id"]
+        release = upstream_releaser(upstream, node)
+        return StreamingResponse(relay_upstream(upstream, release), status_code=upstream.status_code,
+                                 headers=response_headers, background=BackgroundTask(release))
+    return openai_error(502, f"No node serving {body['model']} is reachable", "upstream_error")
+
+def node_to_dict(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a registered node"""
+    gpus = node["gpus"].get("gpus", [])
+    entries = node_entries(node)
+    return {
+        "node_id": node["node_id"],
+        "url": node["url"],
+        "status": "live" if is_node_live(node) else "lost",
+        "registered_at": node["registered_at"],
+        "last_heartbeat": node["last_heartbeat"],
+        "gpus": len(gpus),
+        "gpu_memory_total_mib": sum(gpu.get("memory_total", 0) for gpu in gpus),
+        "gpu_available_fractions": [gpu.get("available_fraction") for gpu in gpus],
+        "gpu_probe_error": node["gpus"].get("error"),
+        "ports_free": node["ports"].get("free"),
+        "replicas": sum(1 for entry in entries if entry.get("replica_id")),
+        "models": sorted({entry["model_id"] for entry in entries}),
+        "outstanding_requests": node["outstanding"],
+        "total_requests": node["total_requests"]
+    }
+
+@app.post("/nodes/heartbeat")
+async def node_heartbeat(heartbeat: NodeHeartbeat):
+    """Register an agent, or refresh the GPUs, ports and deployments it reports (coordinator only)"""
+    require_coordinator()
+    node = cluster_nodes.get(heartbeat.node_id)
+    if node is None:
+        node = {"node_id": heartbeat.node_id, "registered_at": time.time(), "outstanding": 0, "total_requests": 0}
+        cluster_nodes[heartbeat.node_id] = node
+        print(f"Node {heartbeat.node_id} registered from {heartbeat.url}")
+    elif not is_node_live(node):
+        print(f"Node {heartbeat.node_id} is back")
+    update_node(node, heartbeat.model_dump())
+    return {"status": "ok", "heartbeat_interval": NODE_HEARTBEAT_INTERVAL}
+
+@app.get("/nodes")
+async def list_nodes():
+    """Nodes registered with this coordinator; a node is lost after NODE_TIMEOUT without a heartbeat"""
+    require_coordinator()
+    return [node_to_dict(node) for node in cluster_nodes.values()]
+
+@app.delete("/nodes/{node_id}")
+async def remove_node(node_id: str):
+    """Forget a node. Its deployments keep running; if it is still alive it registers again."""
+    require_coordinator()
+    if cluster_nodes.pop(node_id, None) is None:
+        raise HTTPException(status_code=404, detail=f"Node {node_id} is not registered")
+    deployments_snapshot.touch()
+    return {"status": "removed", "node_id": node_id}
+
+@app.post("/prefetch")
+async def prefetch_models(prefetch_request: PrefetchRequest):
+    """Download model weights into the shared cache in the background
     
+    Downloads run concurrently (POLARIS_PREFETCH_WORKERS at a time), resume
+    where an earlier attempt stopped, and are shared with deploys of the same
+    model. Poll GET /prefetch for progress.
+    """
+    for model_id in prefetch_request.model_ids:
+        try:
+            find_model_config(model_id)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    jobs = [start_prefetch(model_id) for model_id in prefetch_request.model_ids]
+    return {"status": "prefetching", "jobs": [prefetch_to_dict(job) for job in jobs]}
+
+@app.get("/prefetch")
+async def list_prefetches():
+    """Progress of all weight downloads started by this API process"""
+    return await asyncio.to_thread(lambda: [prefetch_to_dict(job) for job in list(prefetch_jobs.values())])
+
+@app.get("/prefetch/{model_id:path}")
+async def get_prefetch(model_id: str):
+    """Progress of one model's weight download"""
+    job = prefetch_jobs.get(model_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No prefetch started for {model_id}")
+    return await asyncio.to_thread(prefetch_to_dict, job)
+
+@app.post("/media")
+async def upload_media(request: Request, model_id: Optional[str] = None):
+    """Store an image, audio or video file sent as the raw request body
+
+    Returns a `media://<sha256>` reference to use in place of a data URL in
+    image_url / audio_url / video_url message parts. Identical content is
+    stored once. With `model_id`, the media is first downscaled or resampled
+    for that model; clients that prepare it themselves (the CLI does) can
+    check for an existing upload with HEAD /media/{sha256} and skip it.
+    """
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Request body must contain the media bytes")
+    if len(data) > MEDIA_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Media larger than {MEDIA_MAX_UPLOAD_BYTES} bytes")
+    try:
+        return await asyncio.to_thread(store_media, data, model_id)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error stopping deployment: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not process media: {e}")
 
-@app.get("/models", response_model=List[Dict[str, Any]])
-async def list_models():
-    """List all available models with enhanced metadata"""
-    all_models = []
-    
-    # Add multimodal models
-    for category in models_config["multimodal_models"]:
-        for model in models_config["multimodal_models"][category]:
-            model_copy = model.copy()
-            model_copy["category"] = category
-            model_copy["is_multimodal"] = True
-            # Add family information
-            model_copy["family"] = category
-            all_models.append(model_copy)
-    
-    # Add text only models
-    for category in models_config["text_only_models"]:
-        for model in models_config["text_only_models"][category]:
-            model_copy = model.copy()
-            model_copy["category"] = category
-            model_copy["is_multimodal"] = False
-            # Add family information
-            model_copy["family"] = category
-            all_models.append(model_copy)
-    
-    return all_models
+@app.api_route("/media/{media_id}", methods=["GET", "HEAD"])
+async def get_media(media_id: str):
+    """Uploaded media by its SHA-256; HEAD checks whether an upload can be skipped"""
+    media = await asyncio.to_thread(load_media, media_id)
+    if media is None:
+        raise HTTPException(status_code=404, detail=f"Media {media_id} not found")
+    data, mime = media
+    return Response(content=data, media_type=mime, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.delete("/media/{media_id}")
+async def delete_media(media_id: str):
+    """Remove uploaded media"""
+    if not await asyncio.to_thread(remove_media, media_id):
+        raise HTTPException(status_code=404, detail=f"Media {media_id} not found")
+    return {"status": "deleted", "media_id": media_id}
+
+@app.get("/admission")
+async def get_admission():
+    """In-flight counts, queue depths and rejections of gateway admission control, per model"""
+    return [controller.snapshot() for controller in admission_controllers.values()]
+
+@app.get("/cache/responses")
+async def get_response_cache():
+    """Gateway response cache size and hit-rate statistics"""
+    return response_cache.snapshot()
+
+@app.delete("/cache/responses")
+async def clear_response_cache():
+    """Drop every cached gateway response"""
+    return {"status": "cleared", "entries": response_cache.clear()}
+
+@app.get("/cache/models")
+async def list_weight_cache():
+    """Disk usage and last use of cached model weights"""
+    models = await asyncio.to_thread(list_cached_models, weights_in_use())
+    return {
+        "hf_cache_dir": get_hf_cache_dir(),
+        "modelscope_cache_dir": get_modelscope_cache_dir(),
+        "max_bytes": WEIGHT_CACHE_MAX_BYTES,
+        "total_bytes": sum(m["size_bytes"] for m in models),
+        "models": models
+    }
+
+@app.delete("/cache/models/{model_id:path}")
+async def delete_cached_weights(model_id: str):
+    """Remove a model's cached weights"""
+    if model_id in replica_groups:
+        raise HTTPException(status_code=409, detail=f"Model {model_id} is deployed")
+    if model_id in parked_models:
+        raise HTTPException(status_code=409, detail=f"Model {model_id} is scaled to zero and wakes on the next request")
+    job = prefetch_jobs.get(model_id)
+    if job is not None and job["status"] in ("queued", "downloading"):
+        raise HTTPException(status_code=409, detail=f"Weights of {model_id} are being downloaded")
+    if not has_cached_weights(model_id):
+        raise HTTPException(status_code=404, detail=f"No cached weights for {model_id}")
+    size = await asyncio.to_thread(get_weight_cache_size, model_id)
+    await asyncio.to_thread(remove_cached_weights, model_id)
+    forget_prefetch(model_id)
+    return {"status": "removed", "model_id": model_id, "size_bytes": size}
+
+@app.post("/cache/models/prune")
+async def prune_weight_cache(prune_request: PruneWeightsRequest):
+    """Evict least recently used weights of undeployed models under a disk budget"""
+    max_bytes = prune_request.max_bytes if prune_request.max_bytes is not None else WEIGHT_CACHE_MAX_BYTES
+    removed = await evict_weights(max_bytes)
+    models = await asyncio.to_thread(list_cached_models, weights_in_use())
+    return {
+        "status": "pruned",
+        "removed": removed,
+        "remaining": len(models),
+        "total_bytes": sum(m["size_bytes"] for m in models)
+    }
+
+@app.get("/envs")
+async def list_envs():
+    """List cached virtual environments"""
+    envs = list_cached_environments()
+    return {
+        "envs_dir": ENVS_DIR,
+        "max_bytes": ENV_CACHE_MAX_BYTES,
+        "total_bytes": sum(env["size_bytes"] for env in envs),
+        "envs": envs
+    }
+
+@app.post("/envs/prebuild")
+async def prebuild_envs(prebuild_request: PrebuildEnvsRequest):
+    """Fill the wheelhouse and build every catalog environment ahead of deploys"""
+    if prebuild_request.workers is not None and prebuild_request.workers < 1:
+        raise HTTPException(status_code=400, detail="workers must be at least 1")
+    results = await asyncio.to_thread(
+        prebuild_environments, prebuild_request.model_ids, prebuild_request.download, prebuild_request.workers
+    )
+    return {
+        "status": "prebuilt",
+        "builder": env_builder.name,
+        "wheelhouse": WHEELHOUSE_DIR,
+        "built": results["built"],
+        "failed": results["failed"]
+    }
+
+@app.delete("/envs/{key}")
+async def delete_env(key: str):
+    """Remove a cached virtual environment by its key (or key prefix)"""
+    matches = [env for env in list_cached_environments() if env["key"] and env["key"].startswith(key)]
+    if not matches:
+        raise HTTPException(status_code=404, detail=f"Environment {key} not found in cache")
+    if len(matches) > 1:
+        raise HTTPException(status_code=400, detail=f"Key prefix {key} matches {len(matches)} environments")
+
+    env = matches[0]
+    if env["in_use"]:
+        raise HTTPException(status_code=409, detail=f"Environment {env['key']} is used by an active deployment")
+    if not remove_cached_environment(env["env_path"]):
+        raise HTTPException(status_code=409, detail=f"Environment {env['key']} is currently being built")
+
+    return {"status": "removed", "key": env["key"], "env_path": env["env_path"]}
+
+@app.post("/envs/prune")
+async def prune_envs(prune_request: PruneEnvsRequest):
+    """Evict unused cached environments by age and LRU order under a disk budget"""
+    removed = []
+
+    if prune_request.unused_for_seconds is not None:
+        cutoff = time.time() - prune_request.unused_for_seconds
+        for env in list_cached_environments():
+            if not env["in_use"] and (env["last_used"] or 0) < cutoff:
+                if remove_cached_environment(env["env_path"]):
+                    removed.append(env["env_path"])
+
+    max_bytes = prune_request.max_bytes if prune_request.max_bytes is not None else ENV_CACHE_MAX_BYTES
+    removed.extend(evict_cached_environments(max_bytes))
+
+    envs = list_cached_environments()
+    return {
+        "status": "pruned",
+        "removed": removed,
+        "remaining": len(envs),
+        "total_bytes": sum(env["size_bytes"] for env in envs)
+    }
 
 @app.get("/")
 async def root():
@@ -631,10 +4948,51 @@ async def root():
         "endpoints": [
             "/deploy - Deploy a model",
             "/deployments - List active deployments",
-            "/deployments/{model_id} - Stop a deployment",
-            "/models - List all available models"
+            "/deployments/{model_id} - Get a deployment (?wait_until_ready=true to long-poll) or stop it (DELETE)",
+            "/deployments/{model_id}/logs - Recent log lines (?tail=N), or follow them with ?follow=true",
+            "/deployments/{model_id}/timeline - Per-phase deploy timeline, with earlier deploys of the model",
+            "/models - List all available models (filter with ?type=, ?family=, ?modality=)",
+            "/models/families - List models grouped by family",
+            "/v1/chat/completions - OpenAI-compatible chat completions routed by model",
+            "/v1/completions - OpenAI-compatible completions routed by model",
+            "/v1/models - Models that can currently serve requests",
+            "/metadata/warm - Pre-populate the model metadata cache",
+            "/metadata/{model_id} - Cached metadata for a model",
+            "/gpus - Show GPU memory, reservations and queued placements",
+            "/ports - Show model server port pool utilization",
+            "/metrics - Control-plane metrics in the Prometheus text format",
+            "/prefetch - Download model weights in the background (POST) or show progress (GET)",
+            "/cache/models - Disk usage of cached model weights; prune with /cache/models/prune",
+            "/cache/responses - Gateway response cache hit rate (GET) or clear it (DELETE)",
+            "/admission - Gateway in-flight limits and queue depths per model",
+            "/media - Upload an image/audio file once (POST) and reference it as media://<sha256>",
+            "/nodes - Coordinator only: registered nodes and their health; agents POST /nodes/heartbeat",
+            "/envs - List cached virtual environments",
+            "/envs/prebuild - Fill the wheelhouse and build every catalog environment",
+            "/envs/{key} - Remove a cached virtual environment",
+            "/envs/prune - Evict unused environments under a disk budget"
         ]
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=1009)
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "warm-metadata":
+        # Offline warm-up, e.g. at image build time: python api.py warm-metadata [--refresh] [model_id ...]
+        args = sys.argv[2:]
+        refresh = "--refresh" in args
+        results = warm_model_metadata([a for a in args if a != "--refresh"] or None, refresh)
+        print(f"Cached: {len(results['cached'])}, fetched: {len(results['fetched'])}, failed: {len(results['failed'])}")
+        for model_id, error in results["failed"].items():
+            print(f"  {model_id}: {error}")
+        sys.exit(1 if results["failed"] else 0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "prebuild-envs":
+        # Offline environment build, e.g. at image build time: python api.py prebuild-envs [--no-download] [model_id ...]
+        args = sys.argv[2:]
+        results = prebuild_environments([a for a in args if a != "--no-download"] or None, "--no-download" not in args)
+        for built in results["built"]:
+            print(f"Built {built['env_path']} for {built['requires']} in {built['seconds']}s")
+        for requires, error in results["failed"].items():
+            print(f"  {requires}: {error}")
+        sys.exit(1 if results["failed"] else 0)
+
+    uvicorn.run(app, host="0.0.0.0", port=API_PORT)
\ No newline at end of file
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Run a model server and write its output to a size-rotated log file.
+
+The API starts every model server through this relay, in the server's own
+session, so the log file handle belongs to the relay and not to the API
+process: a server left running across an API restart keeps logging. The
+relay rotates by renaming the full file aside and reopening a fresh one, so
+no output is lost, and compresses the old file to <log>.1.gz in the
+background, shifting older archives up to the backup count.
+
+    python log_relay.py <log file> <max bytes> <backup count> -- <command...>
+
+Signals are forwarded to the server, and the relay exits with its exit code.
+"""
+import os
+import sys
+import gzip
+import queue
+import shutil
+import signal
+import threading
+import subprocess
+
+READ_CHUNK_SIZE = 64 * 1024
+
+def compress_rotated_log(path, rotated, backup_count):
+    """Compress a rotated log to <path>.1.gz, shifting older archives up to backup_count"""
+    try:
+        if backup_count < 1:
+            os.remove(rotated)
+            return
+        for index in range(backup_count, 1, -1):
+            older = f"{path}.{index - 1}.gz"
+            if os.path.exists(older):
+                os.replace(older, f"{path}.{index}.gz")
+        with open(rotated, "rb") as src, gzip.open(f"{path}.1.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+    except OSError as e:
+        print(f"Error rotating log {path}: {e}", file=sys.stderr)
+
+class RotatingLog:
+    """Append-only log file that is moved aside and reopened once it reaches max_bytes"""
+
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = open(path, "ab", buffering=0)
+        self.size = self.file.tell()
+        self.rotations = 0
+        # One worker compresses rotated files in order, so archives never swap places
+        self.rotated = queue.Queue()
+        self.compressor = threading.Thread(target=self.compress_rotated, daemon=True)
+        self.compressor.start()
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        if self.max_bytes > 0 and self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        # Readers following the file by name finish the old one before switching to the new one
+        self.file.close()
+        self.rotations += 1
+        rotated = f"{self.path}.{os.getpid()}.{self.rotations}.rotating"
+        os.rename(self.path, rotated)
+        self.file = open(self.path, "ab", buffering=0)
+        self.size = self.file.tell()
+        self.rotated.put(rotated)
+
+    def compress_rotated(self):
+        while True:
+            rotated = self.rotated.get()
+            if rotated is None:
+                return
+            compress_rotated_log(self.path, rotated, self.backup_count)
+
+    def close(self):
+        """Close the file once every rotated file has been compressed"""
+        self.file.close()
+        self.rotated.put(None)
+        self.compressor.join()
+
+def relay(path, max_bytes, backup_count, command):
+    """Run command, copying its output into the rotating log until it exits.
+
+    Returns:
+        The command's exit code, or 128 + signal number if a signal ended it
+    """
+    server = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def forward(signum, frame):
+        try:
+            server.send_signal(signum)
+        except ProcessLookupError:
+            pass
+
+    # Keep reading until the server has exited, so its last lines are kept
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    log = RotatingLog(path, max_bytes, backup_count)
+    try:
+        output = server.stdout.fileno()
+        while True:
+            chunk = os.read(output, READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            log.write(chunk)
+    finally:
+        log.close()
+    return_code = server.wait()
+    return return_code if return_code >= 0 else 128 - return_code
+
+if __name__ == "__main__":
+    if "--" not in sys.argv or sys.argv.index("--") != 4 or len(sys.argv) < 6:
+        print("Usage: log_relay.py <log file> <max bytes> <backup count> -- <command...>", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(relay(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[5:]))
@@ -0,0 +1,196 @@
+"""Media preparation shared by the CLI and the API server.
+
+Images are downscaled to the resolution the target model's vision encoder
+works at, audio is resampled to the rate its audio encoder expects, and the
+MIME type is detected from the content rather than the file name. Prepared
+media is addressed by the SHA-256 of its bytes, so it can be uploaded to the
+server once and then referenced as media://<sha256>.
+
+Pillow (images) and numpy (faster audio resampling) are optional; without
+Pillow images are sent unchanged.
+"""
+import io
+import sys
+import wave
+import base64
+import hashlib
+from array import array
+from typing import Optional, Tuple
+
+MEDIA_REF_PREFIX = "media://"
+
+# (magic bytes, offset, MIME type); checked in order
+MEDIA_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png"),
+    (b"\xff\xd8\xff", 0, "image/jpeg"),
+    (b"GIF87a", 0, "image/gif"),
+    (b"GIF89a", 0, "image/gif"),
+    (b"BM", 0, "image/bmp"),
+    (b"II*\x00", 0, "image/tiff"),
+    (b"MM\x00*", 0, "image/tiff"),
+    (b"ID3", 0, "audio/mpeg"),
+    (b"\xff\xfb", 0, "audio/mpeg"),
+    (b"\xff\xf3", 0, "audio/mpeg"),
+    (b"fLaC", 0, "audio/flac"),
+    (b"OggS", 0, "audio/ogg"),
+    (b"\x1aE\xdf\xa3", 0, "video/webm"),
+)
+
+# Longest image side each vision encoder benefits from; larger images only cost upload time.
+# Matched as substrings of the lowercased model_id, first match wins.
+VISION_MAX_SIDE = (
+    ("qwen2-vl", 1344),
+    ("qwen-vl", 448),
+    ("llava", 336),
+    ("yi-vl", 448),
+    ("internvl", 1344),
+    ("phi-3-vision", 1344),
+    ("deepseek-vl", 1024),
+)
+DEFAULT_VISION_MAX_SIDE = 1024
+
+# Sample rate each audio encoder was trained at
+AUDIO_SAMPLE_RATES = (
+    ("qwen2-audio", 16000),
+    ("qwen-audio", 16000),
+)
+DEFAULT_AUDIO_SAMPLE_RATE = 16000
+
+JPEG_QUALITY = 90
+
+def detect_mime(data: bytes) -> Optional[str]:
+    """MIME type of media bytes from their signature, or None if unrecognized"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "audio/wav"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"M4A ", b"M4B "):
+            return "audio/mp4"
+        if brand in (b"heic", b"heix", b"mif1"):
+            return "image/heic"
+        return "video/mp4"
+    for magic, offset, mime in MEDIA_SIGNATURES:
+        if data[offset:offset + len(magic)] == magic:
+            return mime
+    return None
+
+def media_kind(mime: Optional[str]) -> Optional[str]:
+    """'image', 'audio' or 'video' for a MIME type"""
+    if not mime:
+        return None
+    kind = mime.split("/", 1)[0]
+    return kind if kind in ("image", "audio", "video") else None
+
+def media_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def to_data_url(data: bytes, mime: str) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+def lookup_by_model(table, model_id: Optional[str], default):
+    name = (model_id or "").lower()
+    for pattern, value in table:
+        if pattern in name:
+            return value
+    return default
+
+def vision_max_side(model_id: Optional[str]) -> int:
+    return lookup_by_model(VISION_MAX_SIDE, model_id, DEFAULT_VISION_MAX_SIDE)
+
+def audio_sample_rate(model_id: Optional[str]) -> int:
+    return lookup_by_model(AUDIO_SAMPLE_RATES, model_id, DEFAULT_AUDIO_SAMPLE_RATE)
+
+def prepare_image(data: bytes, model_id: Optional[str] = None) -> Tuple[bytes, str]:
+    """Downscale an image to the model's vision resolution.
+
+    Images already small enough, in a format every backend reads, are returned
+    untouched. Others are re-encoded as PNG (if they have transparency) or JPEG.
+    """
+    mime = detect_mime(data) or "application/octet-stream"
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime
+
+    max_side = vision_max_side(model_id)
+    image = Image.open(io.BytesIO(data))
+    if max(image.size) <= max_side and mime in ("image/jpeg", "image/png"):
+        return data, mime
+
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    output = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        image.save(output, format="PNG", optimize=True)
+        return output.getvalue(), "image/png"
+    image.convert("RGB").save(output, format="JPEG", quality=JPEG_QUALITY)
+    return output.getvalue(), "image/jpeg"
+
+def resample_pcm(samples: array, source_rate: int, target_rate: int) -> array:
+    """Linearly interpolate mono 16-bit samples to a new rate"""
+    count = max(int(len(samples) * target_rate / source_rate), 1)
+    step = source_rate / target_rate
+    last = len(samples) - 1
+    try:
+        import numpy as np
+    except ImportError:
+        resampled = array("h")
+        for i in range(count):
+            position = i * step
+            left = min(int(position), last)
+            right = min(left + 1, last)
+            fraction = position - left
+            resampled.append(int(samples[left] + (samples[right] - samples[left]) * fraction))
+        return resampled
+    positions = np.arange(count) * step
+    values = np.interp(positions, np.arange(len(samples)), np.frombuffer(samples, dtype=np.int16))
+    return array("h", values.astype(np.int16).tobytes())
+
+def prepare_audio(data: bytes, model_id: Optional[str] = None) -> Tuple[bytes, str]:
+    """Convert PCM WAV audio to mono 16-bit at the model's sample rate.
+
+    Compressed formats (MP3, FLAC, ...) need a decoder and are returned as is.
+    """
+    mime = detect_mime(data) or "application/octet-stream"
+    if mime != "audio/wav":
+        return data, mime
+    target_rate = audio_sample_rate(model_id)
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return data, mime
+    if width != 2 or (channels == 1 and rate == target_rate):
+        # Only 16-bit PCM is converted; other sample widths are rare in practice
+        return data, mime
+
+    samples = array("h", frames)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if channels > 1:
+        samples = array("h", (sum(samples[i:i + channels]) // channels for i in range(0, len(samples), channels)))
+    if rate != target_rate:
+        samples = resample_pcm(samples, rate, target_rate)
+    if sys.byteorder == "big":
+        samples.byteswap()
+
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(target_rate)
+        wav.writeframes(samples.tobytes())
+    return output.getvalue(), "audio/wav"
+
+def prepare_media(data: bytes, model_id: Optional[str] = None) -> Tuple[bytes, str]:
+    """Prepare image or audio bytes for a model; anything else is passed through"""
+    mime = detect_mime(data)
+    kind = media_kind(mime)
+    if kind == "image":
+        return prepare_image(data, model_id)
+    if kind == "audio":
+        return prepare_audio(data, model_id)
+    return data, mime or "application/octet-stream"
@@ -2,11 +2,15 @@
 import sys
 import os
 import json
+import time
+import random
+import asyncio
+import httpx
 import requests
-import subprocess
 from tabulate import tabulate  # Add tabulate dependency
+from media import MEDIA_REF_PREFIX, detect_mime, media_hash, media_kind, prepare_media, to_data_url
 
-API_URL = "http://localhost:1009"
+API_URL = os.environ.get("POLARIS_API_URL", "http://localhost:1009")  # a server, or a coordinator
 
 def load_models_from_file():
     """Load models from the config file"""
@@ -17,83 +21,55 @@ def load_models_from_file():
         print(f"Error loading models: {e}")
         return {}
 
-def list_models():
+def print_model_family(family_name, family_models):
+    """Print one family's models as a table"""
+    print(f"{family_name} Family:")
+
+    headers = ["Name", "Type", "Parameters", "Model ID"]
+    table_data = []
+
+    for model in family_models:
+        name = model.get('name', 'Unknown')
+        model_id = model.get('model_id', 'Unknown')
+        params = model.get('parameters', 'Unknown')
+        model_type = model.get('type', 'Unknown')
+        table_data.append([name, model_type, params, model_id])
+
+    print(tabulate(table_data, headers=headers, tablefmt="pretty"))
+    print()
+
+def list_models(model_type=None, family=None):
     """List all available models with detailed formatting"""
     try:
-        # First try to get models from API
-        response = requests.get(f"{API_URL}/models")
+        # The API groups and filters models by family server-side
+        params = {}
+        if model_type:
+            params["type"] = model_type
+        if family:
+            params["family"] = family
+        response = requests.get(f"{API_URL}/models/families", params=params)
         response.raise_for_status()
-        models = response.json()
-        
-        # Group models by family and type
-        multimodal_families = {}
-        text_families = {}
-        
-        # Try to load family information
-        try:
-            config = load_models_from_file()
-            # Add family information if available
-            models = add_family_info(models, config)
-        except Exception as e:
-            # Continue without family grouping if config can't be loaded
-            pass
-        
-        # Group models by family and type
-        for model in models:
-            family_raw = model.get('family', model.get('category', ''))
-            family = family_raw.replace('_models', '').capitalize() if family_raw else 'Other'
-            
-            # Check if model is multimodal
-            is_multimodal = model.get('is_multimodal', False)
-            
-            if is_multimodal:
-                if family not in multimodal_families:
-                    multimodal_families[family] = []
-                multimodal_families[family].append(model)
-            else:
-                if family not in text_families:
-                    text_families[family] = []
-                text_families[family].append(model)
+        families = response.json()
         
         print("\n=== Available Models ===\n")
         
+        if not families:
+            print("No models match the given filters.\n")
+            return
+
         # Display multimodal models
+        multimodal_families = [f for f in families if f.get('is_multimodal')]
         if multimodal_families:
             print("=== MULTIMODAL MODELS ===\n")
-            for family, family_models in multimodal_families.items():
-                print(f"{family} Family:")
-                
-                headers = ["Name", "Type", "Parameters", "Model ID"]
-                table_data = []
-                
-                for model in family_models:
-                    name = model.get('name', model.get('id', 'Unknown'))
-                    model_id = model.get('model_id', 'Unknown')
-                    params = model.get('parameters', 'Unknown')
-                    model_type = model.get('type', 'Unknown')
-                    table_data.append([name, model_type, params, model_id])
-                
-                print(tabulate(table_data, headers=headers, tablefmt="pretty"))
-                print()
+            for family_info in multimodal_families:
+                print_model_family(family_info['name'], family_info['models'])
         
         # Display text-only models
+        text_families = [f for f in families if not f.get('is_multimodal')]
         if text_families:
             print("=== TEXT-ONLY MODELS ===\n")
-            for family, family_models in text_families.items():
-                print(f"{family} Family:")
-                
-                headers = ["Name", "Type", "Parameters", "Model ID"]
-                table_data = []
-                
-                for model in family_models:
-                    name = model.get('name', model.get('id', 'Unknown'))
-                    model_id = model.get('model_id', 'Unknown')
-                    params = model.get('parameters', 'Unknown')
-                    model_type = model.get('type', 'Unknown')
-                    table_data.append([name, model_type, params, model_id])
-                
-                print(tabulate(table_data, headers=headers, tablefmt="pretty"))
-                print()
+            for family_info in text_families:
+                print_model_family(family_info['name'], family_info['models'])
                 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -106,27 +82,6 @@ def list_models():
         else:
             print("No models found.")
 
-def add_family_info(models, config):
-    """Add family information to models based on config file"""
-    model_to_family = {}
-    
-    # Create mapping from model_id to family
-    for category in ['multimodal_models', 'text_only_models']:
-        if category in config:
-            for family, family_models in config[category].items():
-                for model in family_models:
-                    model_id = model.get('model_id')
-                    if model_id:
-                        model_to_family[model_id] = family
-    
-    # Add family info to each model
-    for model in models:
-        model_id = model.get('model_id')
-        if model_id in model_to_family:
-            model['family'] = model_to_family[model_id]
-    
-    return models
-
 def display_models_from_config(config):
     """Display models directly from config file with proper organization"""
     print("\n=== Available Models ===\n")
@@ -137,22 +92,7 @@ def display_models_from_config(config):
         for family, models in config['multimodal_models'].items():
             if not models:  # Skip empty families
                 continue
-                
-            family_name = family.replace('_models', '').capitalize()
-            print(f"{family_name} Family:")
-            
-            headers = ["Name", "Type", "Parameters", "Model ID"]
-            table_data = []
-            
-            for model in models:
-                name = model.get('name', 'Unknown')
-                model_id = model.get('model_id', 'Unknown')
-                params = model.get('parameters', 'Unknown')
-                model_type = model.get('type', 'Unknown')
-                table_data.append([name, model_type, params, model_id])
-            
-            print(tabulate(table_data, headers=headers, tablefmt="pretty"))
-            print()
+            print_model_family(family.replace('_models', '').capitalize(), models)
     
     # Process text-only models
     if 'text_only_models' in config:
@@ -160,35 +100,50 @@ def display_models_from_config(config):
         for family, models in config['text_only_models'].items():
             if not models:  # Skip empty families
                 continue
-                
-            family_name = family.replace('_models', '').capitalize()
-            print(f"{family_name} Family:")
-            
-            headers = ["Name", "Type", "Parameters", "Model ID"]
-            table_data = []
-            
-            for model in models:
-                name = model.get('name', 'Unknown')
-                model_id = model.get('model_id', 'Unknown')
-                params = model.get('parameters', 'Unknown')
-                model_type = model.get('type', 'Unknown')
-                table_data.append([name, model_type, params, model_id])
-            
-            print(tabulate(table_data, headers=headers, tablefmt="pretty"))
-            print()
+            print_model_family(family.replace('_models', '').capitalize(), models)
 
-def deploy_model(model_id, gpu_id=0, max_model_len=None, port=None, isolate_env=True):
+def wait_for_deployment(model_id, timeout=1800):
+    """Long-poll the API until a deployment is ready or has failed"""
+    deadline = time.time() + timeout
+    deployment = {}
+    while time.time() < deadline:
+        response = requests.get(
+            f"{API_URL}/deployments/{model_id}",
+            params={"wait_until_ready": "true", "timeout": min(300, max(1, deadline - time.time()))},
+            timeout=330
+        )
+        response.raise_for_status()
+        deployment = response.json()
+        if deployment.get("settled"):
+            break
+        print(f"  ... {deployment.get('status')}")
+    return deployment
+
+def deploy_model(model_id, gpu_id=0, max_model_len=None, port=None, isolate_env=True, wait=False, replicas=1,
+                 tensor_parallel_size=1, queue=False, idle_timeout=None, always_warm=False,
+                 max_in_flight=None, node=None):
     """Deploy a model"""
     try:
         payload = {
             "model_id": model_id,
-            "gpu_id": int(gpu_id),
-            "isolate_env": bool(isolate_env)
+            "gpu_id": gpu_id if gpu_id == "auto" else int(gpu_id),
+            "isolate_env": bool(isolate_env),
+            "replicas": int(replicas),
+            "tensor_parallel_size": int(tensor_parallel_size),
+            "on_no_capacity": "queue" if queue else "reject"
         }
         if max_model_len:
             payload["max_model_len"] = int(max_model_len)
         if port:
             payload["port"] = int(port)
+        if idle_timeout is not None:
+            payload["idle_timeout"] = float(idle_timeout)
+        if always_warm:
+            payload["always_warm"] = True
+        if max_in_flight is not None:
+            payload["max_in_flight"] = int(max_in_flight)
+        if node:
+            payload["node"] = node
         
         response = requests.post(f"{API_URL}/deploy", json=payload)
         response.raise_for_status()
@@ -196,9 +151,29 @@ def deploy_model(model_id, gpu_id=0, max_model_len=None, port=None, isolate_env=
         
         if result["status"] == "already_deployed":
             print(f"Model {model_id} is already deployed on port {result['port']}")
+        elif result["status"] == "queued":
+            print(f"No GPU capacity for {model_id} right now; queued on port {result['port']}")
+            print("Check status with: polarisLLM list deployments")
         else:
             print(f"Deploying {model_id} on port {result['port']}...")
             print(f"Check logs with: polarisLLM logs {model_id}")
+        if len(result.get("replicas", [])) > 1 or result.get("node_id"):
+            for replica in result["replicas"]:
+                gpus = ",".join(str(gpu) for gpu in replica.get("gpu_ids") or []) or "pending"
+                node_info = f"node {replica['node_id']}, " if replica.get("node_id") else ""
+                print(f"  Replica {replica['replica_id']}: {node_info}port {replica['port']}, GPU {gpus} "
+                      f"({replica['status']})")
+        if result.get("message"):
+            print(f"Warning: {result['message']}")
+
+        if wait:
+            print(f"Waiting for {model_id} to become ready...")
+            deployment = wait_for_deployment(model_id)
+            if deployment.get("status") == "ready":
+                print(f"Model {model_id} is ready on port {deployment['port']} (time to ready: {deployment.get('time_to_ready')}s)")
+                print(f"Send requests to {API_URL}/v1/chat/completions with \"model\": \"{model_id}\"")
+            else:
+                print(f"Model {model_id} did not become ready (status: {deployment.get('status')})")
     except Exception as e:
         print(f"Error: {str(e)}")
 
@@ -215,23 +190,46 @@ def list_deployments():
             print("No active deployments found.\n")
             return
         
-        print("+---------------------------+-----------+------+-----+----------+")
-        print("| Model ID                  | Status    | Port | GPU | Type     |")
-        print("+---------------------------+-----------+------+-----+----------+")
+        # Deployments listed by a coordinator say which node they run on
+        node_width = max([len(d.get("node_id") or "") for d in deployments] + [4])
+        show_nodes = any(d.get("node_id") for d in deployments)
+        border = "+---------------------------+----+--------------+------+-----+----------+"
+        header = "| Model ID                  | #  | Status       | Port | GPU | Type     |"
+        if show_nodes:
+            border += "-" * (node_width + 2) + "+"
+            header += f" {'Node':<{node_width}} |"
+        print(border)
+        print(header)
+        print(border)
         
         for deployment in deployments:
             model_id = deployment.get("model_id", "Unknown")
             status = deployment.get("status", "Unknown")
-            port = deployment.get("port", 0)
-            gpu_id = deployment.get("gpu_id", 0)
+            port = deployment.get("port") or "-"
+            gpu_id = ",".join(str(gpu) for gpu in deployment.get("gpu_ids") or []) or "-"
             env_type = "Isolated" if deployment.get("env_path") else "System"
             
-            status_display = f"● Running" if status == "running" else status
-            print(f"| {model_id:<25} | {status_display:<9} | {port:<4} | {gpu_id:<3} | {env_type:<8} |")
+            replica_index = deployment.get("replica_index")
+            if replica_index is None:
+                replica_index = "-"
+
+            if status == "ready":
+                status_display = "● Ready"
+            elif status == "scaled_to_zero":
+                status_display = "○ Idle (0)"
+            else:
+                status_display = status
+            row = f"| {model_id:<25} | {replica_index:<2} | {status_display:<12} | {port:<4} | {gpu_id:<3} | {env_type:<8} |"
+            if show_nodes:
+                row += f" {deployment.get('node_id') or '-':<{node_width}} |"
+            print(row)
         
-        print("+---------------------------+-----------+------+-----+----------+")
+        print(border)
         
         print("\n=== Monitoring Options ===\n")
+        if any(d.get("status") == "scaled_to_zero" for d in deployments):
+            print("Idle (0) models were scaled to zero and start again on their next request.\n")
+
         print("• To view deployment logs:")
         print("  polarisLLM logs <model_id>\n")
         
@@ -245,30 +243,70 @@ def list_deployments():
     except Exception as e:
         print(f"Error: {str(e)}")
 
-def view_logs(model_id):
-    """View deployment logs for a model"""
+def list_nodes():
+    """List the nodes registered with a coordinator"""
     try:
-        # First get the deployment info to find the log file
-        response = requests.get(f"{API_URL}/deployments")
+        response = requests.get(f"{API_URL}/nodes")
+        if response.status_code == 400:
+            print(f"{API_URL} is not a coordinator (start it with POLARIS_ROLE=coordinator)")
+            return
         response.raise_for_status()
-        deployments = response.json()
+        nodes = response.json()
         
-        log_file = None
-        for deployment in deployments:
-            if deployment.get("model_id") == model_id:
-                log_file = deployment.get("log_file")
-                break
+        print("\n=== Nodes ===\n")
+        if not nodes:
+            print("No nodes registered. Start agents with POLARIS_ROLE=agent POLARIS_COORDINATOR_URL=<url>.\n")
+            return
         
-        if not log_file:
+        table_data = []
+        for node in nodes:
+            free = ", ".join(f"{fraction:.0%}" for fraction in node["gpu_available_fractions"]) or "-"
+            last_seen = f"{time.time() - node['last_heartbeat']:.0f}s ago"
+            table_data.append([node["node_id"], node["url"], node["status"], node["gpus"], free,
+                               node["replicas"], ", ".join(node["models"]) or "-", last_seen])
+        print(tabulate(table_data, headers=["Node", "URL", "Status", "GPUs", "GPU free", "Replicas", "Models",
+                                            "Heartbeat"], tablefmt="grid"))
+        print()
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+def view_logs(model_id, tail=100, follow=True):
+    """View deployment logs for a model, streamed from the API server"""
+    try:
+        response = requests.get(
+            f"{API_URL}/deployments/{model_id}/logs",
+            params={"tail": tail, "follow": "true" if follow else "false"},
+            stream=follow,
+            timeout=(10, None)
+        )
+        if response.status_code == 404:
             print(f"No deployment found for model {model_id}")
             return
+        response.raise_for_status()
+
+        if not follow:
+            print(response.text, end="")
+            return
         
-        # Use tail to follow the log file
+        # Follow the server-sent events until the deployment's log is closed
         print(f"Showing logs for {model_id} (press Ctrl+C to exit):")
         try:
-            subprocess.run(["tail", "-f", log_file])
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = line[len("data: "):] if line.startswith("data: ") else line[len("data:"):]
+                    if event == "end":
+                        print(f"\nDeployment log closed (status: {data})")
+                        return
+                    print(data)
+                elif not line:
+                    event = None
         except KeyboardInterrupt:
             print("\nExiting log view")
+        finally:
+            response.close()
     except Exception as e:
         print(f"Error: {str(e)}")
 
@@ -282,104 +320,806 @@ def stop_deployment(model_id):
     except Exception as e:
         print(f"Error: {str(e)}")
 
-def test_text_model(model_id):
-    """Test a text model with an interactive prompt"""
+CHAT_CHARS_PER_TOKEN = 4  # Rough estimate for text whose token count the server has not reported yet
+
+def estimate_tokens(text):
+    return len(text) // CHAT_CHARS_PER_TOKEN + 4
+
+def get_max_model_len(session, model_id):
+    """Context length the model was deployed with, or None if unknown"""
     try:
-        # Find the port
-        response = requests.get(f"{API_URL}/deployments")
-        response.raise_for_status()
-        deployments = response.json()
-        
-        port = None
-        for deployment in deployments:
-            if deployment.get("model_id") == model_id:
-                port = deployment.get("port")
+        response = session.get(f"{API_URL}/deployments/{model_id}", timeout=10)
+        if response.status_code != 200:
+            return None
+        return response.json().get("max_model_len")
+    except requests.RequestException:
+        return None
+
+def truncate_history(history, budget):
+    """Drop the oldest turns (keeping a system prompt) until the history fits in budget tokens.
+
+    Returns:
+        Number of messages dropped
+    """
+    dropped = 0
+    first = 1 if history and history[0]["role"] == "system" else 0
+    # Always keep the newest user message, even if it alone is over budget
+    while sum(m["tokens"] for m in history) > budget and len(history) - first > 1:
+        history.pop(first)
+        dropped += 1
+    return dropped
+
+def stream_chat_completion(session, model_id, messages, max_tokens):
+    """Stream one chat completion to stdout as it arrives.
+
+    Returns:
+        (reply text, usage dict or None, time to first token, total seconds)
+    """
+    data = {
+        "model": model_id,
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    }
+    if max_tokens:
+        data["max_tokens"] = max_tokens
+
+    start = time.perf_counter()
+    ttft = None
+    parts = []
+    usage = None
+    with session.post(f"{API_URL}/v1/chat/completions", json=data, stream=True, timeout=(10, None)) as response:
+        if response.status_code != 200:
+            raise RuntimeError(response.text)
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
                 break
+            chunk = json.loads(payload)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices", []):
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(text)
+                    print(text, end="", flush=True)
+    return "".join(parts), usage, ttft, time.perf_counter() - start
+
+def test_text_model(model_id, system_prompt=None, max_tokens=512, truncate=True):
+    """Chat with a text model interactively, streaming replies and printing latency after each"""
+    session = requests.Session()
+    try:
+        max_model_len = get_max_model_len(session, model_id) if truncate else None
+        history = []
+        if system_prompt:
+            history.append({"role": "system", "content": system_prompt, "tokens": estimate_tokens(system_prompt)})
+        print(f"Testing model {model_id} (Enter 'exit' to quit, '/reset' to clear the conversation)")
+        if max_model_len:
+            print(f"History is trimmed to fit max_model_len {max_model_len}")
+        print()
         
-        if not port:
-            print(f"No active deployment found for model {model_id}")
+        # Prompt tokens the server counted for the history sent last turn
+        last_prompt_tokens = None
+        while True:
+            user_input = input("User: ")
+            if user_input.lower() == "exit":
+                break
+            if user_input.strip() == "/reset":
+                history = history[:1] if history and history[0]["role"] == "system" else []
+                last_prompt_tokens = None
+                print("Conversation cleared.\n")
+                continue
+
+            history.append({"role": "user", "content": user_input, "tokens": estimate_tokens(user_input)})
+            if max_model_len:
+                dropped = truncate_history(history, max_model_len - (max_tokens or 0))
+                if dropped:
+                    last_prompt_tokens = None
+                    print(f"(dropped {dropped} earlier message(s) to fit max_model_len)")
+
+            sent_tokens = sum(m["tokens"] for m in history)
+            print("\nAssistant: ", end="", flush=True)
+            try:
+                reply, usage, ttft, total = stream_chat_completion(
+                    session, model_id, [{"role": m["role"], "content": m["content"]} for m in history], max_tokens
+                )
+            except (RuntimeError, requests.RequestException) as e:
+                history.pop()
+                print(f"\nError: {e}\n")
+                continue
+
+            completion_tokens = (usage or {}).get("completion_tokens")
+            if usage and usage.get("prompt_tokens"):
+                # Replace the estimate for this turn's message with what the server counted
+                known = sent_tokens - history[-1]["tokens"]
+                if last_prompt_tokens is not None:
+                    known = last_prompt_tokens
+                history[-1]["tokens"] = max(usage["prompt_tokens"] - known, 1)
+                last_prompt_tokens = usage["prompt_tokens"] + (completion_tokens or 0)
+            history.append({"role": "assistant", "content": reply,
+                            "tokens": completion_tokens or estimate_tokens(reply)})
+
+            readout = [f"{total:.2f} s total"]
+            if ttft is not None:
+                readout.insert(0, f"TTFT {ttft * 1000:.0f} ms")
+                if completion_tokens and completion_tokens > 1 and total > ttft:
+                    readout.insert(1, f"{(completion_tokens - 1) / (total - ttft):.1f} tokens/s")
+            if completion_tokens:
+                readout.append(f"{completion_tokens} tokens")
+            print(f"\n[{' | '.join(readout)}]\n")
+    except (KeyboardInterrupt, EOFError):
+        print()
+    except Exception as e:
+        print(f"Error: {str(e)}")
+    finally:
+        session.close()
+
+def upload_media(session, model_id, raw):
+    """Prepare media bytes for the model and upload them once, keyed by content hash.
+
+    Returns:
+        (URL to put in the message part, MIME type, prepared size in bytes)
+    """
+    data, mime = prepare_media(raw, model_id)
+    media_id = media_hash(data)
+    response = session.head(f"{API_URL}/media/{media_id}")
+    if response.status_code == 404:
+        response = session.post(f"{API_URL}/media", data=data, headers={"Content-Type": mime})
+    if response.status_code in (404, 405):
+        # Older servers without /media: send the prepared bytes inline
+        return to_data_url(data, mime), mime, len(data)
+    response.raise_for_status()
+    return f"{MEDIA_REF_PREFIX}{media_id}", mime, len(data)
+
+def test_media_model(model_id, media_path, kind):
+    """Ask an image or audio model questions about one file, uploading the file only once"""
+    session = requests.Session()
+    try:
+        if not os.path.exists(media_path):
+            print(f"{kind.capitalize()} file not found: {media_path}")
             return
         
-        print(f"Testing model {model_id} (Enter 'exit' to quit)\n")
+        with open(media_path, "rb") as f:
+            raw = f.read()
+        if media_kind(detect_mime(raw)) != kind:
+            print(f"{media_path} is not a recognized {kind} file")
+            return
+        url, mime, size = upload_media(session, model_id, raw)
+        print(f"Testing {'vision' if kind == 'image' else kind} model {model_id} with {media_path} "
+              f"({mime}, {len(raw) // 1024} KiB -> {size // 1024} KiB)")
+        print("Enter 'exit' to quit\n")
         
+        part_type = f"{kind}_url"
         while True:
-            user_input = input("User: ")
+            user_input = input(f"Prompt (ask about the {kind}): ")
             if user_input.lower() == "exit":
                 break
-                
-            data = {
-                "messages": [
-                    {"role": "user", "content": user_input}
-                ],
-                "stream": False
-            }
-            
-            response = requests.post(f"http://localhost:{port}/v1/chat/completions", json=data)
-            if response.status_code == 200:
-                result = response.json()
-                assistant_message = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-                print(f"\nAssistant: {assistant_message}\n")
-            else:
-                print(f"Error: {response.text}")
+            messages = [{"role": "user", "content": [
+                {"type": "text", "text": user_input},
+                {"type": part_type, part_type: {"url": url}}
+            ]}]
+            print("\nAssistant: ", end="", flush=True)
+            try:
+                _, usage, ttft, total = stream_chat_completion(session, model_id, messages, None)
+            except (RuntimeError, requests.RequestException) as e:
+                print(f"\nError: {e}\n")
+                continue
+            readout = [f"{total:.2f} s total"]
+            if ttft is not None:
+                readout.insert(0, f"TTFT {ttft * 1000:.0f} ms")
+            if usage and usage.get("prompt_tokens"):
+                readout.append(f"{usage['prompt_tokens']} prompt tokens")
+            print(f"\n[{' | '.join(readout)}]\n")
+    except (KeyboardInterrupt, EOFError):
+        print()
     except Exception as e:
         print(f"Error: {str(e)}")
+    finally:
+        session.close()
 
 def test_vision_model(model_id, image_path):
     """Test a vision model with an image"""
+    test_media_model(model_id, image_path, "image")
+
+def test_audio_model(model_id, audio_path):
+    """Test an audio model with an audio file"""
+    test_media_model(model_id, audio_path, "audio")
+
+def warm_metadata(model_ids=None, refresh=False):
+    """Pre-populate the server's model metadata cache"""
     try:
-        # Find the port
-        response = requests.get(f"{API_URL}/deployments")
+        payload = {"model_ids": model_ids or None, "refresh": refresh}
+        print("Warming model metadata cache (this may take a while)...")
+        response = requests.post(f"{API_URL}/metadata/warm", json=payload)
         response.raise_for_status()
-        deployments = response.json()
+        result = response.json()
         
-        port = None
-        for deployment in deployments:
-            if deployment.get("model_id") == model_id:
-                port = deployment.get("port")
+        print(f"Already cached: {result['cached']}, fetched: {result['fetched']}, failed: {len(result['failed'])}")
+        for model_id, error in result["failed"].items():
+            print(f"  {model_id}: {error}")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+def prebuild_envs(model_ids=None, download=True, workers=None):
+    """Fill the server's wheelhouse and build every catalog environment ahead of deploys"""
+    try:
+        payload = {"model_ids": model_ids or None, "download": download}
+        if workers:
+            payload["workers"] = int(workers)
+        print("Prebuilding model environments (this may take a while)...")
+        response = requests.post(f"{API_URL}/envs/prebuild", json=payload)
+        response.raise_for_status()
+        result = response.json()
+
+        print(f"Builder: {result['builder']}, wheelhouse: {result['wheelhouse']}")
+        table_data = [[b["requires"], b["env_path"], b["downloaded"], f"{b['seconds']}s"] for b in result["built"]]
+        print(tabulate(table_data, headers=["Requires", "Environment", "Downloaded", "Time"], tablefmt="pretty"))
+        for requires, error in result["failed"].items():
+            print(f"  Failed {requires}: {error}")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+def format_bytes(size):
+    """Human-readable byte count"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def prefetch_models(model_ids, wait=True):
+    """Download model weights into the server's cache ahead of deploys"""
+    try:
+        response = requests.post(f"{API_URL}/prefetch", json={"model_ids": model_ids})
+        response.raise_for_status()
+        print(f"Prefetching {len(model_ids)} model(s)...")
+        if not wait:
+            print("Check progress with: polarisLLM prefetch --status")
+            return
+
+        # Poll until every download has finished, printing progress as it changes
+        last_lines = {}
+        while True:
+            jobs = []
+            for model_id in model_ids:
+                response = requests.get(f"{API_URL}/prefetch/{model_id}")
+                if response.status_code == 404:
+                    # Already evicted again to stay under the cache quota
+                    jobs.append({"model_id": model_id, "status": "evicted", "bytes_done": 0, "progress": None})
+                    continue
+                response.raise_for_status()
+                jobs.append(response.json())
+            for job in jobs:
+                progress = f"{job['progress'] * 100:.0f}%" if job.get("progress") is not None else "?"
+                line = f"  {job['model_id']}: {job['status']} {progress} ({format_bytes(job['bytes_done'])})"
+                if job.get("error") and job["status"] == "failed":
+                    line += f" - {job['error']}"
+                if last_lines.get(job["model_id"]) != line:
+                    print(line)
+                    last_lines[job["model_id"]] = line
+            if all(job["status"] in ("done", "failed", "evicted") for job in jobs):
                 break
+            time.sleep(2)
+    except KeyboardInterrupt:
+        print("\nStopped watching; downloads continue on the server")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+def show_prefetch_status():
+    """Show weight downloads and the cached weights on the server"""
+    try:
+        jobs = requests.get(f"{API_URL}/prefetch").json()
+        if jobs:
+            table_data = [[j["model_id"], j["status"],
+                           f"{j['progress'] * 100:.0f}%" if j.get("progress") is not None else "?",
+                           format_bytes(j["bytes_done"])] for j in jobs]
+            print(tabulate(table_data, headers=["Model ID", "Status", "Progress", "Downloaded"], tablefmt="pretty"))
         
-        if not port:
-            print(f"No active deployment found for model {model_id}")
+        cache = requests.get(f"{API_URL}/cache/models").json()
+        print(f"\nCached weights: {format_bytes(cache['total_bytes'])} of {format_bytes(cache['max_bytes'])}")
+        table_data = [[m["model_id"], format_bytes(m["size_bytes"]),
+                       time.strftime("%Y-%m-%d %H:%M", time.localtime(m["last_used"])),
+                       "yes" if m["in_use"] else ""] for m in cache["models"]]
+        print(tabulate(table_data, headers=["Model ID", "Size", "Last used", "In use"], tablefmt="pretty"))
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+BATCH_RETRIES = 5
+BATCH_RETRY_STATUSES = (429, 502, 503)
+
+def parse_batch_line(line, model_id):
+    """Endpoint, request body and custom_id for one line of a batch input file.
+
+    A line is a request body ({"messages": ...} or {"prompt": ...}), an
+    OpenAI batch request ({"custom_id", "url", "body"}), or a bare string
+    sent as a single user message.
+    """
+    record = json.loads(line)
+    if isinstance(record, str):
+        record = {"messages": [{"role": "user", "content": record}]}
+    if not isinstance(record, dict):
+        raise ValueError("each line must be a JSON object or string")
+    body = dict(record["body"]) if isinstance(record.get("body"), dict) else dict(record)
+    custom_id = record.get("custom_id")
+    body.pop("custom_id", None)
+    url = record.get("url")
+    if not url:
+        url = "/v1/completions" if "prompt" in body and "messages" not in body else "/v1/chat/completions"
+    body["model"] = model_id
+    body["stream"] = False
+    return url, body, custom_id
+
+def load_batch_checkpoint(output_path, retry_errors=False, ordered=False):
+    """Input lines already answered in an earlier run's output file.
+
+    The output file is the checkpoint: every record carries its input line
+    number. A record cut off by an interruption is dropped, as are failed
+    ones when they are to be retried, by rewriting the file without them.
+    For ordered output only the in-order prefix before the first dropped
+    record is kept, so re-run lines are not appended out of order.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    kept = []
+    dropped = 0
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                line_number = record["line"]
+            except (ValueError, KeyError, TypeError):
+                dropped += 1
+                continue
+            if (retry_errors and "error" in record) or (ordered and (dropped or line_number < max(done, default=0))):
+                dropped += 1
+                continue
+            done.add(line_number)
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, output_path)
+    return done
+
+async def send_batch_request(client, url, body, priority):
+    """POST one batch request, retrying overload and connection errors.
+
+    Returns:
+        (response JSON, None) on success, or (None, error dict)
+    """
+    error = None
+    for attempt in range(BATCH_RETRIES + 1):
+        delay = min(2 ** attempt, 30)
+        try:
+            response = await client.post(url, json=body, headers={"X-Polaris-Priority": priority})
+        except httpx.TransportError as e:
+            error = {"message": str(e) or type(e).__name__, "type": "connection_error"}
+        else:
+            if response.status_code == 200:
+                return response.json(), None
+            try:
+                error = response.json().get("error") or response.json()
+            except ValueError:
+                error = {"message": response.text}
+            if not isinstance(error, dict):
+                error = {"message": str(error)}
+            error.setdefault("code", response.status_code)
+            if response.status_code not in BATCH_RETRY_STATUSES:
+                return None, error
+            # Back off as long as admission control asks
+            delay = float(response.headers.get("retry-after", delay))
+        if attempt < BATCH_RETRIES:
+            await asyncio.sleep(delay)
+    return None, error
+
+async def run_batch(model_id, input_path, output_path, concurrency, ordered, priority, done):
+    """Stream input lines through the gateway with at most `concurrency` requests in flight."""
+    stats = {"ok": 0, "failed": 0, "completion_tokens": 0, "total_tokens": 0}
+    resumed = len(done)
+    started = time.time()
+    slots = asyncio.Semaphore(concurrency)
+    # Ordered output: results wait here until every earlier line is written
+    reorder = {}
+    window = concurrency * 8
+    progress = asyncio.Condition()
+    state = {"next_line": 1}
+
+    def report(final=False):
+        elapsed = max(time.time() - started, 1e-6)
+        finished = stats["ok"] + stats["failed"]
+        line = (f"{finished} done ({stats['failed']} failed, {resumed} from checkpoint) | "
+                f"{finished / elapsed:.1f} req/s | {stats['completion_tokens'] / elapsed:.1f} tokens/s")
+        print(f"\r{line}", end="\n" if final else "", file=sys.stderr, flush=True)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(1)
+            report()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        def next_to_write():
+            # Lines from the checkpoint and blank lines are never written again
+            while state["next_line"] in done:
+                state["next_line"] += 1
+            return state["next_line"]
+
+        async def emit(line_number, record):
+            if not ordered:
+                write(record)
+                return
+            reorder[line_number] = record
+            async with progress:
+                while True:
+                    if next_to_write() not in reorder:
+                        break
+                    write(reorder.pop(state["next_line"]))
+                    state["next_line"] += 1
+                progress.notify_all()
+
+        async def run_one(client, line_number, line):
+            try:
+                try:
+                    url, body, custom_id = parse_batch_line(line, model_id)
+                except (ValueError, KeyError) as e:
+                    result, error, custom_id = None, {"message": f"Invalid input line: {e}", "type": "invalid_input"}, None
+                else:
+                    result, error = await send_batch_request(client, url, body, priority)
+                record = {"line": line_number, "custom_id": custom_id}
+                if error is None:
+                    record["response"] = result
+                    stats["ok"] += 1
+                    usage = result.get("usage") or {}
+                    stats["completion_tokens"] += usage.get("completion_tokens") or 0
+                    stats["total_tokens"] += usage.get("total_tokens") or 0
+                else:
+                    record["error"] = error
+                    stats["failed"] += 1
+                await emit(line_number, record)
+            finally:
+                slots.release()
+
+        reporter = asyncio.create_task(report_progress())
+        tasks = set()
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        try:
+            async with httpx.AsyncClient(base_url=API_URL, timeout=httpx.Timeout(30.0, read=None),
+                                         limits=limits) as client:
+                with open(input_path, "r", encoding="utf-8") as f:
+                    for line_number, line in enumerate(f, 1):
+                        if line_number in done:
+                            continue
+                        if not line.strip():
+                            done.add(line_number)
+                            continue
+                        await slots.acquire()
+                        if ordered:
+                            # Keep the reorder buffer bounded behind a slow early request
+                            async with progress:
+                                await progress.wait_for(lambda: line_number - next_to_write() < window)
+                        task = asyncio.create_task(run_one(client, line_number, line))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    await asyncio.gather(*tasks)
+        finally:
+            reporter.cancel()
+            for task in tasks:
+                task.cancel()
+            report(final=True)
+    return stats
+
+def batch_inference(model_id, input_path, output_path=None, concurrency=32, ordered=False, resume=True,
+                    retry_errors=False, priority="batch"):
+    """Run every request in a JSONL file against a deployed model, writing results as JSONL"""
+    try:
+        if not os.path.exists(input_path):
+            print(f"Input file not found: {input_path}")
             return
+        output_path = output_path or f"{os.path.splitext(input_path)[0]}.out.jsonl"
+        if not resume and os.path.exists(output_path):
+            os.remove(output_path)
+        done = load_batch_checkpoint(output_path, retry_errors, ordered)
+        if done:
+            print(f"Resuming: {len(done)} line(s) already in {output_path}")
+        print(f"Sending {input_path} to {model_id} with {concurrency} concurrent requests "
+              f"({'input' if ordered else 'completion'} order) -> {output_path}")
+
+        stats = asyncio.run(run_batch(model_id, input_path, output_path, concurrency, ordered, priority, done))
+        print(f"Finished: {stats['ok']} succeeded, {stats['failed']} failed, "
+              f"{stats['total_tokens']} tokens in total")
+        if stats["failed"]:
+            print("Re-run failed lines with: polarisLLM batch "
+                  f"{model_id} {input_path} -o {output_path} --retry-errors")
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume from the output file")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+BENCH_WORDS = ("the quick brown fox jumps over a lazy dog while seven wizards quietly judge "
+               "every box of mixed liquor and frozen pizza").split()
+
+def percentile(values, q):
+    """q-th percentile (0-100) with linear interpolation; None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def load_bench_prompts(model_id, prompts_path, num_requests, input_len, output_len, seed):
+    """Request bodies for a benchmark: lines of a JSONL file (cycled), or synthetic prompts"""
+    if prompts_path:
+        bodies = []
+        skipped = 0
+        with open(prompts_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if len(bodies) >= num_requests:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    url, body, _ = parse_batch_line(line, model_id)
+                except (ValueError, KeyError):
+                    skipped += 1
+                    continue
+                body.setdefault("max_tokens", output_len)
+                bodies.append((url, body))
+        if skipped:
+            print(f"Skipped {skipped} invalid line(s) in {prompts_path}")
+        if not bodies:
+            raise ValueError(f"No prompts in {prompts_path}")
+        return [bodies[i % len(bodies)] for i in range(num_requests)]
+
+    rng = random.Random(seed)
+    return [("/v1/chat/completions", {
+        "model": model_id,
+        "messages": [{"role": "user", "content": " ".join(rng.choice(BENCH_WORDS) for _ in range(input_len))}],
+        "max_tokens": output_len
+    }) for _ in range(num_requests)]
+
+async def bench_request(client, url, body):
+    """Stream one request and time it.
+
+    Returns:
+        Dict with ttft, itl (inter-token gaps), e2e, output_tokens and error
+    """
+    body = {**body, "stream": True, "stream_options": {"include_usage": True}}
+    result = {"ttft": None, "itl": [], "e2e": None, "output_tokens": 0, "error": None}
+    start = time.perf_counter()
+    last_token_at = None
+    chunks = 0
+    try:
+        async with client.stream("POST", url, json=body, headers={"Cache-Control": "no-cache"}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}: {response.text[:200]}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    result["output_tokens"] = chunk["usage"].get("completion_tokens") or 0
+                for choice in chunk.get("choices", []):
+                    text = (choice.get("delta") or {}).get("content") or choice.get("text")
+                    if not text:
+                        continue
+                    now = time.perf_counter()
+                    if last_token_at is None:
+                        result["ttft"] = now - start
+                    else:
+                        result["itl"].append(now - last_token_at)
+                    last_token_at = now
+                    chunks += 1
+    except (httpx.HTTPError, ValueError) as e:
+        result["error"] = str(e) or type(e).__name__
+        return result
+    result["e2e"] = time.perf_counter() - start
+    # Servers that omit usage: count streamed chunks instead
+    result["output_tokens"] = result["output_tokens"] or chunks
+    return result
+
+def summarize_bench_level(results, duration, **level):
+    """Latency percentiles and throughput for one concurrency level or arrival rate"""
+    ok = [r for r in results if r["error"] is None]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    itls = [gap for r in ok for gap in r["itl"]]
+    e2es = [r["e2e"] for r in ok]
+    # Time per output token after the first one
+    tpots = [(r["e2e"] - r["ttft"]) / (r["output_tokens"] - 1)
+             for r in ok if r["ttft"] is not None and r["output_tokens"] > 1]
+    output_tokens = sum(r["output_tokens"] for r in ok)
+
+    def stats(values):
+        return {"mean": sum(values) / len(values) if values else None,
+                **{f"p{q}": percentile(values, q) for q in (50, 95, 99)}}
+
+    errors = [r["error"] for r in results if r["error"] is not None]
+    return {
+        **level,
+        "requests": len(results),
+        "failed": len(errors),
+        "errors": sorted(set(errors))[:5],
+        "duration_s": duration,
+        "request_throughput": len(ok) / duration if duration else None,
+        "output_tokens_per_s": output_tokens / duration if duration else None,
+        "output_tokens": output_tokens,
+        "ttft_s": stats(ttfts),
+        "tpot_s": stats(tpots),
+        "itl_s": stats(itls),
+        "e2e_s": stats(e2es)
+    }
+
+async def run_bench_level(base_url, prompts, concurrency=None, rate=None, seed=0):
+    """Closed loop: `concurrency` workers send back to back. Open loop: Poisson arrivals at `rate` req/s."""
+    limits = httpx.Limits(max_connections=max(concurrency or 0, 1000), max_keepalive_connections=concurrency or 100)
+    async with httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(30.0, read=None),
+                                 limits=limits) as client:
+        results = []
+        started = time.perf_counter()
+        if rate is None:
+            queue = list(reversed(prompts))
             
-        # Check if image exists
-        if not os.path.exists(image_path):
-            print(f"Image file not found: {image_path}")
+            async def worker():
+                while queue:
+                    url, body = queue.pop()
+                    results.append(await bench_request(client, url, body))
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        else:
+            rng = random.Random(seed)
+            tasks = []
+            for url, body in prompts:
+                tasks.append(asyncio.create_task(bench_request(client, url, body)))
+                await asyncio.sleep(rng.expovariate(rate))
+            results = await asyncio.gather(*tasks)
+        return results, time.perf_counter() - started
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+def format_rate(rate):
+    return "-" if rate is None else f"{rate:.1f}"
+
+def bench_model(model_id, mode="closed", levels=None, num_requests=100, prompts_path=None, input_len=128,
+                output_len=128, base_url=None, output_path=None, seed=0, warmup=2):
+    """Load-test a deployed model and report TTFT, TPOT, ITL, end-to-end latency and throughput"""
+    try:
+        base_url = base_url or API_URL
+        if mode not in ("closed", "open"):
+            print("Mode must be 'closed' (fixed concurrency) or 'open' (Poisson arrival rate)")
             return
+        levels = levels or ([1, 4, 16] if mode == "closed" else [1.0, 4.0, 16.0])
+        prompts = load_bench_prompts(model_id, prompts_path, num_requests, input_len, output_len, seed)
+        source = prompts_path or f"synthetic, {input_len} words in / {output_len} tokens out"
+        print(f"Benchmarking {model_id} at {base_url} ({mode} loop, {num_requests} requests per level, {source})")
         
-        print(f"Testing vision model {model_id} with image {image_path}\n")
-        
-        user_input = input("Prompt (describe what you want to know about the image): ")
-        
-        # Encode image as base64
-        import base64
-        with open(image_path, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
-        
-        # Create message with image
-        data = {
-            "messages": [
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": user_input},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"}
-                        }
-                    ]
-                }
-            ],
-            "stream": False
+        if warmup:
+            asyncio.run(run_bench_level(base_url, prompts[:warmup], concurrency=warmup))
+
+        summaries = []
+        for level in levels:
+            if mode == "closed":
+                results, duration = asyncio.run(run_bench_level(base_url, prompts, concurrency=int(level)))
+                summary = summarize_bench_level(results, duration, concurrency=int(level))
+            else:
+                results, duration = asyncio.run(run_bench_level(base_url, prompts, rate=float(level), seed=seed))
+                summary = summarize_bench_level(results, duration, rate=float(level))
+            summaries.append(summary)
+            label = f"concurrency {int(level)}" if mode == "closed" else f"{float(level)} req/s"
+            print(f"  {label}: {summary['requests'] - summary['failed']}/{summary['requests']} ok in "
+                  f"{duration:.1f}s, {format_rate(summary['output_tokens_per_s'])} output tokens/s")
+            for error in summary["errors"]:
+                print(f"    error: {error}")
+
+        headers = ["Concurrency" if mode == "closed" else "Rate (req/s)", "Req/s", "Out tok/s",
+                   "TTFT p50", "TTFT p99", "TPOT p50", "ITL p95", "E2E p50", "E2E p95", "E2E p99"]
+        table_data = [[s.get("concurrency", s.get("rate")), f"{s['request_throughput']:.2f}",
+                       format_rate(s["output_tokens_per_s"]),
+                       format_ms(s["ttft_s"]["p50"]), format_ms(s["ttft_s"]["p99"]),
+                       format_ms(s["tpot_s"]["p50"]), format_ms(s["itl_s"]["p95"]), format_ms(s["e2e_s"]["p50"]),
+                       format_ms(s["e2e_s"]["p95"]), format_ms(s["e2e_s"]["p99"])] for s in summaries]
+        print("\nLatencies in ms\n")
+        print(tabulate(table_data, headers=headers, tablefmt="pretty"))
+
+        output_path = output_path or f"bench_{model_id.replace('/', '_')}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        report = {
+            "model_id": model_id,
+            "url": base_url,
+            "mode": mode,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {"num_requests": num_requests, "prompts": prompts_path, "input_len": input_len,
+                       "output_len": output_len, "seed": seed, "warmup": warmup},
+            "levels": summaries
         }
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {output_path}")
+    except KeyboardInterrupt:
+        print("\nBenchmark interrupted")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+def phase_durations(timeline):
+    """Total seconds per top-level phase of a deploy timeline"""
+    durations = {}
+    for span in timeline["spans"]:
+        if not span.get("parent"):
+            durations[span["phase"]] = durations.get(span["phase"], 0.0) + span["duration"]
+    return durations
+
+def print_waterfall(timeline, width=40):
+    """Print a deploy timeline as a waterfall of spans"""
+    spans = timeline["spans"]
+    total = max([span["offset"] + span["duration"] for span in spans] + [timeline.get("time_to_ready") or 0, 0.001])
+
+    print(f"\n{timeline['replica_id']} ({timeline['status']}, time to ready: {timeline.get('time_to_ready') or '-'}s)\n")
+    table_data = []
+    for span in spans:
+        start = int(span["offset"] / total * width)
+        length = max(1, int(span["duration"] / total * width))
+        bar = " " * start + "#" * min(length, width - start)
+        name = f"└ {span['phase']}" if span.get("parent") else span["phase"]
+        duration = f"{span['duration']:.2f}s" + (" ..." if span.get("open") else "")
+        table_data.append([name, f"{span['offset']:.2f}s", duration, f"|{bar:<{width}}|"])
+    print(tabulate(table_data, headers=["Phase", "Start", "Duration", "Waterfall"], tablefmt="simple"))
+
+def print_timeline_comparison(timeline, history):
+    """Compare a deploy's phases with the previous and median earlier deploys"""
+    if not history:
+        print("\nNo earlier deploys of this model to compare with.")
+        return
+
+    current = phase_durations(timeline)
+    previous = phase_durations(history[0])
+    earlier = [phase_durations(t) for t in history]
+    phases = list(current) + [p for p in previous if p not in current]
+
+    table_data = []
+    for phase in phases:
+        values = sorted(d[phase] for d in earlier if phase in d)
+        median = values[len(values) // 2] if values else None
+        now = current.get(phase)
+        delta = f"{now - median:+.2f}s" if now is not None and median is not None else "-"
+        table_data.append([
+            phase,
+            f"{now:.2f}s" if now is not None else "-",
+            f"{previous[phase]:.2f}s" if phase in previous else "-",
+            f"{median:.2f}s" if median is not None else "-",
+            delta
+        ])
+    print(f"\nCompared with {len(history)} earlier deploy(s):\n")
+    print(tabulate(table_data, headers=["Phase", "This deploy", "Previous", "Median", "vs median"], tablefmt="simple"))
+
+def profile_deploy(model_id, gpu_id=0, isolate_env=True):
+    """Deploy a model (if not already running), wait for it and print its deploy timeline"""
+    try:
+        deploy_model(model_id, gpu_id, isolate_env=isolate_env, wait=True)
         
-        response = requests.post(f"http://localhost:{port}/v1/chat/completions", json=data)
-        if response.status_code == 200:
-            result = response.json()
-            assistant_message = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            print(f"\nAssistant: {assistant_message}\n")
-        else:
-            print(f"Error: {response.text}")
+        response = requests.get(f"{API_URL}/deployments/{model_id}/timeline")
+        response.raise_for_status()
+        result = response.json()
+
+        if not result["current"]:
+            print(f"Model {model_id} is not deployed; showing its last recorded deploy.")
+            print_waterfall(result["history"][0])
+            print_timeline_comparison(result["history"][0], result["history"][1:])
+            return
+        for timeline in result["current"]:
+            print_waterfall(timeline)
+        print_timeline_comparison(result["current"][0], result["history"])
     except Exception as e:
         print(f"Error: {str(e)}")
 
@@ -387,18 +1127,70 @@ def show_help():
     """Show help message"""
     print("\n=== PolarisLLM CLI Help ===\n")
     print("Available commands:")
-    print("  polarisLLM list models                       - List all available models")
+    print("  polarisLLM list models [options]             - List all available models")
+    print("    Options:")
+    print("      --type <type>                            - Only models of a type (e.g. vision)")
+    print("      --family <family>                        - Only models of a family (e.g. qwen)")
     print("  polarisLLM deploy <model_id> [options]       - Deploy a model")
     print("    Options:")
-    print("      --gpu <id>                               - GPU ID (default: 0)")
+    print("      --gpu <id|auto>                          - GPU ID, or auto placement (default: 0)")
+    print("      --tp <n>                                 - Tensor-parallel GPUs per replica")
+    print("      --queue                                  - Queue instead of failing when GPUs are full")
+    print("      --replicas <n>                           - Number of replicas, one GPU each")
     print("      --max-len <length>                       - Maximum sequence length")
     print("      --port <port>                            - Port number")
     print("      --no-isolate                             - Don't use isolated environment")
+    print("      --wait                                   - Wait until the model is ready")
+    print("      --idle-timeout <seconds>                 - Scale to zero after this long without requests")
+    print("      --always-warm                            - Never scale this model to zero")
+    print("      --max-in-flight <n>                      - Requests let through to the model at once")
+    print("      --node <node_id>                         - Coordinator only: deploy on this node")
+    print("  polarisLLM profile-deploy <model_id> [options] - Deploy and show a per-phase timing waterfall")
+    print("    Options:")
+    print("      --gpu <id|auto>                          - GPU ID, or auto placement (default: 0)")
+    print("      --no-isolate                             - Don't use isolated environment")
     print("  polarisLLM list deployments                  - List active deployments")
-    print("  polarisLLM logs <model_id>                   - View deployment logs")
-    print("  polarisLLM test text <model_id>              - Test a text model interactively")
+    print("  polarisLLM nodes                             - List nodes registered with a coordinator")
+    print("  polarisLLM logs <model_id> [options]         - View deployment logs")
+    print("    Options:")
+    print("      --tail <n>                               - Number of recent lines to show (default: 100)")
+    print("      --no-follow                              - Print recent lines and exit")
+    print("  polarisLLM test text <model_id> [options]    - Chat with a text model, streaming replies")
+    print("    Options:")
+    print("      --system <prompt>                        - System prompt for the conversation")
+    print("      --max-tokens <n>                         - Longest reply (default: 512)")
+    print("      --no-truncate                            - Keep all history even past max_model_len")
     print("  polarisLLM test vision <model_id> <img_path> - Test a vision model with an image")
-    print("  polarisLLM stop <model_id>                   - Stop a deployment")
+    print("  polarisLLM test audio <model_id> <audio_path> - Test an audio model with a WAV/MP3/FLAC file")
+    print("  polarisLLM stop <model_id>                   - Stop a deployment (all replicas)")
+    print("  polarisLLM bench <model_id> [options]        - Measure TTFT, TPOT, latency and throughput")
+    print("    Options:")
+    print("      --mode <closed|open>                     - Fixed concurrency or Poisson arrivals (default: closed)")
+    print("      --levels <a,b,...>                       - Concurrency levels, or rates in req/s for open loop")
+    print("      --requests <n>                           - Requests per level (default: 100)")
+    print("      --prompts <file.jsonl>                   - Prompts to send (default: synthetic)")
+    print("      --input-len <n> / --output-len <n>       - Synthetic prompt words / max output tokens")
+    print("      --url <base_url>                         - Target another OpenAI server, e.g. stub_server.py")
+    print("      -o <results.json>                        - Where to write the JSON results")
+    print("  polarisLLM batch <model_id> <input.jsonl>    - Run a JSONL file of requests against a model")
+    print("    Options:")
+    print("      -o <out.jsonl>                           - Output file (default: <input>.out.jsonl)")
+    print("      --concurrency <n>                        - Requests in flight at once (default: 32)")
+    print("      --ordered                                - Write results in input order")
+    print("      --retry-errors                           - Retry lines that failed in an earlier run")
+    print("      --restart                                - Ignore earlier output instead of resuming")
+    print("      --priority <interactive|batch>           - Admission priority (default: batch)")
+    print("  polarisLLM warm-metadata [model_id...]       - Cache model metadata for fast deploys")
+    print("    Options:")
+    print("      --refresh                                - Re-fetch metadata that is already cached")
+    print("  polarisLLM prefetch <model_id...>            - Download model weights ahead of deploys")
+    print("    Options:")
+    print("      --no-wait                                - Return without waiting for downloads")
+    print("      --status                                 - Show downloads and cached weights")
+    print("  polarisLLM prebuild-envs [model_id...]       - Build model environments ahead of deploys")
+    print("    Options:")
+    print("      --no-download                            - Only use wheels already in the wheelhouse")
+    print("      --workers <n>                            - Environments to build in parallel")
     print("  polarisLLM help                              - Show this help message\n")
 
 if __name__ == "__main__":
@@ -409,19 +1201,42 @@ if __name__ == "__main__":
     command = sys.argv[1].lower()
     
     if command == "list" and len(sys.argv) > 2 and sys.argv[2].lower() == "models":
-        list_models()
+        model_type = None
+        family = None
+
+        # Parse options
+        i = 3
+        while i < len(sys.argv):
+            if sys.argv[i] == "--type" and i+1 < len(sys.argv):
+                model_type = sys.argv[i+1]
+                i += 2
+            elif sys.argv[i] == "--family" and i+1 < len(sys.argv):
+                family = sys.argv[i+1]
+                i += 2
+            else:
+                i += 1
+
+        list_models(model_type, family)
     elif command == "deploy" and len(sys.argv) > 2:
         model_id = sys.argv[2]
         gpu_id = 0
         max_model_len = None
         port = None
         isolate_env = True
+        wait = False
+        replicas = 1
+        tensor_parallel_size = 1
+        queue = False
+        idle_timeout = None
+        always_warm = False
+        max_in_flight = None
+        node = None
         
         # Parse options
         i = 3
         while i < len(sys.argv):
             if sys.argv[i] == "--gpu" and i+1 < len(sys.argv):
-                gpu_id = int(sys.argv[i+1])
+                gpu_id = sys.argv[i+1] if sys.argv[i+1] == "auto" else int(sys.argv[i+1])
                 i += 2
             elif sys.argv[i] == "--max-len" and i+1 < len(sys.argv):
                 max_model_len = int(sys.argv[i+1])
@@ -432,23 +1247,213 @@ if __name__ == "__main__":
             elif sys.argv[i] == "--no-isolate":
                 isolate_env = False
                 i += 1
+            elif sys.argv[i] == "--wait":
+                wait = True
+                i += 1
+            elif sys.argv[i] == "--replicas" and i+1 < len(sys.argv):
+                replicas = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--tp" and i+1 < len(sys.argv):
+                tensor_parallel_size = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--queue":
+                queue = True
+                i += 1
+            elif sys.argv[i] == "--idle-timeout" and i+1 < len(sys.argv):
+                idle_timeout = float(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--always-warm":
+                always_warm = True
+                i += 1
+            elif sys.argv[i] == "--max-in-flight" and i+1 < len(sys.argv):
+                max_in_flight = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--node" and i+1 < len(sys.argv):
+                node = sys.argv[i+1]
+                i += 2
+            else:
+                i += 1
+
+        deploy_model(model_id, gpu_id, max_model_len, port, isolate_env, wait, replicas,
+                     tensor_parallel_size, queue, idle_timeout, always_warm, max_in_flight, node)
+    elif command == "profile-deploy" and len(sys.argv) > 2:
+        gpu_id = 0
+        isolate_env = True
+
+        # Parse options
+        i = 3
+        while i < len(sys.argv):
+            if sys.argv[i] == "--gpu" and i+1 < len(sys.argv):
+                gpu_id = sys.argv[i+1] if sys.argv[i+1] == "auto" else int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--no-isolate":
+                isolate_env = False
+                i += 1
             else:
                 i += 1
         
-        deploy_model(model_id, gpu_id, max_model_len, port, isolate_env)
+        profile_deploy(sys.argv[2], gpu_id, isolate_env)
     elif command == "list" and len(sys.argv) > 2 and sys.argv[2].lower() == "deployments":
         list_deployments()
+    elif command == "nodes":
+        list_nodes()
     elif command == "logs" and len(sys.argv) > 2:
-        view_logs(sys.argv[2])
+        tail = 100
+        follow = True
+
+        # Parse options
+        i = 3
+        while i < len(sys.argv):
+            if sys.argv[i] == "--tail" and i+1 < len(sys.argv):
+                tail = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--no-follow":
+                follow = False
+                i += 1
+            else:
+                i += 1
+
+        view_logs(sys.argv[2], tail, follow)
     elif command == "stop" and len(sys.argv) > 2:
         stop_deployment(sys.argv[2])
+    elif command == "bench" and len(sys.argv) > 2:
+        mode = "closed"
+        levels = None
+        num_requests = 100
+        prompts_path = None
+        input_len = 128
+        output_len = 128
+        base_url = None
+        output_path = None
+        seed = 0
+
+        # Parse options
+        i = 3
+        while i < len(sys.argv):
+            if sys.argv[i] == "--mode" and i+1 < len(sys.argv):
+                mode = sys.argv[i+1]
+                i += 2
+            elif sys.argv[i] in ("--levels", "--concurrency", "--rate") and i+1 < len(sys.argv):
+                levels = [float(level) for level in sys.argv[i+1].split(",")]
+                if sys.argv[i] == "--rate":
+                    mode = "open"
+                i += 2
+            elif sys.argv[i] == "--requests" and i+1 < len(sys.argv):
+                num_requests = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--prompts" and i+1 < len(sys.argv):
+                prompts_path = sys.argv[i+1]
+                i += 2
+            elif sys.argv[i] == "--input-len" and i+1 < len(sys.argv):
+                input_len = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--output-len" and i+1 < len(sys.argv):
+                output_len = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--url" and i+1 < len(sys.argv):
+                base_url = sys.argv[i+1].rstrip("/")
+                i += 2
+            elif sys.argv[i] in ("-o", "--output") and i+1 < len(sys.argv):
+                output_path = sys.argv[i+1]
+                i += 2
+            elif sys.argv[i] == "--seed" and i+1 < len(sys.argv):
+                seed = int(sys.argv[i+1])
+                i += 2
+            else:
+                i += 1
+
+        bench_model(sys.argv[2], mode, levels, num_requests, prompts_path, input_len, output_len,
+                    base_url, output_path, seed)
+    elif command == "batch" and len(sys.argv) > 3:
+        output_path = None
+        concurrency = 32
+        ordered = False
+        resume = True
+        retry_errors = False
+        priority = "batch"
+
+        # Parse options
+        i = 4
+        while i < len(sys.argv):
+            if sys.argv[i] in ("-o", "--output") and i+1 < len(sys.argv):
+                output_path = sys.argv[i+1]
+                i += 2
+            elif sys.argv[i] == "--concurrency" and i+1 < len(sys.argv):
+                concurrency = int(sys.argv[i+1])
+                i += 2
+            elif sys.argv[i] == "--ordered":
+                ordered = True
+                i += 1
+            elif sys.argv[i] == "--retry-errors":
+                retry_errors = True
+                i += 1
+            elif sys.argv[i] == "--restart":
+                resume = False
+                i += 1
+            elif sys.argv[i] == "--priority" and i+1 < len(sys.argv):
+                priority = sys.argv[i+1]
+                i += 2
+            else:
+                i += 1
+
+        batch_inference(sys.argv[2], sys.argv[3], output_path, concurrency, ordered, resume,
+                        retry_errors, priority)
     elif command == "test" and len(sys.argv) > 3:
         if sys.argv[2].lower() == "text":
-            test_text_model(sys.argv[3])
+            system_prompt = None
+            max_tokens = 512
+            truncate = True
+
+            # Parse options
+            i = 4
+            while i < len(sys.argv):
+                if sys.argv[i] == "--system" and i+1 < len(sys.argv):
+                    system_prompt = sys.argv[i+1]
+                    i += 2
+                elif sys.argv[i] == "--max-tokens" and i+1 < len(sys.argv):
+                    max_tokens = int(sys.argv[i+1])
+                    i += 2
+                elif sys.argv[i] == "--no-truncate":
+                    truncate = False
+                    i += 1
+                else:
+                    i += 1
+
+            test_text_model(sys.argv[3], system_prompt, max_tokens, truncate)
         elif sys.argv[2].lower() == "vision" and len(sys.argv) > 4:
             test_vision_model(sys.argv[3], sys.argv[4])
+        elif sys.argv[2].lower() == "audio" and len(sys.argv) > 4:
+            test_audio_model(sys.argv[3], sys.argv[4])
+        else:
+            print("Invalid test command. Use 'text', 'vision' or 'audio'.")
+    elif command == "warm-metadata":
+        args = sys.argv[2:]
+        warm_metadata([a for a in args if a != "--refresh"], "--refresh" in args)
+    elif command == "prefetch" and len(sys.argv) > 2:
+        args = sys.argv[2:]
+        if "--status" in args:
+            show_prefetch_status()
         else:
-            print("Invalid test command. Use 'text' or 'vision'.")
+            prefetch_models([a for a in args if not a.startswith("--")], "--no-wait" not in args)
+    elif command == "prebuild-envs":
+        model_ids = []
+        download = True
+        workers = None
+
+        # Parse options
+        i = 2
+        while i < len(sys.argv):
+            if sys.argv[i] == "--no-download":
+                download = False
+                i += 1
+            elif sys.argv[i] == "--workers" and i+1 < len(sys.argv):
+                workers = int(sys.argv[i+1])
+                i += 2
+            else:
+                model_ids.append(sys.argv[i])
+                i += 1
+
+        prebuild_envs(model_ids, download, workers)
     elif command == "help":
         show_help()
     else:
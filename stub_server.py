@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Stub OpenAI-compatible model server for exercising the gateway and `polarisLLM bench`
+without a GPU.
+
+Answers /v1/models, /v1/chat/completions and /v1/completions with synthetic
+tokens, after a fixed time to first token and a fixed time per output token.
+
+    python stub_server.py [--port 8100] [--model stub-model] [--ttft 0.05] [--tpot 0.01]
+    polarisLLM bench stub-model --url http://localhost:8100
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Stub OpenAI Server")
+
+STUB_CONFIG = {
+    "model": "stub-model",
+    "ttft": 0.05,  # Seconds before the first token
+    "tpot": 0.01,  # Seconds between output tokens
+    "max_tokens": 64  # Output length when a request sets none
+}
+
+def count_prompt_tokens(body):
+    """Whitespace token count of the prompt, standing in for a tokenizer"""
+    if "messages" in body:
+        text = " ".join(m.get("content") if isinstance(m.get("content"), str) else json.dumps(m.get("content"))
+                        for m in body["messages"])
+    else:
+        text = str(body.get("prompt", ""))
+    return len(text.split())
+
+def stub_usage(prompt_tokens, completion_tokens):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+async def stub_completion(request: Request, chat: bool):
+    body = await request.json()
+    completion_tokens = int(body.get("max_tokens") or STUB_CONFIG["max_tokens"])
+    prompt_tokens = count_prompt_tokens(body)
+    tokens = [f"tok{i} " for i in range(completion_tokens)]
+    base = {"id": f"cmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()),
+            "model": body.get("model") or STUB_CONFIG["model"]}
+
+    if not body.get("stream"):
+        await asyncio.sleep(STUB_CONFIG["ttft"] + STUB_CONFIG["tpot"] * max(completion_tokens - 1, 0))
+        text = "".join(tokens)
+        choice = {"index": 0, "message": {"role": "assistant", "content": text}} if chat else {"index": 0, "text": text}
+        choice["finish_reason"] = "length"
+        return JSONResponse({**base, "object": "chat.completion" if chat else "text_completion",
+                             "choices": [choice], "usage": stub_usage(prompt_tokens, completion_tokens)})
+
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+    def event(choices, **extra):
+        chunk = {**base, "object": "chat.completion.chunk" if chat else "text_completion", "choices": choices, **extra}
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    async def generate():
+        await asyncio.sleep(STUB_CONFIG["ttft"])
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(STUB_CONFIG["tpot"])
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            yield event([{"index": 0, "delta": delta, "finish_reason": None} if chat
+                         else {"index": 0, "text": token, "finish_reason": None}])
+        yield event([{"index": 0, "delta": {}, "finish_reason": "length"} if chat
+                     else {"index": 0, "text": "", "finish_reason": "length"}])
+        if include_usage:
+            yield event([], usage=stub_usage(prompt_tokens, completion_tokens))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": STUB_CONFIG["model"], "object": "model", "owned_by": "stub"}]}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    return await stub_completion(request, chat=True)
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    return await stub_completion(request, chat=False)
+
+if __name__ == "__main__":
+    port = 8100
+
+    # Parse options
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == "--port" and i+1 < len(sys.argv):
+            port = int(sys.argv[i+1])
+            i += 2
+        elif sys.argv[i] == "--model" and i+1 < len(sys.argv):
+            STUB_CONFIG["model"] = sys.argv[i+1]
+            i += 2
+        elif sys.argv[i] in ("--ttft", "--tpot") and i+1 < len(sys.argv):
+            STUB_CONFIG[sys.argv[i][2:]] = float(sys.argv[i+1])
+            i += 2
+        elif sys.argv[i] == "--max-tokens" and i+1 < len(sys.argv):
+            STUB_CONFIG["max_tokens"] = int(sys.argv[i+1])
+            i += 2
+        else:
+            i += 1
+
+    print(f"Stub OpenAI server for {STUB_CONFIG['model']} on port {port} "
+          f"(TTFT {STUB_CONFIG['ttft']}s, {STUB_CONFIG['tpot']}s per token)")
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="warning")
@@ -0,0 +1,120 @@
+"""Shared fixtures: the API runs in-process with the stub launcher and a fake GPU probe.
+
+The environment is set before api.py is imported, since it reads its
+configuration at import time. State, environments, media and deployment logs
+all live in a temporary directory that is also the working directory.
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+import concurrent.futures
+
+import httpx
+import pytest
+import uvicorn
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="polaris_test_")
+
+os.environ.update({
+    "POLARIS_LAUNCHER": "stub",
+    "POLARIS_GPU_PROBE": "fake",
+    "POLARIS_FAKE_GPUS": "2x24576",
+    "POLARIS_STATE_DB": os.path.join(WORK_DIR, "state", "polaris_state.db"),
+    "POLARIS_ENVS_DIR": os.path.join(WORK_DIR, "envs"),
+    "POLARIS_MEDIA_DIR": os.path.join(WORK_DIR, "media"),
+    "POLARIS_WHEELHOUSE": os.path.join(WORK_DIR, "wheelhouse"),
+    "POLARIS_METADATA_CACHE": os.path.join(WORK_DIR, "metadata"),
+    "POLARIS_MIN_PORT": "18100",
+    "POLARIS_MAX_PORT": "18119",
+    "MODELSCOPE_CACHE": os.path.join(WORK_DIR, "modelscope"),
+    "HF_HOME": os.path.join(WORK_DIR, "hf"),
+    "HF_HUB_OFFLINE": "1"
+})
+shutil.copy(os.path.join(REPO_DIR, "models_config.json"), WORK_DIR)
+os.chdir(WORK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import api  # noqa: E402
+
+TEXT_MODEL = "Qwen/Qwen2.5-7B-Instruct"
+VISION_MODEL = "Qwen/Qwen-VL-Chat"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ServerThread:
+    """Serve an ASGI app with uvicorn on a background thread, for as long as the context is open"""
+
+    def __init__(self, app):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Test server did not start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+@pytest.fixture(scope="session")
+def api_server():
+    """The API, started once per test session; every deployment is stopped afterwards"""
+    with ServerThread(api.app) as server:
+        yield server
+        with httpx.Client(base_url=server.url, timeout=30) as client:
+            for model_id in {d["model_id"] for d in client.get("/deployments").json()}:
+                client.delete(f"/deployments/{model_id}")
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+@pytest.fixture
+def client(api_server):
+    with httpx.Client(base_url=api_server.url, timeout=30) as client:
+        yield client
+
+def run_async(coro):
+    """asyncio.run() on a worker thread.
+
+    The API installs a process-wide pidfd child watcher on its loop; a loop
+    created on the main thread would take that watcher over and leave the
+    API unable to reap its model servers.
+    """
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def deploy(client, model_id, **options):
+    """Deploy a model with the stub launcher and wait until it is ready"""
+    body = {"model_id": model_id, "gpu_id": "auto", "gpu_memory_utilization": 0.3, "isolate_env": False, **options}
+    response = client.post("/deploy", json=body)
+    assert response.status_code == 200, response.text
+    ready = client.get(f"/deployments/{model_id}", params={"wait_until_ready": "true", "timeout": 30})
+    assert ready.json()["status"] == "ready", ready.text
+    return response.json()
+
+@pytest.fixture
+def deployed(client):
+    """Factory that deploys models for one test and stops them when it ends"""
+    model_ids = []
+
+    def deploy_model(model_id, **options):
+        model_ids.append(model_id)
+        return deploy(client, model_id, **options)
+
+    yield deploy_model
+    for model_id in model_ids:
+        client.delete(f"/deployments/{model_id}")
@@ -0,0 +1,38 @@
+"""The CLI's streaming chat client and history trimming, against a stub deployment"""
+import requests
+
+import polarisLLM
+from conftest import TEXT_MODEL
+
+def test_stream_chat_completion(api_server, deployed, monkeypatch, capsys):
+    deployed(TEXT_MODEL, max_model_len=1024)
+    monkeypatch.setattr(polarisLLM, "API_URL", api_server.url)
+    with requests.Session() as session:
+        messages = [{"role": "user", "content": "hello there"}]
+        reply, usage, ttft, total = polarisLLM.stream_chat_completion(session, TEXT_MODEL, messages, 6)
+        assert polarisLLM.get_max_model_len(session, TEXT_MODEL) == 1024
+    assert reply and capsys.readouterr().out.endswith(reply)
+    assert usage["completion_tokens"] == 6 and usage["prompt_tokens"] > 0
+    assert 0 < ttft <= total
+
+def test_text_model_session(api_server, deployed, monkeypatch, capsys):
+    deployed(TEXT_MODEL)
+    monkeypatch.setattr(polarisLLM, "API_URL", api_server.url)
+    prompts = iter(["first question", "second question", "/reset", "third question", "exit"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(prompts))
+    polarisLLM.test_text_model(TEXT_MODEL, system_prompt="Be brief", max_tokens=4)
+    output = capsys.readouterr().out
+    assert "Error" not in output
+    assert output.count("TTFT") == 3
+    assert output.count("4 tokens]") == 3
+
+def test_truncate_history_keeps_system_prompt_and_newest_turn():
+    history = [
+        {"role": "system", "content": "s", "tokens": 10},
+        {"role": "user", "content": "a", "tokens": 50},
+        {"role": "assistant", "content": "b", "tokens": 50},
+        {"role": "user", "content": "c", "tokens": 200},
+    ]
+    assert polarisLLM.truncate_history(history, 100) == 2
+    assert [m["content"] for m in history] == ["s", "c"]
+    assert polarisLLM.truncate_history(history, 1000) == 0
@@ -0,0 +1,81 @@
+"""Coordinator placement across agents that register through heartbeats"""
+import time
+
+import pytest
+from fastapi import FastAPI
+
+import api
+from conftest import ServerThread, TEXT_MODEL
+
+class FakeAgent:
+    """An agent API that reports fixed GPUs and records the deploys it is sent"""
+
+    def __init__(self, node_id, available_fraction, deployments=()):
+        self.node_id = node_id
+        self.gpus = {"gpus": [{"index": 0, "available_fraction": available_fraction}]}
+        self.deployments = list(deployments)
+        self.deploys = []
+        self.app = FastAPI()
+        self.app.get("/gpus")(lambda: self.gpus)
+        self.app.get("/ports")(lambda: {})
+        self.app.get("/deployments")(lambda: self.deployments)
+        self.app.post("/deploy")(self.deploy)
+
+    async def deploy(self, body: dict):
+        self.deploys.append(body)
+        model_id = body["model_id"]
+        running = [entry for entry in self.deployments if entry.get("model_id") == model_id
+                   and entry.get("replica_id") and entry["status"] not in ("failed", "stopped")]
+        index = len([entry for entry in self.deployments if entry.get("replica_id")])
+        for offset in range(body["replicas"] - len(running)):
+            self.deployments.append(replica_entry(model_id, index + offset, "deploying"))
+        replicas = [api.replica_summary_entry(entry) for entry in self.deployments
+                    if entry.get("model_id") == model_id and entry.get("replica_id")]
+        return {"status": "deploying", "model_id": model_id, "deployment_command": "stub",
+                "log_file": f"deployment_{self.node_id}.log", "port": 18000, "replicas": replicas}
+
+    def heartbeat(self, url):
+        return {"node_id": self.node_id, "url": url, "gpus": self.gpus, "ports": {}, "deployments": self.deployments}
+
+def replica_entry(model_id, index, status):
+    return {"model_id": model_id, "replica_id": f"{model_id}@{index}", "status": status,
+            "port": 18000 + index, "gpu_id": 0}
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    monkeypatch.setattr(api, "NODE_ROLE", "coordinator")
+    yield
+    api.cluster_nodes.clear()
+
+def test_placement_counts_only_live_replicas(client, coordinator):
+    # One running replica, one that failed and the placeholder of a model scaled to zero
+    busy = FakeAgent("node-a", 0.4, [
+        replica_entry(TEXT_MODEL, 0, "ready"),
+        replica_entry(TEXT_MODEL, 1, "failed"),
+        {"model_id": "Qwen/Qwen2.5-0.5B-Instruct", "status": "scaled_to_zero"},
+    ])
+    idle = FakeAgent("node-b", 1.0)
+    with ServerThread(busy.app) as busy_server, ServerThread(idle.app) as idle_server:
+        for agent, server in ((busy, busy_server), (idle, idle_server)):
+            response = client.post("/nodes/heartbeat", json=agent.heartbeat(server.url))
+            assert response.status_code == 200, response.text
+
+        body = {"model_id": TEXT_MODEL, "replicas": 3, "gpu_id": "auto", "gpu_memory_utilization": 0.3}
+        response = client.post("/deploy", json=body)
+        assert response.status_code == 200, response.text
+        # The failed replica does not count: one more on each node makes three
+        assert [d["replicas"] for d in busy.deploys] == [2]
+        assert [d["replicas"] for d in idle.deploys] == [1]
+        assert len(response.json()["replicas"]) == 4  # The failed one is still reported
+
+        # node-b stops sending heartbeats
+        api.cluster_nodes["node-b"]["seen"] = time.monotonic() - api.NODE_TIMEOUT - 1
+        response = client.post("/deploy", json=body)
+        assert response.status_code == 200, response.text
+        # Its replica no longer counts, so node-a is asked for one more
+        assert [d["replicas"] for d in busy.deploys] == [2, 3]
+        assert len(idle.deploys) == 1
+        assert all(replica["node_id"] == "node-a" for replica in response.json()["replicas"])
+
+        nodes = {node["node_id"]: node["status"] for node in client.get("/nodes").json()}
+        assert nodes == {"node-a": "live", "node-b": "lost"}
@@ -0,0 +1,42 @@
+"""Concurrent deploys of one model, and the /deployments snapshot"""
+import threading
+import concurrent.futures
+
+import httpx
+
+from conftest import TEXT_MODEL
+
+def test_concurrent_deploys_start_replicas_once(api_server, client):
+    callers = 8
+    barrier = threading.Barrier(callers)
+    body = {"model_id": TEXT_MODEL, "replicas": 2, "gpu_id": "auto", "gpu_memory_utilization": 0.3,
+            "isolate_env": False}
+
+    def deploy():
+        with httpx.Client(base_url=api_server.url, timeout=30) as caller:
+            barrier.wait()
+            response = caller.post("/deploy", json=body)
+            assert response.status_code == 200, response.text
+            return response.json()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(callers) as executor:
+            results = list(executor.map(lambda _: deploy(), range(callers)))
+        statuses = sorted(result["status"] for result in results)
+        assert statuses == ["already_deployed"] * (callers - 1) + ["deploying"]
+        assert all(len(result["replicas"]) == 2 for result in results)
+        ready = client.get(f"/deployments/{TEXT_MODEL}", params={"wait_until_ready": "true", "timeout": 30})
+        assert ready.json()["status"] == "ready", ready.text
+
+        response = client.get("/deployments")
+        replicas = [entry["replica_id"] for entry in response.json() if entry["model_id"] == TEXT_MODEL]
+        assert sorted(replicas) == [f"{TEXT_MODEL}@0", f"{TEXT_MODEL}@1"]
+        etag = response.headers["etag"]
+        assert client.get("/deployments", headers={"If-None-Match": etag}).status_code == 304
+    finally:
+        client.delete(f"/deployments/{TEXT_MODEL}")
+
+    # A stop is visible to the very next request
+    response = client.get("/deployments", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert not [entry for entry in response.json() if entry["model_id"] == TEXT_MODEL]
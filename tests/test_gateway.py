@@ -0,0 +1,73 @@
+"""Deploy -> ready -> gateway -> stop, against stub model servers"""
+import json
+
+import polarisLLM
+from conftest import TEXT_MODEL, run_async
+
+def test_deploy_chat_and_stop(client, deployed):
+    result = deployed(TEXT_MODEL)
+    assert result["status"] == "deploying"
+    assert result["replica_id"] == f"{TEXT_MODEL}@0"
+
+    response = client.post("/v1/chat/completions", json={
+        "model": TEXT_MODEL,
+        "messages": [{"role": "user", "content": "hello there"}],
+        "max_tokens": 4
+    })
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["choices"][0]["message"]["content"]
+    assert body["usage"]["completion_tokens"] == 4
+
+    response = client.delete(f"/deployments/{TEXT_MODEL}")
+    assert response.json()["status"] == "stopped"
+    assert client.get(f"/deployments/{TEXT_MODEL}").status_code == 404
+
+def test_streaming_chat(client, deployed):
+    deployed(TEXT_MODEL)
+    chunks = []
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": TEXT_MODEL,
+        "messages": [{"role": "user", "content": "stream please"}],
+        "max_tokens": 5,
+        "stream": True
+    }) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for line in response.iter_lines():
+            if line.startswith("data:"):
+                chunks.append(line[len("data:"):].strip())
+    assert chunks[-1] == "[DONE]"
+    text = "".join((choice.get("delta") or {}).get("content") or ""
+                   for chunk in chunks[:-1] for choice in json.loads(chunk)["choices"])
+    assert len(text.split()) == 5
+
+def test_served_model_name_and_unknown_model(client, deployed):
+    deployed(TEXT_MODEL)
+    response = client.post("/v1/chat/completions", json={
+        "model": TEXT_MODEL.split("/")[-1],
+        "messages": [{"role": "user", "content": "hi"}],
+        "max_tokens": 1
+    })
+    assert response.status_code == 200
+    response = client.post("/v1/chat/completions", json={
+        "model": "no-such-model",
+        "messages": [{"role": "user", "content": "hi"}]
+    })
+    assert response.status_code == 404
+
+def test_bench_against_stub(client, deployed):
+    result = deployed(TEXT_MODEL)
+    prompts = polarisLLM.load_bench_prompts(TEXT_MODEL, None, num_requests=6, input_len=8, output_len=4, seed=0)
+    results, duration = run_async(polarisLLM.run_bench_level(f"http://127.0.0.1:{result['port']}", prompts,
+                                                             concurrency=3))
+    summary = polarisLLM.summarize_bench_level(results, duration, concurrency=3)
+    assert summary["failed"] == 0
+    assert summary["output_tokens"] == 6 * 4
+    assert summary["ttft_s"]["p50"] > 0
+    assert summary["tpot_s"]["p50"] is not None
+
+def test_bench_summary_without_duration():
+    summary = polarisLLM.summarize_bench_level([], 0, concurrency=1)
+    assert summary["output_tokens_per_s"] is None
+    assert polarisLLM.format_rate(summary["output_tokens_per_s"]) == "-"
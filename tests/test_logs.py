@@ -0,0 +1,77 @@
+"""Deployment log relay, rotation and the in-memory tail"""
+import os
+import sys
+import gzip
+import time
+import subprocess
+
+import api
+
+def read_all_lines(path, backup_count):
+    """Lines of every archive, oldest first, then of the live file"""
+    data = b""
+    for index in range(backup_count, 0, -1):
+        archive = f"{path}.{index}.gz"
+        if os.path.exists(archive):
+            with gzip.open(archive, "rb") as f:
+                data += f.read()
+    with open(path, "rb") as f:
+        data += f.read()
+    return data.decode().splitlines()
+
+def test_no_lines_lost_across_rotations(tmp_path):
+    path = str(tmp_path / "deployment.log")
+    total = 100000
+    tailed = []
+    log = api.DeploymentLog(path, "w", on_data=tailed.append)
+    # Polled only by this test, not also by the tail loop of the API a fixture may be running
+    api.open_deployment_logs.discard(log)
+    # A server printing numbered lines in quick bursts, into a log rotated every ~100 KB. The bursts keep
+    # rotations well apart from each other; a tail that falls far behind skips ahead by design.
+    program = (f"import sys, time\nfor i in range({total}):\n    sys.stdout.write(f'line {{i}}\\n')\n"
+               "    if i % 1000 == 999:\n        sys.stdout.flush()\n        time.sleep(0.005)")
+    writer = subprocess.Popen([sys.executable, api.LOG_RELAY_PATH, path, "100000", "1000", "--",
+                               sys.executable, "-c", program])
+    api_lines = 0
+    while writer.poll() is None:
+        # API lines are appended to the same file while the relay rotates it
+        log.write(f"api {api_lines}\n")
+        api_lines += 1
+        log.poll()
+        time.sleep(0.001)
+    assert writer.returncode == 0
+    log.close()
+
+    on_disk = read_all_lines(path, 1000)
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".gz")]) > 5
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".rotating")]
+    assert [line for line in on_disk if line.startswith("line ")] == [f"line {i}" for i in range(total)]
+    assert [line for line in on_disk if line.startswith("api ")] == [f"api {i}" for i in range(api_lines)]
+    # Following the file by name across renames read every server line too
+    seen = b"".join(tailed).decode().splitlines()
+    assert [line for line in seen if line.startswith("line ")] == [f"line {i}" for i in range(total)]
+    assert f"line {total - 1}" in log.lines
+
+def test_relay_keeps_backup_count_and_exit_code(tmp_path):
+    path = str(tmp_path / "deployment.log")
+    open(path, "wb").close()
+    code = subprocess.call([
+        sys.executable, api.LOG_RELAY_PATH, path, "1000", "2", "--",
+        # Separate flushed bursts, each larger than max bytes, so the file rotates at least once per burst
+        sys.executable, "-c", "import sys, time\nfor i in range(10):\n    print('x' * 2000, flush=True)\n"
+                              "    time.sleep(0.02)\nsys.exit(3)"
+    ])
+    assert code == 3
+    assert sorted(name for name in os.listdir(tmp_path) if name != "deployment.log") == \
+        ["deployment.log.1.gz", "deployment.log.2.gz"]
+
+def test_logs_endpoint_tail(client, deployed):
+    deployed("Qwen/Qwen2.5-7B-Instruct")
+    client.post("/v1/chat/completions", json={
+        "model": "Qwen/Qwen2.5-7B-Instruct",
+        "messages": [{"role": "user", "content": "hi"}],
+        "max_tokens": 1
+    })
+    lines = client.get("/deployments/Qwen/Qwen2.5-7B-Instruct/logs", params={"tail": 50}).text.splitlines()
+    assert "=== Deployment Output ===" in lines
+    assert any(line.startswith("Stub OpenAI server for Qwen2.5-7B-Instruct") for line in lines)
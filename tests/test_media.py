@@ -0,0 +1,77 @@
+"""Media upload, lookup and removal, and the CLI's upload path"""
+import struct
+import zlib
+
+import pytest
+import requests
+from fastapi import FastAPI
+
+import polarisLLM
+from conftest import ServerThread, VISION_MODEL
+
+def png_bytes(width=2, height=2):
+    """A valid RGB PNG, built without Pillow"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\x00" + b"\x80\x40\x20" * width for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+def test_upload_get_and_delete(client):
+    data = png_bytes()
+    response = client.post("/media", content=data, headers={"Content-Type": "image/png"})
+    assert response.status_code == 200, response.text
+    media = response.json()
+    assert media["mime_type"] == "image/png"
+    assert media["ref"] == f"media://{media['media_id']}"
+
+    assert client.head(f"/media/{media['media_id']}").status_code == 200
+    response = client.get(f"/media/{media['media_id']}")
+    assert response.content == data
+    assert response.headers["content-type"] == "image/png"
+
+    assert client.delete(f"/media/{media['media_id']}").json()["status"] == "deleted"
+    assert client.delete(f"/media/{media['media_id']}").status_code == 404
+    assert client.head(f"/media/{media['media_id']}").status_code == 404
+    assert client.delete("/media/not-a-hash").status_code == 404
+
+@pytest.mark.parametrize("params", [{}, {"model_id": VISION_MODEL}])
+def test_upload_rejects_unrecognized_bytes(client, params):
+    response = client.post("/media", params=params, content=b"plain text, not media")
+    assert response.status_code == 415
+
+def test_cli_uploads_once(api_server, monkeypatch):
+    monkeypatch.setattr(polarisLLM, "API_URL", api_server.url)
+    with requests.Session() as session:
+        url, mime, size = polarisLLM.upload_media(session, VISION_MODEL, png_bytes(3, 3))
+        assert url.startswith("media://")
+        assert mime == "image/png"
+        assert polarisLLM.upload_media(session, VISION_MODEL, png_bytes(3, 3))[0] == url
+
+def test_cli_rejects_wrong_kind_before_upload(tmp_path, monkeypatch, capsys):
+    # Nothing listens here, so any request would surface as an error
+    monkeypatch.setattr(polarisLLM, "API_URL", "http://127.0.0.1:9")
+    path = tmp_path / "notes.png"
+    path.write_bytes(b"plain text, not media")
+    polarisLLM.test_media_model(VISION_MODEL, str(path), "image")
+    output = capsys.readouterr().out
+    assert "is not a recognized image file" in output
+    assert "Error" not in output
+
+def test_cli_falls_back_inline_only_without_media_endpoint(monkeypatch):
+    old_server = FastAPI()
+    failing_server = FastAPI()
+
+    @failing_server.api_route("/media/{media_id}", methods=["HEAD"])
+    async def media_unavailable(media_id: str):
+        raise RuntimeError("store offline")
+
+    with requests.Session() as session:
+        with ServerThread(old_server) as server:
+            monkeypatch.setattr(polarisLLM, "API_URL", server.url)
+            url, mime, _ = polarisLLM.upload_media(session, VISION_MODEL, png_bytes())
+            assert url.startswith("data:image/png;base64,")
+        with ServerThread(failing_server) as server:
+            monkeypatch.setattr(polarisLLM, "API_URL", server.url)
+            with pytest.raises(requests.HTTPError):
+                polarisLLM.upload_media(session, VISION_MODEL, png_bytes())